@@ -0,0 +1,115 @@
+"""
+Loose .enc files versus one archive, for many small images.
+
+Encrypts ``--count`` small images once as loose files in a directory and
+once into an archive, then times:
+
+    write    images encrypted and stored per second
+    list     reading every name, shape and mode (a header scan of the
+             directory versus the archive's index)
+    lookup   opening the store and decrypting ``--lookups`` random images by name
+
+File system caches are warm, so the list and lookup times are a lower
+bound; on a cold cache the loose layout also pays a seek per file.
+
+Usage:
+    python benchmarks/bench_archive.py --count 10000
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from encryption.archive import Archive  # noqa: E402
+from encryption.container import iter_headers  # noqa: E402
+from encryption.decryptor import decrypt_image  # noqa: E402
+from encryption.encryptor import encrypt_image  # noqa: E402
+
+
+def _images(count: int, size: int) -> list[bytes]:
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(min(count, 16)):  # A few distinct images, reused
+        out = io.BytesIO()
+        Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)).save(out, 'PNG')
+        images.append(out.getvalue())
+    return images
+
+
+def _disk_bytes(path: str) -> int:
+    # Allocated blocks where the platform reports them, so per-file slack counts
+    st = os.stat(path)
+    return st.st_blocks * 512 if hasattr(st, 'st_blocks') else st.st_size
+
+
+def _loose(tmp: str, names: list[str], images: list[bytes], key: bytes, salt: bytes, lookups: list[str]) -> dict:
+    directory = os.path.join(tmp, 'loose')
+    os.makedirs(directory)
+    start = time.perf_counter()
+    for i, name in enumerate(names):
+        encrypt_image(io.BytesIO(images[i % len(images)]), os.path.join(directory, name + '.enc'), key, salt,
+                      verbose=False)
+    written = time.perf_counter()
+    listing = [(path, header.shape, header.mode) for path, header, _ in iter_headers(directory)]
+    listed = time.perf_counter()
+    for name in lookups:
+        decrypt_image(os.path.join(directory, name + '.enc'), io.BytesIO(), key=key, verbose=False)
+    looked_up = time.perf_counter()
+    size = sum(_disk_bytes(os.path.join(directory, name)) for name in os.listdir(directory))
+    assert len(listing) == len(names)
+    return {"write": written - start, "list": listed - written, "lookup": looked_up - listed, "bytes": size}
+
+
+def _archive(tmp: str, names: list[str], images: list[bytes], key: bytes, salt: bytes, lookups: list[str]) -> dict:
+    path = os.path.join(tmp, 'images.encpack')
+    start = time.perf_counter()
+    with Archive(path, 'a') as archive:
+        for i, name in enumerate(names):
+            archive.add(name, io.BytesIO(images[i % len(images)]), key, salt)
+    written = time.perf_counter()
+    with Archive(path) as archive:
+        listing = [(entry.name, header.shape, header.mode)
+                   for entry in archive.entries() for header in (entry.header,)]
+    listed = time.perf_counter()
+    with Archive(path) as archive:
+        for name in lookups:
+            archive.decrypt(name, io.BytesIO(), key=key)
+    looked_up = time.perf_counter()
+    assert len(listing) == len(names)
+    return {"write": written - start, "list": listed - written, "lookup": looked_up - listed,
+            "bytes": _disk_bytes(path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=2000, help="Images to store (default: 2000)")
+    parser.add_argument('--size', type=int, default=64, help="Side of each image in pixels (default: 64)")
+    parser.add_argument('--lookups', type=int, default=200, help="Random images to decrypt (default: 200)")
+    args = parser.parse_args()
+
+    key, salt = os.urandom(32), os.urandom(16)
+    images = _images(args.count, args.size)
+    names = [f"image_{i:07d}.png" for i in range(args.count)]
+    lookups = random.Random(0).choices(names, k=args.lookups)
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {"loose files": _loose(tmp, names, images, key, salt, lookups),
+                   "archive": _archive(tmp, names, images, key, salt, lookups)}
+
+    print(f"{args.count} images of {args.size}x{args.size} RGB, {args.lookups} random lookups")
+    print(f"{'layout':<12} {'write img/s':>12} {'list ms':>9} {'ms/lookup':>10} {'disk MB':>8}")
+    for layout, result in results.items():
+        print(f"{layout:<12} {args.count / result['write']:12.0f} {result['list'] * 1000:9.1f} "
+              f"{result['lookup'] * 1000 / args.lookups:10.2f} {result['bytes'] / 2**20:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
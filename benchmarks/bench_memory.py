@@ -0,0 +1,123 @@
+"""
+Peak-RSS comparison of the one-shot and streaming encrypt/decrypt paths.
+
+Each measurement runs in a fresh interpreter so ``ru_maxrss`` reflects only
+that job. The one-shot baseline reproduces the original implementation
+(``tobytes()`` + ``update() + finalize()`` + metadata concatenation). The
+``array`` and ``memmap`` jobs decrypt into a NumPy array (in memory, or a
+memory-mapped ``.npy`` file) without encoding an image; ``tiff`` streams the
+pixels into a TIFF strip by strip. The source is an uncompressed BMP, which
+the streaming encryptor decodes band by band.
+
+Usage:
+    python benchmarks/bench_memory.py --megapixels 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+WORKER = r"""
+import json, os, resource, sys, time
+sys.path.insert(0, {src!r})
+import numpy as np
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from utils.image_loader import load_image, save_image
+
+job, image_path, enc_path, out_path = sys.argv[1:5]
+key, salt = b'k' * 32, b's' * 16
+start = time.perf_counter()
+
+if job == 'oneshot-encrypt':
+    image_array, mode = load_image(image_path)
+    data = image_array.tobytes()
+    iv = os.urandom(16)
+    encryptor = Cipher(algorithms.AES(key), modes.CFB(iv)).encryptor()
+    encrypted_data = encryptor.update(data) + encryptor.finalize()
+    metadata = {{"shape": image_array.shape, "mode": mode, "iv": iv.hex(), "salt": salt.hex()}}
+    with open(enc_path, 'wb') as f:
+        f.write(json.dumps(metadata).ljust(512, ' ').encode('utf-8') + encrypted_data)
+elif job == 'oneshot-decrypt':
+    with open(enc_path, 'rb') as f:
+        file_data = f.read()
+    metadata = json.loads(file_data[:512].decode('utf-8').strip())
+    decryptor = Cipher(algorithms.AES(key), modes.CFB(bytes.fromhex(metadata['iv']))).decryptor()
+    decrypted_data = decryptor.update(file_data[512:]) + decryptor.finalize()
+    array = np.frombuffer(decrypted_data, dtype=np.uint8).reshape(tuple(metadata['shape']))
+    save_image(array, out_path, metadata['mode'])
+elif job == 'streaming-encrypt':
+    from encryption.encryptor import encrypt_image
+    encrypt_image(image_path, enc_path, key, salt)
+elif job == 'streaming-decrypt':
+    from encryption.decryptor import decrypt_image
+    decrypt_image(enc_path, out_path, key=key)
+elif job == 'tiff-decrypt':
+    from encryption.decryptor import decrypt_image
+    decrypt_image(enc_path, out_path + '.tiff', key=key)
+elif job == 'array-decrypt':
+    from encryption.decryptor import decrypt_to_array
+    decrypt_to_array(enc_path, key=key)
+elif job == 'memmap-decrypt':
+    from encryption.decryptor import decrypt_to_array
+    decrypt_to_array(enc_path, key=key, memmap_path=out_path + '.npy')
+
+elapsed = time.perf_counter() - start
+# VmHWM is tracked per address space, unlike ru_maxrss which survives exec
+# and would report the parent's footprint.
+try:
+    with open('/proc/self/status') as status:
+        peak_kb = next(int(line.split()[1]) for line in status if line.startswith('VmHWM:'))
+except OSError:
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"job": job, "seconds": elapsed, "peak_rss_mb": peak_kb / 1024}}))
+"""
+
+
+def make_image(path: str, megapixels: float):
+    """Writes an uncompressed RGB BMP so decode cost stays out of the comparison."""
+    import numpy as np
+    from PIL import Image
+
+    side = int((megapixels * 1_000_000) ** 0.5)
+    rng = np.random.default_rng(0)
+    Image.fromarray(rng.integers(0, 256, (side, side, 3), dtype=np.uint8)).save(path)
+    return side * side * 3
+
+
+def run_job(job: str, image_path: str, enc_path: str, out_path: str) -> dict:
+    code = WORKER.format(src=os.path.abspath(SRC_DIR))
+    result = subprocess.run([sys.executable, '-c', code, job, image_path, enc_path, out_path],
+                            check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megapixels', type=float, default=24)
+    args = parser.parse_args()
+
+    baseline = run_job('baseline', '', '', '')
+    print(f"Interpreter + imports: {baseline['peak_rss_mb']:.1f} MB")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_path = os.path.join(tmp, 'source.bmp')
+        out_path = os.path.join(tmp, 'decrypted.bmp')
+        payload = make_image(image_path, args.megapixels)
+        print(f"Image payload: {payload / 2**20:.1f} MB")
+
+        for job in ('oneshot-encrypt', 'streaming-encrypt', 'oneshot-decrypt', 'streaming-decrypt',
+                    'tiff-decrypt', 'array-decrypt', 'memmap-decrypt'):
+            # Each pipeline decrypts its own output format
+            enc_path = os.path.join(tmp, ('oneshot' if job.startswith('oneshot') else 'streaming') + '.enc')
+            stats = run_job(job, image_path, enc_path, out_path)
+            working_set = stats['peak_rss_mb'] - baseline['peak_rss_mb']
+            print(f"{job:<20} peak RSS {stats['peak_rss_mb']:8.1f} MB   "
+                  f"(+{working_set * 2**20 / payload:4.2f}x payload)   {stats['seconds']:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Encrypted size and encrypt/decrypt time per payload type.
+
+Compares the raw 'pixels' payload with the 'file' (original bytes) and
+'zlib' (compressed pixels) payloads over the sample images.
+
+Usage:
+    python benchmarks/bench_payload.py [IMAGE ...]
+"""
+import argparse
+import contextlib
+import glob
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from encryption.encryptor import encrypt_image  # noqa: E402
+from encryption.decryptor import decrypt_image  # noqa: E402
+
+PAYLOADS = ('pixels', 'file', 'zlib')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*')
+    args = parser.parse_args()
+    images = args.images or sorted(glob.glob(os.path.join(ROOT, 'sample_images', '*.jpg')))
+
+    key, salt = os.urandom(32), os.urandom(16)
+    totals = {payload: [0, 0.0, 0.0] for payload in PAYLOADS}
+    source_bytes = sum(os.path.getsize(path) for path in images)
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        for path in images:
+            for payload in PAYLOADS:
+                enc_path = os.path.join(tmp, f'{payload}.enc')
+                start = time.perf_counter()
+                encrypt_image(path, enc_path, key, salt, payload=payload)
+                encrypted = time.perf_counter()
+                decrypt_image(enc_path, os.path.join(tmp, f'{payload}.png'), key=key)
+                decrypted = time.perf_counter()
+                totals[payload][0] += os.path.getsize(enc_path)
+                totals[payload][1] += encrypted - start
+                totals[payload][2] += decrypted - encrypted
+
+    print(f"{len(images)} images, {source_bytes / 2**20:.1f} MB of source files")
+    print(f"{'payload':<8} {'size MB':>9} {'x source':>9} {'encrypt s':>10} {'decrypt s':>10}")
+    for payload, (size, enc_s, dec_s) in totals.items():
+        print(f"{payload:<8} {size / 2**20:9.1f} {size / source_bytes:9.2f} {enc_s:10.2f} {dec_s:10.2f}")
+
+
+if __name__ == '__main__':
+    main()
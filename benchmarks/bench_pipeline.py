@@ -0,0 +1,282 @@
+"""
+Per-stage latency, throughput and peak memory of the image crypto pipeline.
+
+Runs over synthetic images in several sizes and modes (L, RGB, RGBA, P,
+generated from a fixed seed) plus the sample images, and times each stage
+on its own:
+
+    decode      Image.open() + load()
+    convert     conversion to RGB (what load_image does)
+    tobytes     NumPy array -> bytes
+    kdf         PBKDF2 key derivation (uncached)
+    header      container header pack + parse
+    aes-cfb     in-memory AES-CFB encrypt / decrypt
+    aes-gcm     in-memory chunked AES-GCM encrypt / decrypt
+    save        save_image() PNG encoding
+    encrypt     encrypt_image() end to end, per cipher
+    decrypt     decrypt_image() end to end, per cipher
+
+Every image is measured in a fresh interpreter. Peak RSS is reset before
+each stage (Linux ``/proc/self/clear_refs``), so the reported peak belongs
+to that stage. MB/s is computed from the decoded RGB size of the image.
+Results are written as JSON. ``--compare`` prints the ratio to an earlier
+run for regression checks between commits.
+
+Usage:
+    python benchmarks/bench_pipeline.py -o bench.json
+    python benchmarks/bench_pipeline.py --sizes 1 4 --modes RGB --no-samples
+    python benchmarks/bench_pipeline.py -o new.json --compare old.json
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SRC_DIR = os.path.join(ROOT, 'src')
+
+MODES = ('L', 'RGB', 'RGBA', 'P')
+SIZES = (0.25, 1, 4)  # megapixels
+FIXED_COST_STAGES = ('kdf', 'header')  # Independent of image size: no MB/s
+
+
+def make_image(path: str, megapixels: float, mode: str, seed: int = 0):
+    """Writes a deterministic PNG: smooth gradients plus mild noise, so it compresses like a photo."""
+    import numpy as np
+    from PIL import Image
+
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1_000_000 / width)
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    channels = [x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height), 255 - y * 128 // height]
+    pixels = np.stack(channels, axis=-1) + rng.integers(0, 16, (height, width, 4))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGBA')
+    if mode == 'P':
+        image = image.convert('RGB').convert('P')
+    elif mode != 'RGBA':
+        image = image.convert(mode)
+    image.save(path)
+
+
+def _rss_kb(field: str):
+    try:
+        with open('/proc/self/status') as status:
+            return next(int(line.split()[1]) for line in status if line.startswith(field + ':'))
+    except (OSError, StopIteration):
+        return None
+
+
+def _reset_peak():
+    with contextlib.suppress(OSError):
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+
+
+def measure(image_path: str, repeat: int, tmp: str) -> dict:
+    """Times every stage for one image; runs inside the worker process."""
+    sys.path.insert(0, os.path.abspath(SRC_DIR))
+    import numpy as np
+    from PIL import Image
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from config import CHUNK_SIZE
+    from encryption.chunked import decrypt_chunks_into, encrypt_chunks, write_index
+    from encryption.container import CIPHER_AES_GCM, CIPHERS, Header, parse_header
+    from encryption.decryptor import decrypt_image
+    from encryption.encryptor import encrypt_image
+    from encryption.key_manager import KeyCache, KeyManager
+    from encryption.stream import decrypt_from_file, encrypt_to_file
+    from utils.image_loader import save_image
+
+    stages = {}
+
+    @contextlib.contextmanager
+    def stage(name: str):
+        _reset_peak()
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        entry = stages.setdefault(name, {"seconds": [], "peak_rss_kb": 0})
+        entry["seconds"].append(elapsed)
+        entry["peak_rss_kb"] = max(entry["peak_rss_kb"], _rss_kb('VmHWM') or 0)
+
+    key, salt, iv = os.urandom(32), os.urandom(16), os.urandom(16)
+    with Image.open(image_path) as probe:
+        mode, (width, height) = probe.mode, probe.size
+    nbytes = width * height * 3
+    baseline_kb = _rss_kb('VmRSS')
+
+    for _ in range(repeat):
+        with stage('decode'):
+            img = Image.open(image_path)
+            img.load()
+        with stage('convert'):
+            array = np.asarray(img.convert('RGB'))
+        img.close()
+        with stage('tobytes'):
+            data = array.tobytes()
+        with stage('kdf'):
+            KeyManager(cache=KeyCache()).generate_key_from_password('benchmark', salt)
+        header = Header(salt=salt, iv=iv, mode=mode, shape=array.shape, cipher=CIPHER_AES_GCM,
+                        chunk_size=CHUNK_SIZE)
+        with stage('header'):
+            parse_header(io.BytesIO(header.pack()))
+
+        with stage('aes-cfb encrypt'):
+            sink = io.BytesIO()
+            encrypt_to_file(Cipher(algorithms.AES(key), modes.CFB(iv)).encryptor(), [data], sink, CHUNK_SIZE)
+        out = bytearray(len(data))
+        with stage('aes-cfb decrypt'):
+            sink.seek(0)
+            decrypt_from_file(Cipher(algorithms.AES(key), modes.CFB(iv)).decryptor(), sink,
+                              memoryview(out), CHUNK_SIZE)
+        with stage('aes-gcm encrypt'):
+            sink = io.BytesIO()
+            sink.write(header.pack())
+            entries = encrypt_chunks(key, header, [data], sink)
+            header.index_offset = sink.tell()
+            write_index(sink, entries)
+        with stage('aes-gcm decrypt'):
+            decrypt_chunks_into(key, header, sink.getbuffer(), memoryview(out))
+        del sink, data, out
+
+        with stage('save'), contextlib.redirect_stdout(sys.stderr):
+            save_image(array, os.path.join(tmp, 'saved.png'), mode)
+        del array
+
+        for cipher in CIPHERS:
+            enc_path, out_path = os.path.join(tmp, 'image.enc'), os.path.join(tmp, 'image.png')
+            with contextlib.redirect_stdout(sys.stderr):
+                with stage(f'encrypt {cipher}'):
+                    encrypt_image(image_path, enc_path, key, salt, cipher=cipher)
+                with stage(f'decrypt {cipher}'):
+                    decrypt_image(enc_path, out_path, key=key)
+
+    for name, entry in stages.items():
+        seconds = entry.pop("seconds")
+        entry["median_s"] = statistics.median(seconds)
+        entry["min_s"] = min(seconds)
+        sized = name not in FIXED_COST_STAGES and entry["median_s"]
+        entry["mb_s"] = nbytes / 2**20 / entry["median_s"] if sized else None
+    return {"path": image_path, "mode": mode, "width": width, "height": height, "rgb_bytes": nbytes,
+            "file_bytes": os.path.getsize(image_path), "baseline_rss_kb": baseline_kb, "stages": stages}
+
+
+def run_worker(image_path: str, repeat: int, tmp: str) -> dict:
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', image_path,
+                             '--repeat', str(repeat), '--tmp', tmp],
+                            check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _environment() -> dict:
+    import cryptography
+    import numpy
+    import PIL
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "numpy": numpy.__version__, "pillow": PIL.__version__,
+            "cryptography": cryptography.__version__,
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+
+def summarize(images: list[dict]) -> dict:
+    """Aggregate throughput per stage over all images."""
+    total_bytes = sum(image["rgb_bytes"] for image in images)
+    summary = {}
+    for name in images[0]["stages"]:
+        seconds = sum(image["stages"][name]["median_s"] for image in images)
+        sized = name not in FIXED_COST_STAGES and seconds
+        summary[name] = {"seconds": seconds, "mb_s": total_bytes / 2**20 / seconds if sized else None,
+                         "images_s": len(images) / seconds if seconds else None,
+                         "peak_rss_kb": max(image["stages"][name]["peak_rss_kb"] for image in images)}
+    return summary
+
+
+def print_report(results: dict, baseline: dict = None):
+    for image in results["images"]:
+        print(f"{image['path']}: {image['mode']} {image['width']}x{image['height']} "
+              f"({image['rgb_bytes'] / 2**20:.1f} MB RGB)")
+    summary, old = results["summary"], {}
+    if baseline:
+        # Only images present in both runs are comparable
+        common = {image["path"] for image in baseline["images"]} & {image["path"] for image in results["images"]}
+        if common:
+            summary = summarize([image for image in results["images"] if image["path"] in common])
+            old = summarize([image for image in baseline["images"] if image["path"] in common])
+        print(f"\nComparing {len(common)} common images with {baseline['environment'].get('commit')}")
+    header = f"{'stage':<26} {'total s':>9} {'MB/s':>9} {'img/s':>8} {'peak MB':>9}"
+    print("\n" + header + ("  vs baseline" if old else ""))
+    for name, stats in summary.items():
+        mb_s = f"{stats['mb_s']:9.1f}" if stats['mb_s'] else f"{'-':>9}"
+        line = (f"{name:<26} {stats['seconds']:9.3f} {mb_s} "
+                f"{stats['images_s'] or 0:8.1f} {stats['peak_rss_kb'] / 1024:9.1f}")
+        if name in old and old[name]["seconds"]:
+            line += f"  {stats['seconds'] / old[name]['seconds']:6.2f}x time"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*', help="Extra images to include")
+    parser.add_argument('--sizes', type=float, nargs='*', default=list(SIZES), help="Synthetic sizes in megapixels")
+    parser.add_argument('--modes', nargs='*', default=list(MODES), choices=MODES)
+    parser.add_argument('--no-samples', action='store_true', help="Skip sample_images/")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per image; the median is reported")
+    parser.add_argument('-o', '--output', help="Write results as JSON")
+    parser.add_argument('--compare', help="Earlier JSON results to compare against")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--tmp', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(args.worker, args.repeat, args.tmp)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = list(args.images)
+        for megapixels in args.sizes:
+            for mode in args.modes:
+                path = os.path.join(tmp, f'synthetic_{mode}_{megapixels:g}mp.png')
+                make_image(path, megapixels, mode)
+                paths.append(path)
+        if not args.no_samples:
+            paths += sorted(glob.glob(os.path.join(ROOT, 'sample_images', '*.jpg')))
+        if not paths:
+            parser.error("No images to benchmark.")
+
+        images = []
+        for i, path in enumerate(paths, 1):
+            print(f"[{i}/{len(paths)}] {os.path.basename(path)}", file=sys.stderr)
+            images.append(run_worker(path, args.repeat, tmp))
+            # Stable names so runs can be compared
+            images[-1]["path"] = os.path.basename(path) if path.startswith(tmp) else os.path.relpath(path, ROOT)
+
+    results = {"environment": _environment(), "repeat": args.repeat, "images": images,
+               "summary": summarize(images)}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+GUI preview latency: full decode versus reduced decoding and the thumbnail caches.
+
+For each image, times a full decode plus resize (what a preview cost before
+``ui/preview.py``), a cold :func:`make_thumbnail`, a disk cache hit (a fresh
+cache over the same directory) and a memory cache hit. Without arguments a
+synthetic 50 MP JPEG is generated and the sample images are added.
+
+Usage:
+    python benchmarks/bench_preview.py [IMAGE ...]
+"""
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from config import PREVIEW_SIZE  # noqa: E402
+from ui.preview import ThumbnailCache, make_thumbnail  # noqa: E402
+
+
+def _timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def _full_decode(path: str):
+    with Image.open(path) as img:
+        img.convert('RGB').resize(PREVIEW_SIZE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images = args.images
+        if not images:
+            large = os.path.join(tmp, 'synthetic_50mp.jpg')
+            noise = np.random.default_rng(0).integers(0, 256, (96, 144, 3), dtype=np.uint8)
+            Image.fromarray(noise).resize((8660, 5774), Image.BILINEAR).save(large, quality=90)
+            images = [large] + sorted(glob.glob(os.path.join(ROOT, 'sample_images', '*.jpg')))
+
+        print(f"{'image':<24} {'pixels':>8} {'full ms':>8} {'cold ms':>8} {'disk ms':>8} {'memory ms':>10}")
+        for path in images:
+            with Image.open(path) as img:
+                megapixels = img.width * img.height / 1e6
+            cache_dir = tempfile.mkdtemp(dir=tmp)
+            full = _timed(_full_decode, path)
+            cold = _timed(make_thumbnail, path)
+            ThumbnailCache(directory=cache_dir).thumbnail(path)
+            disk = _timed(ThumbnailCache(directory=cache_dir).thumbnail, path)
+            cache = ThumbnailCache()
+            cache.thumbnail(path)
+            memory = _timed(cache.thumbnail, path)
+            print(f"{os.path.basename(path)[:24]:<24} {megapixels:7.1f}M {full:8.1f} {cold:8.1f} "
+                  f"{disk:8.2f} {memory:10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Per-image encryption versus stacks, for many small same-size images.
+
+Writes ``--counts`` small JPEG frames to a directory, then encrypts them
+once as one .enc file per image (``encrypt_image``) and once as stacks
+(``encrypt_stack``, grouped by ``plan_stacks``), and decrypts both back to
+arrays (``decrypt_to_array`` per file versus ``decrypt_stack``). Key
+derivation is excluded: both sides use one ready key.
+
+Usage:
+    python benchmarks/bench_stack.py --counts 1000 10000
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from encryption.decryptor import decrypt_to_array  # noqa: E402
+from encryption.encryptor import encrypt_image  # noqa: E402
+from encryption.stack import decrypt_stack, encrypt_stack, plan_stacks  # noqa: E402
+
+
+def _frames(directory: str, count: int, width: int, height: int) -> list[str]:
+    rng = np.random.default_rng(0)
+    encoded = []
+    for _ in range(16):  # A few distinct frames, reused
+        noise = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+        out = io.BytesIO()
+        Image.fromarray(noise).resize((width, height), Image.BILINEAR).save(out, 'JPEG', quality=90)
+        encoded.append(out.getvalue())
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"frame_{i:06d}.jpg")
+        with open(path, 'wb') as f:
+            f.write(encoded[i % len(encoded)])
+        paths.append(path)
+    return paths
+
+
+def _per_image(tmp: str, paths: list[str], key: bytes, salt: bytes, workers: int) -> dict:
+    directory = os.path.join(tmp, 'per_image')
+    os.makedirs(directory)
+    outputs = [os.path.join(directory, os.path.basename(path) + '.enc') for path in paths]
+    start = time.perf_counter()
+    for path, output in zip(paths, outputs):
+        encrypt_image(path, output, key, salt, verbose=False)
+    encrypted = time.perf_counter()
+    for output in outputs:
+        decrypt_to_array(output, key=key, workers=workers)
+    decrypted = time.perf_counter()
+    return {"encrypt": encrypted - start, "decrypt": decrypted - encrypted, "files": len(outputs)}
+
+
+def _stacked(tmp: str, paths: list[str], key: bytes, salt: bytes, workers: int) -> dict:
+    directory = os.path.join(tmp, 'stacks')
+    os.makedirs(directory)
+    start = time.perf_counter()
+    plans, _ = plan_stacks(paths)
+    outputs = []
+    for number, group in enumerate(plans):
+        output = os.path.join(directory, f"stack_{number:05d}.enc")
+        encrypt_stack(group, output, key, salt, workers=workers, verbose=False)
+        outputs.append(output)
+    encrypted = time.perf_counter()
+    frames = 0
+    for output in outputs:
+        frames += len(decrypt_stack(output, key=key, workers=workers)[0])
+    decrypted = time.perf_counter()
+    assert frames == len(paths)
+    return {"encrypt": encrypted - start, "decrypt": decrypted - encrypted, "files": len(outputs)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000],
+                        help="Frame counts to measure (default: 1000 10000)")
+    parser.add_argument('--size', default='160x120', help="Frame size WIDTHxHEIGHT (default: 160x120)")
+    parser.add_argument('--workers', type=int, default=1, help="Decoding and decryption threads (default: 1)")
+    args = parser.parse_args()
+    width, height = (int(n) for n in args.size.split('x'))
+
+    key, salt = os.urandom(32), os.urandom(16)
+    print(f"{width}x{height} RGB JPEG frames, {args.workers} worker(s)")
+    print(f"{'frames':>7} {'layout':<10} {'files':>6} {'encrypt img/s':>14} {'decrypt img/s':>14}")
+    for count in args.counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'frames')
+            os.makedirs(source)
+            paths = _frames(source, count, width, height)
+            results = {"per image": _per_image(tmp, paths, key, salt, args.workers),
+                       "stacked": _stacked(tmp, paths, key, salt, args.workers)}
+        for layout, result in results.items():
+            print(f"{count:>7} {layout:<10} {result['files']:>6} {count / result['encrypt']:14.0f} "
+                  f"{count / result['decrypt']:14.0f}")
+
+
+if __name__ == '__main__':
+    main()
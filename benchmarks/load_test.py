@@ -0,0 +1,167 @@
+"""
+Latency of the HTTP service under concurrent requests.
+
+Starts ``cli.py serve`` in a subprocess (or targets ``--url``), then has
+``--concurrency`` clients, each on its own keep-alive connection, send
+``--requests`` requests in total. Reports throughput, p50/p90/p99 latency of
+successful requests, and how many were refused with 503 because the queue was
+full (those are not retried).
+
+'encrypt' posts the image; 'decrypt' posts a container encrypted once up
+front, so it measures decryption with the derived key cached; 'roundtrip'
+alternates the two.
+
+Usage:
+    python benchmarks/load_test.py --requests 200 --concurrency 16 --workers 2 --queue 8
+    python benchmarks/load_test.py --url http://127.0.0.1:8080 --op decrypt
+"""
+import argparse
+import asyncio
+import glob
+import io
+import os
+import re
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PASSWORD = 'load-test'
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def _default_image(size: int) -> bytes:
+    samples = sorted(glob.glob(os.path.join(ROOT, 'sample_images', '*.jpg')))
+    if samples:
+        with Image.open(samples[0]) as img:
+            img = img.convert('RGB')
+            img.thumbnail((size, size))
+    else:
+        img = Image.fromarray(np.random.default_rng(0).integers(0, 256, (size, size, 3), dtype=np.uint8))
+    out = io.BytesIO()
+    img.save(out, 'PNG')
+    return out.getvalue()
+
+
+async def _request(reader, writer, host: str, path: str, body: bytes):
+    writer.write((f"POST {path} HTTP/1.1\r\nHost: {host}\r\nX-Password: {PASSWORD}\r\n"
+                  f"Content-Length: {len(body)}\r\n\r\n").encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    data = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, data, headers.get('connection') != 'close'
+
+
+async def _client(host: str, port: int, jobs: asyncio.Queue, results: list):
+    connection = None
+    while True:
+        try:
+            path, body = jobs.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        if connection is None:
+            connection = await asyncio.open_connection(host, port)
+        start = time.perf_counter()
+        try:
+            status, _, keep_alive = await _request(*connection, host, path, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            status, keep_alive = None, False
+        results.append((status, time.perf_counter() - start))
+        if not keep_alive:
+            connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+async def _run(host: str, port: int, args, image: bytes) -> tuple[list, float]:
+    reader, writer = await asyncio.open_connection(host, port)
+    status, container, _ = await _request(reader, writer, host, '/encrypt', image)
+    writer.close()
+    if status != 200:
+        raise SystemExit(f"Warm-up encrypt failed with HTTP {status}: {container[:200]!r}")
+
+    requests = {'encrypt': [('/encrypt', image)], 'decrypt': [('/decrypt', container)],
+                'roundtrip': [('/encrypt', image), ('/decrypt', container)]}[args.op]
+    jobs = asyncio.Queue()
+    for i in range(args.requests):
+        jobs.put_nowait(requests[i % len(requests)])
+    results = []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, jobs, results) for _ in range(args.concurrency)))
+    return results, time.perf_counter() - start
+
+
+def _start_server(args):
+    command = [sys.executable, os.path.join(ROOT, 'src', 'cli.py'), 'serve', '--port', '0']
+    if args.workers:
+        command += ['--workers', str(args.workers)]
+    if args.queue is not None:
+        command += ['--queue', str(args.queue)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    banner = process.stdout.readline()
+    match = re.search(r'http://([^:]+):(\d+)', banner)
+    if not match:
+        process.kill()
+        raise SystemExit(f"Server did not start: {banner!r}")
+    print(banner.strip().lstrip('✅ '))
+    return process, match.group(1), int(match.group(2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="Server to test instead of starting one")
+    parser.add_argument('--op', choices=('encrypt', 'decrypt', 'roundtrip'), default='roundtrip')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--image', help="Image to send (default: first sample image)")
+    parser.add_argument('--size', type=int, default=512, help="Longest side of the default image")
+    parser.add_argument('--workers', type=int, help="Workers of the started server")
+    parser.add_argument('--queue', type=int, help="Queue size of the started server")
+    args = parser.parse_args()
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            image = f.read()
+    else:
+        image = _default_image(args.size)
+
+    process = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        process, host, port = _start_server(args)
+    try:
+        results, seconds = asyncio.run(_run(host, port, args, image))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    latencies = [elapsed * 1000 for status, elapsed in results if status == 200]
+    busy = sum(status == 503 for status, _ in results)
+    failed = len(results) - len(latencies) - busy
+    print(f"{args.op}: {len(results)} requests, {args.concurrency} concurrent, "
+          f"{len(image) / 1024:.0f} KB image")
+    print(f"ok {len(latencies)}  busy (503) {busy}  failed {failed}  "
+          f"{len(latencies) / seconds:.1f} req/s over {seconds:.2f} s")
+    if latencies:
+        print(f"latency ms: p50 {_percentile(latencies, 50):.1f}  p90 {_percentile(latencies, 90):.1f}  "
+              f"p99 {_percentile(latencies, 99):.1f}  max {max(latencies):.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Startup-time budget check for the headless CLI.
+
+Runs ``python -X importtime`` on the CLI entry points, sums the reported
+import times and fails (exit status 1) when the total exceeds the budget or
+when a GUI module is imported.
+
+Usage:
+    python benchmarks/startup_budget.py --budget-ms 100
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+FORBIDDEN = ('tkinter', 'ttkbootstrap', 'pyperclip')
+# Heavy modules that must stay out of argument parsing and --help
+LAZY = ('numpy', 'PIL', 'cryptography')
+
+COMMANDS = (
+    ['main.py', '--help'],
+    ['cli.py', '--help'],
+    ['cli.py', 'encrypt', '--help'],
+)
+
+
+def measure(command: list[str], runs: int) -> tuple[float, set]:
+    """Returns the best total import time in ms and the set of top-level packages imported."""
+    best = None
+    packages = set()
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', *command], cwd=SRC_DIR,
+                                capture_output=True, text=True, check=True)
+        total_us = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, _, name = line[len('import time:'):].split('|')
+            total_us += int(self_us)
+            packages.add(name.strip().split('.')[0])
+        best = total_us if best is None else min(best, total_us)
+    return best / 1000, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=100)
+    parser.add_argument('--runs', type=int, default=5, help="Best-of-N runs per command")
+    args = parser.parse_args()
+
+    failed = False
+    for command in COMMANDS:
+        total_ms, packages = measure(command, args.runs)
+        problems = [f"imports {name}" for name in FORBIDDEN + LAZY if name in packages]
+        if total_ms > args.budget_ms:
+            problems.append(f"over budget ({args.budget_ms:.0f} ms)")
+        failed = failed or bool(problems)
+        status = "FAIL: " + ", ".join(problems) if problems else "ok"
+        print(f"{' '.join(command):<28} {total_ms:7.1f} ms  {status}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,504 @@
+"""
+Headless command-line interface.
+
+Only argparse and the standard library are imported at startup; each command
+imports the ``encryption``/``utils`` modules it needs when it runs, so the
+tool starts quickly and never loads Tk, ttkbootstrap or pyperclip.
+
+Usage:
+    python cli.py encrypt photo.jpg -o photo.enc
+    python cli.py decrypt photo.enc -o photo.png
+    python cli.py batch encrypt images/ encrypted_images/ --workers 8
+    python cli.py inspect encrypted_images/*.enc
+    python cli.py sidecars encrypted_images/ --dry-run
+    python cli.py rekey encrypted_images/ --workers 8
+    python cli.py archive add photos.encpack images/
+    python cli.py archive extract photos.encpack cat.jpg -o out/
+    python cli.py stack encrypt frames/ -o stacks/
+    python cli.py serve --port 8080 --workers 4
+    python cli.py calibrate --kdf scrypt --target-ms 500
+    python cli.py --metrics log --metrics json:metrics.jsonl encrypt photo.jpg
+"""
+import argparse
+import getpass
+import json
+import os
+import sys
+
+PASSWORD_ENV = 'IMAGE_ENC_PASSWORD'
+NEW_PASSWORD_ENV = 'IMAGE_ENC_NEW_PASSWORD'
+METRICS_ENV = 'IMAGE_ENC_METRICS'  # Read by utils.instrumentation.configure_from_env
+
+
+def _password(args) -> str:
+    return args.password or os.environ.get(PASSWORD_ENV) or getpass.getpass("Password: ")
+
+
+def _kdf(args):
+    from encryption.key_manager import make_kdf
+
+    params = [int(value) for value in args.kdf_params.split(',')] if args.kdf_params else None
+    return make_kdf(args.kdf, params)
+
+
+def cmd_encrypt(args) -> int:
+    from encryption.encryptor import encrypt_image
+    from encryption.key_manager import KeyManager
+
+    kdf = _kdf(args)
+    output = args.output or args.image + '.enc'
+    options = dict(payload=args.payload, cipher=args.cipher, native=not args.rgb, kdf=kdf)
+    if args.dedup:
+        from encryption.dedup import DedupIndex, encrypt_deduplicated, link_or_copy
+
+        with DedupIndex(args.dedup) as index:
+            path, reused = encrypt_deduplicated(index, args.image, output, _password(args), **options)
+        if reused:
+            if os.path.abspath(path) != os.path.abspath(output):
+                link_or_copy(path, output)
+            print(f"✅ Same content already encrypted as {path}; reused for {output}")
+        return 0
+    key, salt = KeyManager().generate_key_from_password(_password(args), kdf=kdf)
+    encrypt_image(args.image, output, key, salt, **options)
+    return 0
+
+
+def cmd_decrypt(args) -> int:
+    from encryption.decryptor import decrypt_image, decrypt_to_array
+
+    if args.npy:
+        pixels = decrypt_to_array(args.encrypted, _password(args), memmap_path=args.npy)
+        print(f"✅ Pixels decrypted to {args.npy} ({'x'.join(map(str, pixels.shape))} {pixels.dtype})")
+        return 0
+    output = args.output or os.path.splitext(args.encrypted)[0] + '.png'
+    decrypt_image(args.encrypted, output, _password(args))
+    return 0
+
+
+def cmd_batch(args) -> int:
+    from encryption.batch import encrypt_batch, decrypt_batch
+
+    options = dict(manifest=args.manifest, workers=args.workers, report_path=args.report)
+    if args.action == 'encrypt':
+        report = encrypt_batch(args.source_dir, args.output_dir, _password(args),
+                               payload=args.payload, cipher=args.cipher, native=not args.rgb,
+                               kdf=_kdf(args), dedup_index=args.dedup, **options)
+    else:
+        report = decrypt_batch(args.source_dir, args.output_dir, _password(args), **options)
+    counts = report["counts"]
+    reused = f"{counts['deduplicated']} reused, " if 'deduplicated' in counts else ''
+    print(f"✅ Batch {args.action} finished: {counts['ok']} done, {reused}"
+          f"{counts['skipped']} skipped, {counts['error']} failed")
+    return 1 if counts["error"] else 0
+
+
+def _new_password(args) -> str:
+    if args.new_password or os.environ.get(NEW_PASSWORD_ENV):
+        return args.new_password or os.environ[NEW_PASSWORD_ENV]
+    password = getpass.getpass("New password: ")
+    if getpass.getpass("Repeat new password: ") != password:
+        raise ValueError("The new passwords do not match.")
+    return password
+
+
+def cmd_rekey(args) -> int:
+    old_password, new_password = _password(args), _new_password(args)
+    if os.path.isdir(args.path):
+        from encryption.batch import rekey_batch
+
+        report = rekey_batch(args.path, old_password, new_password, output_dir=args.output,
+                             manifest=args.manifest, workers=args.workers, report_path=args.report,
+                             kdf=_kdf(args), allow_unverified=args.allow_unverified)
+        counts = report["counts"]
+        for result in report["files"]:
+            if result["status"] == "error":
+                print(f"{result['source']}: error: {result['error']}", file=sys.stderr)
+        print(f"✅ Re-keyed {counts['ok']} files in {report['groups']} salt groups: "
+              f"{counts['skipped']} skipped, {counts['error']} failed")
+        return 1 if counts["error"] else 0
+
+    from encryption.rekey import rekey_image
+
+    rekey_image(args.path, old_password, new_password, args.output, _kdf(args), args.allow_unverified)
+    print(f"✅ Re-keyed {args.output or args.path}")
+    return 0
+
+
+def cmd_inspect(args) -> int:
+    from encryption.container import iter_headers, read_header
+
+    def headers():
+        for path in args.files:
+            if os.path.isdir(path):
+                yield from iter_headers(path)
+                continue
+            try:
+                yield path, read_header(path), None
+            except (OSError, ValueError) as e:
+                yield path, None, e
+
+    status = 0
+    for path, header, error in headers():
+        if error is not None:
+            print(f"{path}: error: {error}", file=sys.stderr)
+            status = 1
+        elif args.json:
+            print(json.dumps({"path": path, **header.to_dict()}))
+        else:
+            shape = 'x'.join(str(n) for n in header.shape)
+            print(f"{path}: v{header.version} {shape} {header.mode} {header.payload} "
+                  f"{header.cipher} ({header.payload_size} payload bytes)")
+    return status
+
+
+def cmd_sidecars(args) -> int:
+    from encryption.sidecars import migrate_sidecars
+
+    report = migrate_sidecars(args.directory, remove=not args.dry_run, workers=args.workers)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for problem in report["problems"]:
+            detail = problem.get("error", problem["status"])
+            print(f"{problem['sidecar']}: {detail}", file=sys.stderr)
+        counts = report["counts"]
+        kept = counts['mismatch'] + counts['orphan'] + counts['error']
+        print(f"✅ Sidecars checked: {counts['removed']} removed, {counts['redundant']} redundant, "
+              f"{kept} kept ({counts['mismatch']} mismatched, {counts['orphan']} orphaned, "
+              f"{counts['error']} unreadable)")
+    return 1 if report["problems"] else 0
+
+
+def _archive_sources(paths: list[str]):
+    from encryption.batch import IMAGE_EXTENSIONS, collect_files
+
+    for path in paths:
+        if os.path.isdir(path):
+            for rel in collect_files(path, IMAGE_EXTENSIONS + ('.enc',)):
+                yield rel.replace(os.sep, '/'), os.path.join(path, rel)
+        else:
+            yield os.path.basename(path), path
+
+
+def cmd_archive(args) -> int:
+    from encryption.archive import Archive, compact_archive
+
+    if args.action == 'compact':
+        result = compact_archive(args.archive)
+        print(f"✅ Archive compacted: {result['entries']} images, "
+              f"{result['before']:,} -> {result['after']:,} bytes")
+        return 0
+
+    if args.action == 'list':
+        with Archive(args.archive) as archive:
+            for entry in archive.entries():
+                header = entry.header
+                if args.json:
+                    print(json.dumps({"name": entry.name, "offset": entry.offset, "length": entry.length,
+                                      **header.to_dict()}))
+                else:
+                    shape = 'x'.join(str(n) for n in header.shape)
+                    print(f"{entry.name}: {shape} {header.mode} {header.payload} {header.cipher} "
+                          f"({entry.length} bytes)")
+        return 0
+
+    if args.action == 'extract':
+        from encryption.decryptor import output_path_for
+
+        password = _password(args)
+        status = 0
+        with Archive(args.archive) as archive:
+            for name in args.names or list(archive):
+                output = os.path.join(args.output or '.', os.path.splitext(name)[0] + '.png')
+                try:
+                    output = output_path_for(output, archive.get(name).header)
+                    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+                    print(f"{name} -> {archive.decrypt(name, output, password)}")
+                except (KeyError, OSError, ValueError) as e:
+                    print(f"{name}: error: {e}", file=sys.stderr)
+                    status = 1
+        return status
+
+    with Archive(args.archive, 'a') as archive:
+        if args.action == 'remove':
+            for name in args.names:
+                archive.remove(name)
+            print(f"✅ Removed {len(args.names)} images; run 'archive compact' to reclaim the space")
+            return 0
+
+        from encryption.key_manager import KeyManager
+
+        key = salt = kdf = None
+        added = failed = 0
+        for name, path in _archive_sources(args.names):
+            if key is None and not path.endswith('.enc'):
+                # One key for the whole run, as for batch encryption
+                kdf = _kdf(args)
+                key, salt = KeyManager().generate_key_from_password(_password(args), kdf=kdf)
+            try:
+                if path.endswith('.enc'):
+                    archive.add_container(name[:-len('.enc')], path)
+                else:
+                    archive.add(name, path, key, salt, payload=args.payload, cipher=args.cipher,
+                                native=not args.rgb, kdf=kdf)
+            except (KeyError, OSError, ValueError) as e:
+                print(f"{path}: error: {e}", file=sys.stderr)
+                failed += 1
+                continue
+            added += 1
+    print(f"✅ Added {added} images to {args.archive} ({len(archive)} in total), {failed} failed")
+    return 1 if failed else 0
+
+
+def cmd_stack(args) -> int:
+    if args.action == 'encrypt':
+        from config import STACK_MAX_BYTES
+        from encryption.stack import encrypt_stacks
+
+        if args.names:
+            raise ValueError("stack encrypt takes a directory, not frame names.")
+        max_bytes = args.max_mb * 1024 * 1024 if args.max_mb else STACK_MAX_BYTES
+        report = encrypt_stacks(args.path, args.output or '.', _password(args), manifest=args.manifest,
+                                max_bytes=max_bytes, cipher=args.cipher, kdf=_kdf(args), workers=args.workers,
+                                report_path=args.report)
+        counts = report["counts"]
+        for result in report["files"]:
+            if result["status"] == "error":
+                print(f"{result['source']}: error: {result['error']}", file=sys.stderr)
+        print(f"✅ {counts['ok']} images encrypted into {len(report['stacks'])} stacks, {counts['error']} failed")
+        return 1 if counts["error"] else 0
+
+    from encryption.container import read_header
+    from encryption.stack import extract_stack, stack_layout
+
+    if args.action == 'list':
+        header = read_header(args.path)
+        height, entries = stack_layout(header)
+        for name, offset in entries:
+            if args.json:
+                print(json.dumps({"name": name, "offset": offset, "height": height, "width": header.shape[1],
+                                  "mode": header.mode}))
+            else:
+                print(f"{name}: {header.shape[1]}x{height} {header.mode} at payload byte {offset}")
+        return 0
+
+    outputs = extract_stack(args.path, args.output or '.', _password(args), names=args.names or None,
+                            workers=args.workers)
+    print(f"✅ {len(outputs)} images extracted to {args.output or '.'}")
+    return 0
+
+
+def cmd_dedup(args) -> int:
+    from encryption.dedup import DedupIndex
+
+    with DedupIndex(args.index) as index:
+        pruned = index.prune() if args.prune else None
+        stats = index.stats()
+    if args.json:
+        print(json.dumps(stats if pruned is None else {**stats, "pruned": pruned}))
+        return 0
+    if pruned is not None:
+        print(f"Pruned {pruned} entries whose encrypted file changed or vanished")
+    print(f"{stats['entries']} of {stats['max_entries']} entries, {stats['hits']} hits, {stats['misses']} misses "
+          f"(hit rate {stats['hit_rate']:.1%}), {stats['stale']} stale, {stats['evictions']} evicted")
+    return 0
+
+
+def cmd_calibrate(args) -> int:
+    from encryption.key_manager import calibrate_kdf
+
+    options = {} if args.max_memory is None else {"max_memory": args.max_memory * 1024 * 1024}
+    kdf, seconds = calibrate_kdf(args.kdf, args.target_ms / 1000, **options)
+    if args.json:
+        print(json.dumps({"kdf": kdf.name, "params": list(kdf.params), "ms": round(seconds * 1000, 1)}))
+        return 0
+    params = ','.join(str(value) for value in kdf.params if value)  # PBKDF2's unused fields are 0
+    print(f"✅ {kdf.name} {params}: {seconds * 1000:.0f} ms per key")
+    print(f"   Use --kdf {kdf.name} --kdf-params {params}, or set KDF/KDF_PARAMS in config.py")
+    return 0
+
+
+def cmd_serve(args) -> int:
+    import asyncio
+    from server import serve
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.queue))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='image-encryption',
+                                     description="Encrypt and decrypt images without the GUI.")
+    parser.add_argument('--metrics', action='append', metavar='SINK',
+                        help="Record per-stage timings: 'log', 'json:PATH' or 'prometheus:PATH' "
+                             "(repeatable; default: $IMAGE_ENC_METRICS)")
+    parser.add_argument('--profile', action='store_true', help="Attach a cProfile summary to every job")
+    parser.add_argument('--trace-memory', action='store_true', help="Record every job's peak Python heap")
+    sub = parser.add_subparsers(dest='command', required=True)
+    password_help = f"Password (defaults to ${PASSWORD_ENV}, then a prompt)"
+    payload_help = ("What to encrypt: decoded 'pixels', the original 'file' bytes, "
+                    "or 'zlib'-compressed pixels (default: pixels)")
+    payload_choices = ('pixels', 'file', 'zlib')
+    cipher_help = ("'aes-gcm-chunked' (authenticated, random access) or the original "
+                   "'aes-cfb' (default: aes-gcm-chunked)")
+    cipher_choices = ('aes-gcm-chunked', 'aes-cfb')
+    rgb_help = "Convert pixels to RGB (the original format) instead of keeping the image's own mode"
+    dedup_help = ("SQLite index of earlier outputs: images whose content was already encrypted "
+                  "with the same password and options are reused instead of re-encrypted")
+    kdf_choices = ('pbkdf2-sha256', 'scrypt')
+    kdf_help = "Key derivation function for new files (default: KDF in config.py)"
+    kdf_params_help = ("Comma-separated KDF parameters: ITERATIONS for pbkdf2-sha256, N,R,P for scrypt "
+                       "(default: the KDF's defaults; see the calibrate command)")
+
+    p = sub.add_parser('encrypt', help="Encrypt one image")
+    p.add_argument('image')
+    p.add_argument('-o', '--output', help="Output path (default: IMAGE.enc)")
+    p.add_argument('--payload', choices=payload_choices, default='pixels', help=payload_help)
+    p.add_argument('--cipher', choices=cipher_choices, default='aes-gcm-chunked', help=cipher_help)
+    p.add_argument('--rgb', action='store_true', help=rgb_help)
+    p.add_argument('--kdf', choices=kdf_choices, help=kdf_help)
+    p.add_argument('--kdf-params', metavar='LIST', help=kdf_params_help)
+    p.add_argument('--dedup', metavar='INDEX', help=dedup_help)
+    p.add_argument('--password', help=password_help)
+    p.set_defaults(func=cmd_encrypt)
+
+    p = sub.add_parser('decrypt', help="Decrypt one .enc file")
+    p.add_argument('encrypted')
+    p.add_argument('-o', '--output', help="Output path (default: ENCRYPTED without .enc, as .png)")
+    p.add_argument('--npy', metavar='PATH',
+                   help="Write the raw pixel array to a memory-mapped .npy file instead of an image")
+    p.add_argument('--password', help=password_help)
+    p.set_defaults(func=cmd_decrypt)
+
+    p = sub.add_parser('batch', help="Encrypt or decrypt a directory tree in parallel")
+    p.add_argument('action', choices=('encrypt', 'decrypt'))
+    p.add_argument('source_dir')
+    p.add_argument('output_dir')
+    p.add_argument('--manifest', help="Text file listing the files to process")
+    p.add_argument('--workers', type=int, help="Worker processes (default: CPU count)")
+    p.add_argument('--report', help="Summary report path")
+    p.add_argument('--payload', choices=payload_choices, default='pixels', help=payload_help)
+    p.add_argument('--cipher', choices=cipher_choices, default='aes-gcm-chunked', help=cipher_help)
+    p.add_argument('--rgb', action='store_true', help=rgb_help)
+    p.add_argument('--kdf', choices=kdf_choices, help=kdf_help + " (encrypt only)")
+    p.add_argument('--kdf-params', metavar='LIST', help=kdf_params_help)
+    p.add_argument('--dedup', metavar='INDEX', help=dedup_help + " (encrypt only)")
+    p.add_argument('--password', help=password_help)
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser('rekey', help="Re-encrypt .enc files under a new password without decoding them")
+    p.add_argument('path', help=".enc file, or a directory of them")
+    p.add_argument('-o', '--output', help="Write the re-keyed file (or directory tree) here instead of in place")
+    p.add_argument('--manifest', help="Text file listing the files to process (directories)")
+    p.add_argument('--workers', type=int, help="Worker processes (default: CPU count)")
+    p.add_argument('--report', help="Summary report path (directories)")
+    p.add_argument('--kdf', choices=kdf_choices, help=kdf_help)
+    p.add_argument('--kdf-params', metavar='LIST', help=kdf_params_help)
+    p.add_argument('--allow-unverified', action='store_true',
+                   help="Also re-key aes-cfb files, whose old password cannot be checked")
+    p.add_argument('--password', help=password_help)
+    p.add_argument('--new-password', help=f"New password (defaults to ${NEW_PASSWORD_ENV}, then a prompt)")
+    p.set_defaults(func=cmd_rekey)
+
+    p = sub.add_parser('inspect', help="Show the headers of .enc files")
+    p.add_argument('files', nargs='+', help=".enc files or directories to scan")
+    p.add_argument('--json', action='store_true', help="Print one JSON object per file")
+    p.set_defaults(func=cmd_inspect)
+
+    p = sub.add_parser('sidecars', help="Check .salt sidecar files against their headers and remove redundant ones")
+    p.add_argument('directory', help="Directory to scan, e.g. encrypted_images/")
+    p.add_argument('--dry-run', action='store_true', help="Only report; remove nothing")
+    p.add_argument('--workers', type=int, help="Worker threads")
+    p.add_argument('--json', action='store_true', help="Print the report as JSON")
+    p.set_defaults(func=cmd_sidecars)
+
+    p = sub.add_parser('archive', help="Store encrypted images in a single indexed archive file")
+    p.add_argument('action', choices=('add', 'list', 'extract', 'remove', 'compact'),
+                   help="add: encrypt images (or copy .enc files) in; extract: decrypt out; "
+                        "compact: reclaim space of removed and replaced images")
+    p.add_argument('archive', help="Archive file, e.g. photos.encpack")
+    p.add_argument('names', nargs='*',
+                   help="add: image or .enc files and directories; extract/remove: names in the archive "
+                        "(extract defaults to all)")
+    p.add_argument('-o', '--output', help="extract: output directory (default: current directory)")
+    p.add_argument('--json', action='store_true', help="list: print one JSON object per image")
+    p.add_argument('--payload', choices=payload_choices, default='pixels', help=payload_help)
+    p.add_argument('--cipher', choices=cipher_choices, default='aes-gcm-chunked', help=cipher_help)
+    p.add_argument('--rgb', action='store_true', help=rgb_help)
+    p.add_argument('--kdf', choices=kdf_choices, help=kdf_help)
+    p.add_argument('--kdf-params', metavar='LIST', help=kdf_params_help)
+    p.add_argument('--password', help=password_help)
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser('stack', help="Encrypt many same-size images as stacks, one cipher pass per stack")
+    p.add_argument('action', choices=('encrypt', 'list', 'extract'),
+                   help="encrypt: a directory of images into stacks; list: the frames of a stack; "
+                        "extract: frames of a stack as images")
+    p.add_argument('path', help="encrypt: image directory; list/extract: stack file")
+    p.add_argument('names', nargs='*', help="extract: frame names (default: all)")
+    p.add_argument('-o', '--output', help="encrypt/extract: output directory (default: current directory)")
+    p.add_argument('--manifest', help="encrypt: text file listing the images to process")
+    p.add_argument('--report', help="encrypt: summary report path (default: OUTPUT/stack_report.json)")
+    p.add_argument('--max-mb', type=int, help="encrypt: largest decoded size of one stack in MiB "
+                                              "(default: STACK_MAX_BYTES in config.py)")
+    p.add_argument('--workers', type=int, help="Decoding and encoding threads (default: CPU count)")
+    p.add_argument('--json', action='store_true', help="list: print one JSON object per frame")
+    p.add_argument('--cipher', choices=cipher_choices, default='aes-gcm-chunked', help=cipher_help)
+    p.add_argument('--kdf', choices=kdf_choices, help=kdf_help)
+    p.add_argument('--kdf-params', metavar='LIST', help=kdf_params_help)
+    p.add_argument('--password', help=password_help)
+    p.set_defaults(func=cmd_stack)
+
+    p = sub.add_parser('dedup', help="Show the statistics of a dedup index")
+    p.add_argument('index', help="SQLite index file")
+    p.add_argument('--prune', action='store_true', help="Drop entries whose encrypted file changed or vanished")
+    p.add_argument('--json', action='store_true', help="Print the statistics as JSON")
+    p.set_defaults(func=cmd_dedup)
+
+    p = sub.add_parser('calibrate', help="Find KDF parameters that take a target time on this machine")
+    p.add_argument('--kdf', choices=kdf_choices, help="KDF to calibrate (default: KDF in config.py)")
+    p.add_argument('--target-ms', type=float, default=250,
+                   help="Wanted time per key derivation in milliseconds (default: 250)")
+    p.add_argument('--max-memory', type=int, metavar='MIB', help="Largest scrypt memory cost in MiB")
+    p.add_argument('--json', action='store_true', help="Print the result as JSON")
+    p.set_defaults(func=cmd_calibrate)
+
+    p = sub.add_parser('serve', help="Serve encrypt/decrypt over local HTTP (see server.py)")
+    p.add_argument('--host', default='127.0.0.1', help="Address to bind (default: 127.0.0.1)")
+    p.add_argument('--port', type=int, default=8080, help="Port to bind (default: 8080)")
+    p.add_argument('--workers', type=int, help="Concurrent jobs (default: CPU count)")
+    p.add_argument('--queue', type=int, help="Jobs waiting for a worker before requests get 503 (default: 32)")
+    p.set_defaults(func=cmd_serve)
+
+    return parser
+
+
+def _configure_metrics(args):
+    from utils import instrumentation
+
+    if not (args.metrics or args.profile or args.trace_memory):
+        instrumentation.configure_from_env()
+        return
+    # --profile/--trace-memory alone report through the log
+    instrumentation.configure([instrumentation.sink_from_spec(spec) for spec in args.metrics or ['log']],
+                              profile=args.profile, trace_memory=args.trace_memory)
+
+
+def main(argv: list[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.metrics or args.profile or args.trace_memory or os.environ.get(METRICS_ENV):
+        _configure_metrics(args)
+    try:
+        return args.func(args)
+    except (ValueError, OSError, KeyError) as e:
+        # KeyError's str() is the repr of its argument
+        message = e.args[0] if isinstance(e, KeyError) and e.args else e
+        print(f"Error: {message}", file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,2 +1,31 @@
 # Default config values
 DEFAULT_KEY = 123  # Example fixed key (you can generate dynamically)
+
+# Streaming cipher settings
+CHUNK_SIZE = 1024 * 1024  # Bytes encrypted/decrypted per cipher update
+
+# Key derivation settings (see encryption.key_manager; `cli.py calibrate` suggests values)
+KDF = 'pbkdf2-sha256'  # KDF for new files: 'pbkdf2-sha256' or 'scrypt'
+KDF_PARAMS = None  # (iterations,) or (n, r, p) for KDF; None means its defaults
+SCRYPT_MAX_MEMORY = 1024 * 1024 * 1024  # Largest scrypt memory cost accepted, including from file headers
+
+# Derived-key cache settings
+KEY_CACHE_SIZE = 32  # Maximum number of derived keys kept in memory
+KEY_CACHE_TTL = 300  # Seconds a derived key stays cached
+
+# Content-addressed encryption (see encryption.dedup)
+DEDUP_INDEX = None  # SQLite index reused by the GUI, e.g. 'encrypted_images/dedup.sqlite'; None always encrypts
+DEDUP_MAX_ENTRIES = 100000  # Index rows kept before the least recently used are evicted
+
+# Stacks of same-size images (see encryption.stack)
+STACK_MAX_BYTES = 256 * 1024 * 1024  # Largest decoded size of one stack; it is held in memory while encrypting
+
+# Async service settings
+SERVICE_WORKERS = None  # Concurrent encrypt/decrypt jobs; None means the CPU count
+SERVICE_QUEUE_SIZE = 32  # Jobs allowed to wait for a worker before requests are refused
+SERVICE_MAX_BODY = 64 * 1024 * 1024  # Largest image or container accepted, in bytes
+
+# GUI preview settings
+PREVIEW_SIZE = (150, 150)  # Largest preview width and height in pixels
+PREVIEW_CACHE_SIZE = 128  # Thumbnails kept in memory
+PREVIEW_DISK_CACHE = None  # Directory for thumbnail PNGs, or None; they are unencrypted copies
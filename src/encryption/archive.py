@@ -0,0 +1,402 @@
+"""
+Append-only archives of encrypted images.
+
+Millions of loose ``.enc`` files cost a directory entry each, and finding one
+means a directory scan. An archive stores the containers back to back in a
+single file, followed by a compact index:
+
+    Archive header  8 bytes   magic b"IPAK", version uint16, 2 reserved
+    Record          14 bytes  magic b"IREC", name length uint16, container
+                              length uint64; then the UTF-8 name and the
+                              container, byte for byte a version 2 .enc file
+    Tombstone       14 bytes  magic b"IDEL", name length uint16, 0 uint64;
+                              then the UTF-8 name of a removed image
+    ...
+    Index           zlib-compressed entries: name length uint16, container
+                    offset uint64, container length uint64, the container's
+                    fixed 128-byte header, then the name
+    Trailer         24 bytes  index offset uint64, index size uint64,
+                              CRC-32 of the index uint32, magic b"IPIX"
+
+Opening an archive reads the trailer and the index only, so listing and
+lookup never touch the records, and any one image is decrypted by seeking to
+its container. New records are written over the old index, followed by a new
+index and trailer; records already written are never modified. If a writer
+dies before the new index is written, the trailer is missing and the index is
+rebuilt by walking the record headers on the next open. Removing a name
+appends a tombstone so a rebuilt index leaves it out, and replacing one
+appends a newer record; the old bytes stay until :func:`compact_archive`
+rewrites the live records into a new file to reclaim the space.
+
+Usage:
+    with Archive('photos.encpack', 'a') as archive:
+        archive.add('cat.jpg', 'images/cat.jpg', key, salt)
+    with Archive('photos.encpack') as archive:
+        archive.decrypt('cat.jpg', 'cat.png', password='secret')
+"""
+import io
+import ntpath
+import os
+import struct
+import threading
+import zlib
+from collections import namedtuple
+
+from config import CHUNK_SIZE
+from encryption.container import HEADER_SIZE, MAGIC, Header, parse_header
+from encryption.decryptor import decrypt_image
+from encryption.encryptor import encrypt_image
+from encryption.stream import open_input
+
+ARCHIVE_MAGIC = b'IPAK'
+ARCHIVE_VERSION = 1
+RECORD_MAGIC = b'IREC'
+TOMBSTONE_MAGIC = b'IDEL'
+INDEX_MAGIC = b'IPIX'
+
+_ARCHIVE_HEADER = struct.Struct('<4sH2x')
+_RECORD = struct.Struct('<4sHQ')
+_ENTRY = struct.Struct(f'<HQQ{HEADER_SIZE}s')
+_TRAILER = struct.Struct('<QQI4s')
+
+
+class ArchiveEntry(namedtuple('ArchiveEntry', 'name offset length fixed_header')):
+    """One image in an archive: its container's offset and length, and its fixed header bytes."""
+    __slots__ = ()
+
+    @property
+    def header(self) -> Header:
+        """The container's header, without extension data (palette, ICC profile)."""
+        return Header.unpack(self.fixed_header)
+
+
+def check_name(name: str) -> str:
+    """
+    Returns ``name`` if it can be stored and safely extracted under a directory.
+
+    Names are relative paths: absolute paths, drive letters and ``..``
+    components are rejected, as an extracted file could land outside the
+    output directory.
+
+    Raises:
+        ValueError: If the name is empty, too long or not a safe relative path.
+    """
+    parts = name.replace('\\', '/').split('/')
+    if (not name or len(name.encode('utf-8')) > 0xFFFF or not parts[0]
+            or ntpath.splitdrive(name)[0] or '..' in parts):
+        raise ValueError(f"Invalid name: {name!r}")
+    return name
+
+
+def _pack_index(entries) -> bytes:
+    parts = []
+    for entry in entries:
+        name = entry.name.encode('utf-8')
+        parts.append(_ENTRY.pack(len(name), entry.offset, entry.length, entry.fixed_header) + name)
+    return zlib.compress(b''.join(parts), 1)
+
+
+def _unpack_index(data: bytes) -> dict:
+    raw = zlib.decompress(data)
+    entries, offset = {}, 0
+    while offset < len(raw):
+        name_length, container, length, fixed = _ENTRY.unpack_from(raw, offset)
+        offset += _ENTRY.size
+        name = check_name(raw[offset:offset + name_length].decode('utf-8'))
+        offset += name_length
+        entries[name] = ArchiveEntry(name, container, length, fixed)
+    return entries
+
+
+class Archive:
+    """
+    An archive of encrypted images, opened for reading or appending.
+
+    Only one process may append at a time; readers may share the file with
+    each other. Reads are thread-safe.
+
+    Args:
+        path: Archive file.
+        mode: 'r' to read, 'a' to append (the archive is created if missing).
+
+    Raises:
+        ValueError: If the file is not an archive.
+    """
+    def __init__(self, path: str, mode: str = 'r'):
+        if mode not in ('r', 'a'):
+            raise ValueError(f"Unknown archive mode: {mode}")
+        self.path = path
+        self.mode = mode
+        if mode == 'a' and not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(_ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION))
+                f.write(_trailer(_ARCHIVE_HEADER.size, _pack_index([])))
+        self._f = open(path, 'rb' if mode == 'r' else 'r+b')
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            self._entries, self._end = self._load()
+        except BaseException:
+            self._f.close()
+            raise
+
+    def _load(self) -> tuple[dict, int]:
+        f = self._f
+        magic, version = _ARCHIVE_HEADER.unpack(f.read(_ARCHIVE_HEADER.size).ljust(_ARCHIVE_HEADER.size))
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError("Not an image archive.")
+        if version != ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported archive version {version}.")
+        size = f.seek(0, os.SEEK_END)
+        if size >= _ARCHIVE_HEADER.size + _TRAILER.size:
+            f.seek(size - _TRAILER.size)
+            index_offset, index_size, crc, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+            if magic == INDEX_MAGIC and index_offset + index_size + _TRAILER.size == size:
+                f.seek(index_offset)
+                data = f.read(index_size)
+                if zlib.crc32(data) == crc:
+                    return _unpack_index(data), index_offset
+        entries, end = self._scan()
+        self._dirty = True  # Written back on commit when appending
+        return entries, end
+
+    def _scan(self) -> tuple[dict, int]:
+        """Rebuilds the index from the record headers, dropping a truncated last record."""
+        f, entries = self._f, {}
+        offset = _ARCHIVE_HEADER.size
+        size = f.seek(0, os.SEEK_END)
+        while offset + _RECORD.size <= size:
+            f.seek(offset)
+            magic, name_length, length = _RECORD.unpack(f.read(_RECORD.size))
+            container = offset + _RECORD.size + name_length
+            if magic == TOMBSTONE_MAGIC and length == 0 and container <= size:
+                entries.pop(check_name(f.read(name_length).decode('utf-8')), None)
+                offset = container
+                continue
+            if magic != RECORD_MAGIC or container + length > size or length < HEADER_SIZE:
+                break
+            name = check_name(f.read(name_length).decode('utf-8'))
+            fixed = f.read(HEADER_SIZE)
+            if fixed[:4] != MAGIC:
+                break
+            entries.pop(name, None)  # Keep insertion order of the latest copy
+            entries[name] = ArchiveEntry(name, container, length, fixed)
+            offset = container + length
+        return entries, offset
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def entries(self) -> list[ArchiveEntry]:
+        """Returns every entry, in the order they were added."""
+        return list(self._entries.values())
+
+    def get(self, name: str) -> ArchiveEntry:
+        """Returns the entry for ``name``; raises KeyError if there is none."""
+        try:
+            return self._entries[name]
+        except KeyError:
+            raise KeyError(f"No image named {name!r} in {self.path}") from None
+
+    def stats(self) -> dict:
+        """Returns the entry count, file size and bytes held by live containers."""
+        live = sum(_RECORD.size + len(entry.name.encode('utf-8')) + entry.length
+                   for entry in self._entries.values())
+        size = os.path.getsize(self.path)
+        return {"entries": len(self._entries), "size": size, "live_bytes": live,
+                "dead_bytes": max(0, self._end - _ARCHIVE_HEADER.size - live)}
+
+    def _writable(self):
+        if self.mode != 'a':
+            raise ValueError("Archive is open for reading only.")
+
+    def _start_record(self, magic: bytes, encoded: bytes) -> int:
+        # Records go where the index was; it is rewritten on commit. Call with the lock held.
+        f = self._f
+        record = self._end
+        self._dirty = True
+        f.seek(record)
+        f.truncate()
+        f.write(_RECORD.pack(magic, len(encoded), 0) + encoded)
+        return record
+
+    def _append(self, name: str, write) -> ArchiveEntry:
+        self._writable()
+        encoded = check_name(name).encode('utf-8')
+        with self._lock:
+            f = self._f
+            record = self._start_record(RECORD_MAGIC, encoded)
+            container = f.tell()
+            try:
+                write(f)
+                end = f.seek(0, os.SEEK_END)
+                f.seek(container)
+                fixed = f.read(HEADER_SIZE)
+                if end - container < HEADER_SIZE or fixed[:4] != MAGIC:
+                    raise ValueError("Only version 2 containers can be archived.")
+            except BaseException:
+                f.seek(record)
+                f.truncate()
+                raise
+            f.seek(record)
+            f.write(_RECORD.pack(RECORD_MAGIC, len(encoded), end - container))
+            self._end = end
+            entry = ArchiveEntry(name, container, end - container, fixed)
+            self._entries.pop(name, None)
+            self._entries[name] = entry
+            return entry
+
+    def add(self, name: str, image, key: bytes, salt: bytes, **options) -> ArchiveEntry:
+        """
+        Encrypts an image straight into the archive, replacing any image of the same name.
+
+        Args:
+            name: Name to store it under, e.g. its relative path.
+            image: Path or binary file object of the image.
+            key: Encryption key.
+            salt: Salt ``key`` was derived with.
+            **options: Passed to :func:`encrypt_image` (``payload``,
+                ``cipher``, ``native``, ``kdf``, ...).
+
+        Returns:
+            The new entry.
+        """
+        return self._append(name, lambda f: encrypt_image(image, f, key, salt, verbose=False, **options))
+
+    def add_container(self, name: str, container) -> ArchiveEntry:
+        """Copies an existing ``.enc`` file (path or binary file object) into the archive."""
+        def copy(f):
+            with open_input(container) as source:
+                while chunk := source.read(CHUNK_SIZE):
+                    f.write(chunk)
+        return self._append(name, copy)
+
+    def remove(self, name: str):
+        """
+        Drops an image from the index; its bytes stay until :func:`compact_archive`.
+
+        A tombstone record is appended, so the image stays removed even if the
+        index has to be rebuilt from the records after a crash.
+        """
+        self._writable()
+        self.get(name)
+        with self._lock:
+            self._start_record(TOMBSTONE_MAGIC, name.encode('utf-8'))
+            self._end = self._f.tell()
+            del self._entries[name]
+
+    def read(self, name: str) -> bytes:
+        """Returns the container bytes of one image."""
+        entry = self.get(name)
+        with self._lock:
+            self._f.seek(entry.offset)
+            data = self._f.read(entry.length)
+        if len(data) != entry.length:
+            raise ValueError(f"Archive is truncated at {name!r}.")
+        return data
+
+    def _chunks(self, entry: ArchiveEntry):
+        offset, remaining = entry.offset, entry.length
+        while remaining:
+            with self._lock:
+                self._f.seek(offset)
+                chunk = self._f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"Archive is truncated at {entry.name!r}.")
+            offset += len(chunk)
+            remaining -= len(chunk)
+            yield chunk
+
+    def open(self, name: str) -> io.BytesIO:
+        """Returns one image's container as an in-memory file, ready for ``decrypt_image``."""
+        return io.BytesIO(self.read(name))
+
+    def header(self, name: str) -> Header:
+        """Returns one image's full header, extension data included."""
+        return parse_header(self.open(name))
+
+    def decrypt(self, name: str, output_path, password: str = None, key: bytes = None, **options):
+        """
+        Decrypts one image to ``output_path`` (see :func:`decrypt_image`).
+
+        Only that image's container is read; it is decrypted in memory.
+
+        Returns:
+            The path the image was written to.
+        """
+        return decrypt_image(self.open(name), output_path, password, key, verbose=False, **options)
+
+    def commit(self):
+        """Writes the index and trailer after the records, making appends and removals durable."""
+        if self.mode != 'a' or not self._dirty:
+            return
+        with self._lock:
+            index = _pack_index(self._entries.values())
+            self._f.seek(self._end)
+            self._f.write(index + _trailer(self._end, index))
+            self._f.truncate()
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._dirty = False
+
+    def close(self):
+        """Commits pending changes and closes the file."""
+        if self._f.closed:
+            return
+        try:
+            self.commit()
+        finally:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _trailer(index_offset: int, index: bytes) -> bytes:
+    return _TRAILER.pack(index_offset, len(index), zlib.crc32(index), INDEX_MAGIC)
+
+
+def compact_archive(path: str) -> dict:
+    """
+    Rewrites an archive with only its live images, reclaiming removed and replaced ones.
+
+    The new archive is written next to the old one and renamed over it once
+    complete, so an interruption leaves the original untouched.
+
+    Returns:
+        Dict with the ``entries`` kept and the file size ``before`` and ``after``.
+    """
+    partial = path + '.compact'
+    with Archive(path) as source:
+        before = os.path.getsize(path)
+        try:
+            with open(partial, 'wb') as out:
+                out.write(_ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION))
+                kept = []
+                for entry in source.entries():
+                    encoded = entry.name.encode('utf-8')
+                    out.write(_RECORD.pack(RECORD_MAGIC, len(encoded), entry.length) + encoded)
+                    container = out.tell()
+                    for chunk in source._chunks(entry):
+                        out.write(chunk)
+                    kept.append(entry._replace(offset=container))
+                index_offset = out.tell()
+                index = _pack_index(kept)
+                out.write(index + _trailer(index_offset, index))
+                out.flush()
+                os.fsync(out.fileno())
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+    os.replace(partial, path)
+    return {"entries": len(kept), "before": before, "after": os.path.getsize(path)}
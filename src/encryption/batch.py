@@ -0,0 +1,345 @@
+import contextlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from encryption.encryptor import encrypt_image
+from encryption.container import PAYLOAD_PIXELS, CIPHER_AES_GCM, read_header
+from encryption.decryptor import decrypt_image, output_path_for
+from encryption.dedup import DedupIndex, content_hash, link_or_copy, options_tag
+from encryption.key_manager import Kdf, KeyManager, make_kdf
+from encryption.rekey import key_matches, rekey_file
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.webp')
+REPORT_NAME = 'batch_report.json'
+
+
+def collect_files(source_dir: str, extensions: tuple, manifest: str = None) -> list[str]:
+    """
+    Lists the files a batch should process, relative to ``source_dir``.
+
+    Args:
+        source_dir: Root directory of the inputs.
+        extensions: Lower-case file extensions to include when walking the tree.
+        manifest: Optional text file with one path per line (relative to
+            ``source_dir`` or absolute); blank lines and ``#`` comments are ignored.
+
+    Returns:
+        Sorted relative paths.
+
+    Raises:
+        ValueError: If manifest entries point outside ``source_dir``; all of them are listed.
+    """
+    if manifest:
+        with open(manifest, 'r', encoding='utf-8') as f:
+            entries = [line.strip() for line in f]
+        entries = [entry for entry in entries if entry and not entry.startswith('#')]
+        files = {entry: _relative_to(entry, source_dir) for entry in entries}
+        outside = [entry for entry, rel in files.items() if rel is None]
+        if outside:
+            raise ValueError(f"Manifest entries outside {source_dir}: {', '.join(outside)}")
+        return sorted(files.values())
+
+    files = []
+    for root, _, names in os.walk(source_dir):
+        for name in names:
+            if name.lower().endswith(extensions):
+                files.append(os.path.relpath(os.path.join(root, name), source_dir))
+    return sorted(files)
+
+
+def _relative_to(entry: str, source_dir: str) -> str:
+    # None when the entry resolves outside source_dir, e.g. '../x' or another drive
+    try:
+        rel = os.path.relpath(os.path.join(source_dir, entry), source_dir)
+    except ValueError:
+        return None
+    return None if rel == os.pardir or rel.startswith(os.pardir + os.sep) or os.path.isabs(rel) else rel
+
+
+def _partial_path(output_path: str) -> str:
+    # Keeps the real extension last so save_image still picks the right format
+    base, ext = os.path.splitext(output_path)
+    return f"{base}.part{ext}"
+
+
+def _run_job(job: tuple) -> dict:
+    """Worker entry point: encrypts, decrypts or re-keys one file and reports the outcome."""
+    action, source, output, key, salt, options = job
+    result = {"source": source, "output": output}
+    if output != source and os.path.exists(output):
+        result["status"] = "skipped"
+        return result
+
+    start = time.perf_counter()
+    partial = _partial_path(output)
+    try:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        if action == 'rekey':
+            old_key, new_key = key
+            rekey_file(source, old_key, new_key, salt, output_path=output, **options)
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                if action == 'encrypt':
+                    encrypt_image(source, partial, key, salt, **options)
+                else:
+                    decrypt_image(source, partial, key=key)
+            os.replace(partial, output)
+        result["status"] = "ok"
+        result["bytes"] = os.path.getsize(output)
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+        with contextlib.suppress(OSError):
+            os.remove(partial)
+    result["seconds"] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def _try_hash(path: str) -> bytes:
+    # Unreadable sources are left for the worker to report
+    try:
+        return content_hash(path)
+    except OSError:
+        return None
+
+
+def _run_batch(jobs: list[tuple], workers: int, report_path: str, results: list = None,
+               on_result=None, started: float = None, summary=None) -> dict:
+    workers = workers or os.cpu_count() or 1
+    started = started or time.time()
+    results = list(results or [])
+    if workers == 1:
+        outcomes = map(_run_job, jobs)
+    else:
+        chunksize = max(1, min(64, len(jobs) // (workers * 8)))
+        executor = ProcessPoolExecutor(max_workers=workers)
+        outcomes = executor.map(_run_job, jobs, chunksize=chunksize)
+    try:
+        for result in outcomes:
+            if on_result is not None:
+                on_result(result)
+            results.append(result)
+    finally:
+        if workers != 1:
+            executor.shutdown()
+
+    counts = {"ok": 0, "skipped": 0, "error": 0}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    report = {
+        "started": started,
+        "seconds": round(time.time() - started, 3),
+        "workers": workers,
+        "counts": counts,
+        "files": results,
+    }
+    if summary is not None:
+        report.update(summary())
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def encrypt_batch(source_dir: str, output_dir: str, password: str, manifest: str = None,
+                  workers: int = None, report_path: str = None, payload: str = PAYLOAD_PIXELS,
+                  cipher: str = CIPHER_AES_GCM, native: bool = True, kdf: Kdf = None,
+                  dedup_index: str = None) -> dict:
+    """
+    Encrypts every image under ``source_dir`` into ``output_dir`` in parallel.
+
+    The key is derived once for the whole batch. Each output mirrors the
+    input's relative path with ``.enc`` appended and is written under a
+    temporary name and renamed when complete, so outputs that already exist
+    are finished and are skipped on rerun.
+
+    With ``dedup_index``, sources are hashed first (on threads) and looked up
+    in a :class:`~encryption.dedup.DedupIndex`; a source whose content was
+    already encrypted with the same password and options is linked (or
+    copied) from that file instead of being decoded and encrypted, and
+    reported as 'deduplicated'. New outputs are added to the index.
+
+    Args:
+        source_dir: Root directory of the images.
+        output_dir: Directory receiving the encrypted files.
+        password: Password for key derivation.
+        manifest: Optional list of files to process instead of walking the tree.
+        workers: Process count; defaults to the number of CPU cores.
+        report_path: Where to write the JSON summary; defaults to
+            ``output_dir/batch_report.json``.
+        payload: Payload type passed to :func:`encrypt_image`.
+        cipher: Cipher passed to :func:`encrypt_image`.
+        native: Keep pixels in each image's own mode (see :func:`encrypt_image`).
+        kdf: KDF and parameters (see :func:`make_kdf`); defaults to the configured ones.
+        dedup_index: Path of a dedup index (SQLite) to reuse earlier outputs from.
+
+    Returns:
+        The summary report, with the index's ``dedup`` statistics when one is used.
+    """
+    started = time.time()
+    kdf = kdf or make_kdf()
+    key, salt = KeyManager().generate_key_from_password(password, kdf=kdf)
+    options = {"payload": payload, "cipher": cipher, "native": native, "kdf": kdf}
+    jobs = [('encrypt', os.path.join(source_dir, rel), os.path.join(output_dir, rel + '.enc'), key, salt, options)
+            for rel in collect_files(source_dir, IMAGE_EXTENSIONS, manifest)]
+    os.makedirs(output_dir, exist_ok=True)
+    report_path = report_path or os.path.join(output_dir, REPORT_NAME)
+    if not dedup_index:
+        return _run_batch(jobs, workers, report_path, started=started)
+
+    with DedupIndex(dedup_index) as index:
+        key_id = index.key_id(password, kdf)
+        tag = options_tag(payload, cipher, native, kdf)
+        pending = [job for job in jobs if not os.path.exists(job[2])]
+        with ThreadPoolExecutor(workers) as pool:
+            digests = dict(zip((job[1] for job in pending),
+                               pool.map(_try_hash, (job[1] for job in pending))))
+        results, remaining = [], [job for job in jobs if job[1] not in digests]
+        for job in pending:
+            digest = digests[job[1]]
+            existing = digest and index.lookup(digest, key_id, tag)
+            if not existing:
+                remaining.append(job)
+                continue
+            result = {"source": job[1], "output": job[2], "reused": existing}
+            try:
+                link_or_copy(existing, job[2])
+                result["status"] = "deduplicated"
+            except OSError as e:
+                result["status"] = "error"
+                result["error"] = f"{type(e).__name__}: {e}"
+            results.append(result)
+
+        def indexed(result):
+            if result["status"] == "ok" and digests.get(result["source"]):
+                index.record(digests[result["source"]], key_id, tag, result["output"])
+
+        return _run_batch(remaining, workers, report_path, results, indexed, started,
+                          lambda: {"dedup": index.stats()})
+
+
+def decrypt_batch(source_dir: str, output_dir: str, password: str, manifest: str = None,
+                  workers: int = None, report_path: str = None) -> dict:
+    """
+    Decrypts every ``.enc`` file under ``source_dir`` into PNGs in ``output_dir``.
+
+    Keys are derived once per distinct salt found in the files' headers.
+    Outputs drop the ``.enc`` suffix and gain ``.png`` (or the original
+    extension for 'file' payloads); existing outputs are skipped as in
+    :func:`encrypt_batch`.
+
+    Returns:
+        The summary report.
+    """
+    key_manager = KeyManager()
+    jobs = []
+    for rel in collect_files(source_dir, ('.enc',), manifest):
+        source = os.path.join(source_dir, rel)
+        output = os.path.join(output_dir, rel[:-len('.enc')] + '.png')
+        try:
+            header = read_header(source)
+            output = output_path_for(output, header)
+            key, _ = key_manager.generate_key_from_password(password, header.salt,
+                                                        make_kdf(header.kdf, header.kdf_params))
+        except Exception:
+            # Let the worker surface the error for this file in the report
+            key = None
+        jobs.append(('decrypt', source, output, key, None, {}))
+    os.makedirs(output_dir, exist_ok=True)
+    return _run_batch(jobs, workers, report_path or os.path.join(output_dir, REPORT_NAME))
+
+
+def _verify_group(files: list[tuple], key: bytes):
+    # The first readable chunked file settles the key for its whole salt group
+    for source, _, header in files:
+        if header.cipher == CIPHER_AES_GCM:
+            try:
+                return key_matches(source, header, key)
+            except (OSError, ValueError):
+                continue
+    return None
+
+
+def rekey_batch(source_dir: str, old_password: str, new_password: str, output_dir: str = None,
+                manifest: str = None, workers: int = None, report_path: str = None, kdf: Kdf = None,
+                allow_unverified: bool = False) -> dict:
+    """
+    Re-encrypts every ``.enc`` file under ``source_dir`` under a new password, in parallel.
+
+    Nothing is decoded: each payload is streamed from the old key to the
+    new one (see :mod:`encryption.rekey`) and the file atomically replaced.
+    Files are grouped by salt and KDF, so the old key is derived once per
+    group and checked on one chunked file of the group before any file is
+    touched; each group gets one new salt and key. A group whose key does
+    not match the old password but does match the new one was already
+    re-keyed by an interrupted run and is skipped.
+
+    Args:
+        source_dir: Root directory of the encrypted files.
+        old_password: Password the files are encrypted with.
+        new_password: Password to encrypt them with.
+        output_dir: Write re-keyed copies here (mirroring relative paths,
+            existing ones skipped) instead of replacing the files in place.
+        manifest: Optional list of files to process instead of walking the tree.
+        workers: Process count; defaults to the number of CPU cores.
+        report_path: Where to write the JSON summary, if anywhere.
+        kdf: KDF for the new password; defaults to the configured one.
+        allow_unverified: Also re-key AES-CFB groups whose old password could
+            not be checked on an AES-GCM file.
+
+    Returns:
+        The summary report, with the number of salt ``groups``.
+    """
+    started = time.time()
+    kdf = kdf or make_kdf()
+    key_manager = KeyManager()
+    groups, results = {}, []
+    for rel in collect_files(source_dir, ('.enc',), manifest):
+        source = os.path.join(source_dir, rel)
+        output = os.path.join(output_dir, rel) if output_dir else source
+        try:
+            header = read_header(source)
+        except (OSError, ValueError) as e:
+            results.append({"source": source, "output": output, "status": "error",
+                            "error": f"{type(e).__name__}: {e}"})
+            continue
+        groups.setdefault((header.salt, header.kdf, header.kdf_params), []).append((source, output, header))
+
+    jobs = []
+    for (salt, name, params), files in groups.items():
+        status, problem = None, None
+        try:
+            old_kdf = make_kdf(name, params)
+            old_key, _ = key_manager.generate_key_from_password(old_password, salt, old_kdf)
+            verified = _verify_group(files, old_key)
+            if verified is False:
+                new_key, _ = key_manager.generate_key_from_password(new_password, salt, old_kdf)
+                if _verify_group(files, new_key):
+                    status = "skipped"
+                else:
+                    problem = "Wrong password: the files do not authenticate with it."
+            elif verified is None and not allow_unverified:
+                problem = ("AES-CFB files are not authenticated, so the old password cannot be checked; "
+                           "allow unverified re-keying to proceed.")
+        except ValueError as e:
+            problem = f"{type(e).__name__}: {e}"
+        if status or problem:
+            results.extend({"source": source, "output": output, "status": status or "error",
+                            **({"error": problem} if problem else {})} for source, output, _ in files)
+            continue
+        new_key, new_salt = key_manager.generate_key_from_password(new_password, kdf=kdf)
+        jobs.extend(('rekey', source, output, (old_key, new_key), new_salt, {"kdf": kdf})
+                    for source, output, _ in files)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    return _run_batch(jobs, workers, report_path, results, started=started,
+                      summary=lambda: {"groups": len(groups)})
+
+
+if __name__ == '__main__':
+    import sys
+    from cli import main
+    raise SystemExit(main(['batch', *sys.argv[1:]]))
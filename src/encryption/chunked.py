@@ -0,0 +1,258 @@
+"""
+Chunked AES-GCM payloads.
+
+The plaintext payload is split into ``header.chunk_size`` pieces (row bands
+for pixel payloads). Every chunk is sealed independently with AES-GCM and
+stored as ciphertext followed by its 16-byte tag. Each chunk's nonce is the
+header IV with the chunk number XORed into its low 8 bytes. Its associated
+data binds the chunk to the header, to its position and to whether it is the
+last chunk, so chunks cannot be swapped, dropped or moved between files.
+A table of (offset, length) entries at ``header.index_offset`` locates
+every chunk, which allows random access and parallel decryption.
+"""
+import io
+import mmap
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+
+from encryption.stream import update_into
+
+TAG_SIZE = 16
+NONCE_SIZE = 12
+_COUNT = struct.Struct('<Q')
+_ENTRY = struct.Struct('<QI')
+_CHUNK_AAD = struct.Struct('<QB')
+
+
+class IntegrityError(ValueError):
+    """A chunk failed authentication: wrong key, or the file was modified."""
+
+
+@contextmanager
+def map_file(f):
+    """
+    Memory-maps an open file read-only for zero-copy chunk access.
+
+    An ``io.BytesIO`` is already in memory, so its own buffer is exposed
+    instead of a map.
+
+    If an exception is propagating while views of the map are still alive
+    (held by its traceback), the map is left for garbage collection instead of
+    masking the error with a ``BufferError``.
+    """
+    if isinstance(f, io.BytesIO):
+        buf = f.getbuffer()
+        release = buf.release
+    else:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        release = buf.close
+    try:
+        yield buf
+    finally:
+        with suppress(BufferError):
+            release()
+
+
+def drop_pages(buf, offset: int, length: int):
+    """
+    Tells the kernel the mapped pages of ``buf[offset:offset + length]`` are no longer needed.
+
+    Consumed ciphertext then stops counting towards resident memory (it stays
+    in the page cache and faults back in if read again). A no-op for
+    anything but a memory map, or where ``madvise`` is unavailable.
+    """
+    if not isinstance(buf, mmap.mmap) or not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+    start = -(-offset // mmap.PAGESIZE) * mmap.PAGESIZE
+    end = (offset + length) // mmap.PAGESIZE * mmap.PAGESIZE
+    if end > start:
+        buf.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+def chunk_nonce(iv: bytes, index: int) -> bytes:
+    """Returns the 96-bit GCM nonce of chunk ``index``."""
+    counter = int.from_bytes(iv[4:NONCE_SIZE], 'big') ^ index
+    return iv[:4] + counter.to_bytes(8, 'big')
+
+
+def _chunk_aad(header_aad: bytes, index: int, last: bool) -> bytes:
+    return header_aad + _CHUNK_AAD.pack(index, last)
+
+
+def _exact_chunks(pieces, size: int):
+    """Regroups buffers into ``size``-byte chunks, passing exact-size pieces through uncopied."""
+    pending = bytearray()
+    for piece in pieces:
+        if not pending and len(piece) == size:
+            yield piece
+            continue
+        pending += piece
+        while len(pending) >= size:
+            yield bytes(pending[:size])
+            del pending[:size]
+    if pending:
+        yield bytes(pending)
+
+
+def _with_last(chunks):
+    """Yields (chunk, is_last) pairs, looking one chunk ahead."""
+    iterator = iter(chunks)
+    previous = next(iterator, None)
+    if previous is None:
+        yield b'', True
+        return
+    for chunk in iterator:
+        yield previous, False
+        previous = chunk
+    yield previous, True
+
+
+def encrypt_chunks(key: bytes, header, pieces, f) -> list[tuple[int, int]]:
+    """
+    Seals the payload chunk by chunk and writes the chunks to ``f``.
+
+    Args:
+        key: AES key.
+        header: The file's :class:`~encryption.container.Header`; its
+            ``chunk_size`` and ``iv`` drive the chunking and nonces.
+        pieces: Iterable of plaintext buffers, in order.
+        f: Binary file object positioned just after the header.
+
+    Returns:
+        The chunk table: (offset, length) of every sealed chunk, relative to
+        the start of the container.
+    """
+    header_aad = header.authenticated_bytes()
+    start = f.tell() - header.data_offset
+    entries = []
+    out = bytearray(header.chunk_size + 15)
+    out_view = memoryview(out)
+    for index, (chunk, last) in enumerate(_with_last(_exact_chunks(pieces, header.chunk_size))):
+        encryptor = Cipher(algorithms.AES(key), modes.GCM(chunk_nonce(header.iv, index)),
+                           backend=default_backend()).encryptor()
+        encryptor.authenticate_additional_data(_chunk_aad(header_aad, index, last))
+        n = encryptor.update_into(chunk, out)
+        encryptor.finalize()
+        offset = f.tell() - start
+        f.write(out_view[:n])
+        f.write(encryptor.tag)
+        entries.append((offset, n + TAG_SIZE))
+    return entries
+
+
+def write_index(f, entries: list[tuple[int, int]]):
+    """Writes the chunk table at the current position."""
+    f.write(_COUNT.pack(len(entries)))
+    f.write(b''.join(_ENTRY.pack(offset, length) for offset, length in entries))
+
+
+def read_index(buf, header) -> list[tuple[int, int]]:
+    """
+    Reads the chunk table of a container held in ``buf``.
+
+    Args:
+        buf: Bytes-like view of the whole container (e.g. a memory map).
+        header: The container's parsed header.
+    """
+    (count,) = _COUNT.unpack_from(buf, header.index_offset)
+    table = header.index_offset + _COUNT.size
+    if table + count * _ENTRY.size > len(buf):
+        raise ValueError("Chunk table is truncated.")
+    return [_ENTRY.unpack_from(buf, table + i * _ENTRY.size) for i in range(count)]
+
+
+def decrypt_chunk_into(key: bytes, header, header_aad: bytes, index: int, last: bool,
+                       sealed: memoryview, out: memoryview) -> int:
+    """
+    Authenticates and decrypts one chunk into ``out``.
+
+    Returns:
+        The number of plaintext bytes written.
+
+    Raises:
+        IntegrityError: If the chunk fails authentication.
+    """
+    ciphertext, tag = sealed[:-TAG_SIZE], sealed[-TAG_SIZE:]
+    decryptor = Cipher(algorithms.AES(key), modes.GCM(chunk_nonce(header.iv, index), bytes(tag)),
+                       backend=default_backend()).decryptor()
+    decryptor.authenticate_additional_data(_chunk_aad(header_aad, index, last))
+    n = update_into(decryptor, ciphertext, out)
+    try:
+        decryptor.finalize()
+    except InvalidTag:
+        raise IntegrityError(f"Chunk {index} failed authentication: wrong password or corrupted file.") from None
+    return n
+
+
+def iter_chunks(key: bytes, header, buf, indices=None, advance=None):
+    """
+    Decrypts chunks in order, yielding ``(index, plaintext)`` pairs.
+
+    Args:
+        buf: Bytes-like view of the whole container.
+        indices: Optional subset of chunk numbers; defaults to every chunk.
+        advance: Optional callback receiving the sealed size of every chunk
+            once it has been consumed.
+    """
+    entries = read_index(buf, header)
+    header_aad = header.authenticated_bytes()
+    view = memoryview(buf)
+    out = bytearray(header.chunk_size)
+    for index in (range(len(entries)) if indices is None else indices):
+        offset, length = entries[index]
+        n = decrypt_chunk_into(key, header, header_aad, index, index == len(entries) - 1,
+                               view[offset:offset + length], memoryview(out))
+        drop_pages(buf, offset, length)
+        yield index, memoryview(out)[:n]
+        if advance is not None:
+            advance(length)
+
+
+def decrypt_chunks_into(key: bytes, header, buf, out: memoryview, workers: int = None,
+                        first: int = 0, stop: int = None, advance=None):
+    """
+    Decrypts chunks ``first``..``stop - 1`` straight into ``out``, spreading them over threads.
+
+    The first requested chunk is decrypted up front so a wrong key fails
+    immediately instead of after the whole payload has been processed.
+
+    Args:
+        buf: Bytes-like view of the whole container.
+        out: Writable byte view sized to the plaintext of the requested chunks.
+        workers: Thread count; defaults to the number of CPU cores.
+        first: First chunk to decrypt.
+        stop: One past the last chunk to decrypt; defaults to every chunk.
+        advance: Optional callback receiving the sealed size of every decrypted
+            chunk; called from the worker threads.
+    """
+    entries = read_index(buf, header)
+    stop = len(entries) if stop is None else stop
+    if sum(length - TAG_SIZE for _, length in entries[first:stop]) != len(out):
+        raise ValueError("Chunk table does not match the image shape.")
+    header_aad = header.authenticated_bytes()
+    view = memoryview(buf)
+    last = len(entries) - 1
+
+    def decrypt(index: int):
+        offset, length = entries[index]
+        start = (index - first) * header.chunk_size
+        decrypt_chunk_into(key, header, header_aad, index, index == last, view[offset:offset + length],
+                           out[start:start + length - TAG_SIZE])
+        drop_pages(buf, offset, length)
+        if advance is not None:
+            advance(length)
+
+    decrypt(first)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or stop - first < 3:
+        for index in range(first + 1, stop):
+            decrypt(index)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() re-raises the first failure
+        list(executor.map(decrypt, range(first + 1, stop)))
@@ -0,0 +1,316 @@
+"""
+On-disk layout of .enc files.
+
+Version 2 files start with a fixed 128-byte little-endian header, followed by
+``extra_size`` bytes of optional extension data, then the encrypted payload:
+
+    offset  size  field
+    0       4     magic b"IENC"
+    4       1     format version (2)
+    5       1     payload type code
+    6       1     cipher code
+    7       1     KDF code
+    8       1     flags
+    9       1     reserved
+    10      12    KDF parameters (3 x uint32)
+    22      16    salt
+    38      16    IV / nonce
+    54      4     NumPy dtype string of the pixel buffer (e.g. "|u1")
+    58      8     Pillow mode of the source image
+    66      8     original file extension ('file' payloads)
+    74      12    height, width, channels (3 x uint32)
+    86      4     plaintext chunk size (chunked ciphers, else 0)
+    90      4     extra_size
+    94      8     payload size in bytes
+    102     8     chunk table offset (0 if none)
+    110     18    reserved
+
+The extension data is a sequence of (tag uint8, length uint32, value)
+records; see ``pack_extra``.
+
+Version 1 files (the original format) start with JSON metadata padded to
+512 bytes; :func:`read_header` still understands them.
+"""
+import json
+import os
+import struct
+from dataclasses import dataclass, field, replace
+
+MAGIC = b'IENC'
+VERSION = 2
+HEADER_SIZE = 128
+METADATA_SIZE = 512  # Size of the legacy (version 1) JSON block
+
+_HEADER = struct.Struct('<4sBBBBBx3I16s16s4s8s8s3IIIQQ18x')
+_EXTRA_SIZE = struct.Struct('<I')
+_EXTRA_SIZE_OFFSET = 90
+
+# Payload types: what the ciphertext after the header holds
+PAYLOAD_PIXELS = 'pixels'  # Raw decoded pixel buffer: RGB, or the image's own mode with FLAG_NATIVE
+PAYLOAD_FILE = 'file'      # The original encoded file bytes, untouched
+PAYLOAD_ZLIB = 'zlib'      # zlib-compressed pixel buffer
+PAYLOAD_TYPES = (PAYLOAD_PIXELS, PAYLOAD_FILE, PAYLOAD_ZLIB)
+
+CIPHER_AES_CFB = 'aes-cfb'
+CIPHER_AES_GCM = 'aes-gcm-chunked'  # Independently authenticated chunks, see encryption.chunked
+CIPHERS = (CIPHER_AES_CFB, CIPHER_AES_GCM)
+KDF_PBKDF2_SHA256 = 'pbkdf2-sha256'  # Parameters: (iterations, 0, 0)
+KDF_SCRYPT = 'scrypt'                # Parameters: (n, r, p)
+
+_PAYLOAD_CODES = {PAYLOAD_PIXELS: 0, PAYLOAD_FILE: 1, PAYLOAD_ZLIB: 2}
+_CIPHER_CODES = {CIPHER_AES_CFB: 0, CIPHER_AES_GCM: 1}
+_KDF_CODES = {KDF_PBKDF2_SHA256: 0, KDF_SCRYPT: 1}
+
+LEGACY_KDF_PARAMS = (100000, 0, 0)
+
+# Header flags
+FLAG_NATIVE = 0x01  # Pixel payload is the image's own raw buffer in ``mode``, not RGB
+
+# Extension record tags
+EXTRA_PALETTE = 1       # Palette raw mode (8 bytes, NUL-padded) followed by the palette
+EXTRA_TRANSPARENCY = 2  # JSON: an int, a list of ints, or {"bytes": hex}
+EXTRA_ICC_PROFILE = 3   # ICC profile bytes
+EXTRA_STACK = 4         # Image height and count, then (offset uint64, name) per image; see encryption.stack
+_EXTRA_RECORD = struct.Struct('<BI')
+_STACK = struct.Struct('<II')
+_STACK_ENTRY = struct.Struct('<QH')
+
+
+def _decode(codes: dict, code: int, what: str) -> str:
+    for name, value in codes.items():
+        if value == code:
+            return name
+    raise ValueError(f"Unknown {what} code {code} in header.")
+
+
+def _text(raw: bytes) -> str:
+    return raw.rstrip(b'\0').decode('ascii')
+
+
+@dataclass
+class Header:
+    """Everything needed to locate and decrypt the payload of a .enc file."""
+    salt: bytes
+    iv: bytes
+    mode: str
+    shape: tuple
+    payload: str = PAYLOAD_PIXELS
+    cipher: str = CIPHER_AES_CFB
+    kdf: str = KDF_PBKDF2_SHA256
+    kdf_params: tuple = LEGACY_KDF_PARAMS
+    dtype: str = '|u1'
+    ext: str = ''
+    flags: int = 0
+    chunk_size: int = 0
+    payload_size: int = 0
+    index_offset: int = 0
+    extra: bytes = b''
+    version: int = field(default=VERSION, compare=False)
+
+    @property
+    def data_offset(self) -> int:
+        """File offset of the first payload byte."""
+        if self.version == 1:
+            return METADATA_SIZE
+        return HEADER_SIZE + len(self.extra)
+
+    def pack(self) -> bytes:
+        """Serializes the header and its extension data."""
+        height, width = self.shape[:2]
+        channels = self.shape[2] if len(self.shape) > 2 else 1
+        fixed = _HEADER.pack(
+            MAGIC, VERSION, _PAYLOAD_CODES[self.payload], _CIPHER_CODES[self.cipher],
+            _KDF_CODES[self.kdf], self.flags, *self.kdf_params, self.salt, self.iv,
+            self.dtype.encode('ascii'), self.mode.encode('ascii'), self.ext.encode('ascii'),
+            height, width, channels, self.chunk_size, len(self.extra),
+            self.payload_size, self.index_offset,
+        )
+        return fixed + self.extra
+
+    @classmethod
+    def unpack(cls, data: bytes) -> 'Header':
+        """Parses the fixed header from the first ``HEADER_SIZE`` bytes (extension data not included)."""
+        (magic, version, payload, cipher, kdf, flags, p1, p2, p3, salt, iv, dtype, mode, ext,
+         height, width, channels, chunk_size, _, payload_size, index_offset) = _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not an encrypted image file.")
+        if version != VERSION:
+            raise ValueError(f"Unsupported format version {version}.")
+        return cls(
+            salt=salt, iv=iv, mode=_text(mode),
+            shape=(height, width) if channels == 1 else (height, width, channels),
+            payload=_decode(_PAYLOAD_CODES, payload, 'payload'),
+            cipher=_decode(_CIPHER_CODES, cipher, 'cipher'),
+            kdf=_decode(_KDF_CODES, kdf, 'KDF'), kdf_params=(p1, p2, p3),
+            dtype=_text(dtype), ext=_text(ext), flags=flags, chunk_size=chunk_size,
+            payload_size=payload_size, index_offset=index_offset,
+        )
+
+    def authenticated_bytes(self) -> bytes:
+        """
+        Returns the header bytes bound into every chunk's associated data.
+
+        The payload size and chunk table offset are only known after the
+        payload is written, so they are zeroed here.
+        """
+        return replace(self, payload_size=0, index_offset=0).pack()
+
+    def to_dict(self) -> dict:
+        """Returns a JSON-friendly view of the header."""
+        return {
+            "version": self.version, "payload": self.payload, "cipher": self.cipher,
+            "kdf": self.kdf, "kdf_params": list(self.kdf_params), "salt": self.salt.hex(),
+            "iv": self.iv.hex(), "mode": self.mode, "shape": list(self.shape),
+            "dtype": self.dtype, "ext": self.ext, "flags": self.flags,
+            "chunk_size": self.chunk_size, "payload_size": self.payload_size,
+            "index_offset": self.index_offset, "extra_size": len(self.extra),
+        }
+
+
+def pack_extra(attributes: dict) -> bytes:
+    """
+    Serializes image attributes (see ``utils.image_loader.image_attributes``) as extension records.
+
+    Args:
+        attributes: Any of 'palette', 'transparency' and 'icc_profile', and
+            'stack': (image height, [(name, payload offset), ...]).
+    """
+    records = []
+    if 'palette' in attributes:
+        rawmode, palette = attributes['palette']
+        records.append((EXTRA_PALETTE, rawmode.encode('ascii').ljust(8, b'\0') + bytes(palette)))
+    if 'transparency' in attributes:
+        value = attributes['transparency']
+        if isinstance(value, bytes):
+            value = {"bytes": value.hex()}
+        records.append((EXTRA_TRANSPARENCY, json.dumps(value).encode('ascii')))
+    if 'icc_profile' in attributes:
+        records.append((EXTRA_ICC_PROFILE, bytes(attributes['icc_profile'])))
+    if 'stack' in attributes:
+        height, entries = attributes['stack']
+        packed = [_STACK.pack(height, len(entries))]
+        for name, offset in entries:
+            name = name.encode('utf-8')
+            packed.append(_STACK_ENTRY.pack(offset, len(name)) + name)
+        records.append((EXTRA_STACK, b''.join(packed)))
+    return b''.join(_EXTRA_RECORD.pack(tag, len(value)) + value for tag, value in records)
+
+
+def unpack_extra(extra: bytes) -> dict:
+    """
+    Parses extension records back into image attributes; unknown tags are skipped.
+
+    Raises:
+        ValueError: If a record runs past the end of the extension data.
+    """
+    attributes = {}
+    offset = 0
+    while offset < len(extra):
+        tag, length = _EXTRA_RECORD.unpack_from(extra, offset)
+        offset += _EXTRA_RECORD.size
+        value = extra[offset:offset + length]
+        if len(value) != length:
+            raise ValueError("Header extension data is truncated.")
+        offset += length
+        if tag == EXTRA_PALETTE:
+            attributes['palette'] = (_text(value[:8]), value[8:])
+        elif tag == EXTRA_TRANSPARENCY:
+            transparency = json.loads(value)
+            if isinstance(transparency, dict):
+                transparency = bytes.fromhex(transparency["bytes"])
+            elif isinstance(transparency, list):
+                transparency = tuple(transparency)
+            attributes['transparency'] = transparency
+        elif tag == EXTRA_ICC_PROFILE:
+            attributes['icc_profile'] = value
+        elif tag == EXTRA_STACK:
+            attributes['stack'] = _unpack_stack(value)
+    return attributes
+
+
+def _unpack_stack(value: bytes) -> tuple:
+    try:
+        height, count = _STACK.unpack_from(value)
+        entries, position = [], _STACK.size
+        for _ in range(count):
+            offset, length = _STACK_ENTRY.unpack_from(value, position)
+            position += _STACK_ENTRY.size + length
+            if position > len(value):
+                raise struct.error
+            entries.append((value[position - length:position].decode('utf-8'), offset))
+    except struct.error:
+        raise ValueError("Header extension data is truncated.") from None
+    return height, entries
+
+
+def _legacy_header(block: bytes, payload_size: int) -> Header:
+    metadata = json.loads(block.decode('utf-8').strip())
+    return Header(
+        salt=bytes.fromhex(metadata['salt']), iv=bytes.fromhex(metadata['iv']),
+        mode=metadata['mode'], shape=tuple(metadata['shape']),
+        payload=metadata.get('payload', PAYLOAD_PIXELS), ext=metadata.get('ext', ''),
+        payload_size=payload_size, version=1,
+    )
+
+
+def parse_header(f) -> Header:
+    """
+    Reads the header from an open binary file positioned at its start.
+
+    On return the file is positioned at the first payload byte.
+    """
+    start = f.tell()
+    fixed = f.read(HEADER_SIZE)
+    if fixed[:1] == b'{':
+        block = fixed + f.read(METADATA_SIZE - len(fixed))
+        end = f.seek(0, 2)
+        f.seek(start + METADATA_SIZE)
+        return _legacy_header(block, end - start - METADATA_SIZE)
+    if len(fixed) < HEADER_SIZE:
+        raise ValueError("Encrypted file is truncated.")
+    header = Header.unpack(fixed)
+    extra_size = _EXTRA_SIZE.unpack_from(fixed, _EXTRA_SIZE_OFFSET)[0]
+    if extra_size:
+        header.extra = f.read(extra_size)
+    return header
+
+
+def read_header(encrypted_path: str) -> Header:
+    """
+    Reads the header of an encrypted file without touching the payload.
+
+    Version 2 headers cost one small read and one ``struct.unpack``; legacy
+    JSON headers are parsed as before.
+
+    Args:
+        encrypted_path: Path to encrypted file.
+
+    Returns:
+        The parsed :class:`Header`.
+    """
+    with open(encrypted_path, 'rb') as f:
+        return parse_header(f)
+
+
+def iter_headers(root: str, suffix: str = '.enc'):
+    """
+    Walks a directory tree and reads the header of every encrypted file.
+
+    Args:
+        root: Directory to scan.
+        suffix: File name suffix identifying encrypted files.
+
+    Yields:
+        (path, header, error) tuples; exactly one of ``header``/``error`` is None.
+    """
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    try:
+                        yield entry.path, read_header(entry.path), None
+                    except (OSError, ValueError) as e:
+                        yield entry.path, None, e
@@ -1,39 +1,368 @@
-import json
+import contextlib
+import os
+import zlib
 import numpy as np
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
-from utils.image_loader import save_image, load_image
-from encryption.key_manager import KeyManager
+from config import CHUNK_SIZE
+from encryption.chunked import decrypt_chunks_into, iter_chunks, map_file
+from encryption.container import (PAYLOAD_PIXELS, PAYLOAD_FILE, PAYLOAD_ZLIB, CIPHER_AES_GCM,
+                                  FLAG_NATIVE, Header, parse_header, unpack_extra)
+from encryption.stream import (decrypt_from_file, display_name, is_path, iter_decrypted, open_input,
+                               open_output, progress_counter)
+from PIL import Image
+from utils.image_loader import PNG_MODES, native_image, native_layout, save_image, save_native
+from utils.tiff_writer import TiffStripWriter, tiff_supported
+from encryption.key_manager import KeyManager, make_kdf
+from utils.instrumentation import annotate, count, job, stage, timed_file
 
-def decrypt_image(encrypted_path: str, output_path: str, password: str):
+def output_path_for(output_path: str, header: Header) -> str:
     """
-    Decrypts an AES-CFB encrypted image using the password and stored salt.
+    Returns the path a decrypted file will actually be written to.
+
+    Files holding the original encoded bytes keep their original extension;
+    native pixels in a mode PNG cannot hold exactly are written as TIFF.
+    """
+    base, ext = os.path.splitext(output_path)
+    if header.payload == PAYLOAD_FILE:
+        return base + header.ext
+    if header.flags & FLAG_NATIVE and ext.lower() == '.png' and header.mode not in PNG_MODES:
+        return base + '.tiff'
+    return output_path
+
+def output_extension(header: Header) -> str:
+    """Returns the extension of the file a header decrypts to by default ('.png', '.tiff' or the original one)."""
+    return os.path.splitext(output_path_for('image.png', header))[1]
+
+def resolve_key(header: Header, password: str = None, key: bytes = None) -> bytes:
+    """Returns ``key`` if given, otherwise derives it from ``password`` with the header's KDF settings."""
+    if key is not None:
+        return key
+    if password is None:
+        raise ValueError("Either a password or a derived key is required.")
+    key, _ = KeyManager().generate_key_from_password(password, header.salt, make_kdf(header.kdf, header.kdf_params))
+    return key
+
+def _inflate_into(chunks, out: memoryview):
+    decompressor = zlib.decompressobj()
+    offset = 0
+    for chunk in chunks:
+        with stage('inflate'):
+            data = decompressor.decompress(chunk)
+        if offset + len(data) > len(out):
+            raise ValueError("Decompressed payload is larger than the image shape.")
+        out[offset:offset + len(data)] = data
+        offset += len(data)
+    if offset != len(out) or not decompressor.eof:
+        raise ValueError("Decompressed payload does not match the image shape.")
+
+def _inflate(chunks):
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        while chunk:
+            with stage('inflate'):
+                # Bounded steps, so a corrupt stream cannot inflate into one huge buffer
+                data = decompressor.decompress(chunk, CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+            yield data
+    if not decompressor.eof:
+        raise ValueError("Decompressed payload does not match the image shape.")
+
+def tiff_streamable(header: Header) -> bool:
+    """
+    Returns True if a TIFF output of this pixel file can be written strip by
+    strip as it is decrypted, without holding the whole image.
+    """
+    if header.payload == PAYLOAD_FILE:
+        return False
+    if not header.flags & FLAG_NATIVE:
+        return header.mode == 'RGB'  # Other modes are converted back from RGB as a whole
+    if header.mode in ('I', 'F') and np.dtype(header.dtype).str[0] != '<':
+        return False
+    return tiff_supported(header.mode, unpack_extra(header.extra))
+
+def _write_tiff(pieces, output_path, header: Header):
+    height, width = header.shape[:2]
+    if header.flags & FLAG_NATIVE:
+        mode, attributes = header.mode, unpack_extra(header.extra)
+        row_bytes = native_layout(mode, width, height)[2]
+    else:
+        mode, attributes, row_bytes = 'RGB', None, width * 3
+    rows_per_strip = None
+    if header.cipher == CIPHER_AES_GCM and header.payload == PAYLOAD_PIXELS:
+        rows_per_strip = header.chunk_size // row_bytes  # One strip per chunk
+    with open_output(output_path) as raw:
+        with TiffStripWriter(timed_file(raw), mode, (width, height), attributes, rows_per_strip) as writer:
+            for piece in pieces:
+                with stage('encode'):
+                    writer.write(piece)
+
+def pixel_layout(header: Header) -> tuple[tuple, np.dtype]:
+    """
+    Returns the (shape, dtype) of the array a pixel payload decrypts into.
+
+    Native '1' images are packed, so their array is (height, row_bytes) bytes
+    rather than ``header.shape``.
+    """
+    if header.flags & FLAG_NATIVE and header.mode == '1':
+        height, width = header.shape[:2]
+        return (height, native_layout('1', width, height)[2]), np.dtype(np.uint8)
+    return tuple(header.shape), np.dtype(header.dtype)
+
+def pixel_buffer(header: Header) -> np.ndarray:
+    """Allocates the array a pixel payload decrypts into (see :func:`pixel_layout`)."""
+    shape, dtype = pixel_layout(header)
+    return np.empty(shape, dtype=dtype)
+
+def _cfb_decryptor(header: Header, key: bytes):
+    return Cipher(algorithms.AES(key), modes.CFB(header.iv), backend=default_backend()).decryptor()
+
+def _decrypt_payload(f, header: Header, key: bytes, chunk_size: int, workers: int, output_path,
+                     advance=None, pixels: np.ndarray = None, tiff: bool = False):
+    """
+    Decrypts the payload of an open container; returns the pixel array, or None
+    when it was written to ``output_path`` directly (file payloads, and pixels
+    streamed into a TIFF when ``tiff`` is set).
+
+    Pixels are decrypted into ``pixels`` when given, otherwise into a new array.
+    """
+    with contextlib.ExitStack() as stack:
+        buf = None
+        if header.cipher == CIPHER_AES_GCM:
+            buf = stack.enter_context(map_file(f))
+
+        if header.payload in (PAYLOAD_FILE, PAYLOAD_ZLIB) or tiff:
+            if buf is not None:
+                chunks = (plaintext for _, plaintext in iter_chunks(key, header, buf, advance=advance))
+            else:
+                chunks = iter_decrypted(_cfb_decryptor(header, key), f, chunk_size, advance)
+            # Closing the generator before the map releases its views of the map
+            chunks = stack.enter_context(contextlib.closing(chunks))
+
+        if header.payload == PAYLOAD_FILE:
+            with open_output(output_path) as raw:
+                out = timed_file(raw)
+                for chunk in chunks:
+                    out.write(chunk)
+            return None
+
+        if tiff:
+            _write_tiff(_inflate(chunks) if header.payload == PAYLOAD_ZLIB else chunks, output_path, header)
+            return None
+
+        decrypted_array = pixel_buffer(header) if pixels is None else pixels
+        out = memoryview(decrypted_array).cast('B')
+        if header.payload == PAYLOAD_ZLIB:
+            _inflate_into(chunks, out)
+        elif buf is not None:
+            decrypt_chunks_into(key, header, buf, out, workers, advance=advance)
+        else:
+            decrypt_from_file(_cfb_decryptor(header, key), timed_file(f), out, chunk_size, advance)
+        return decrypted_array
+
+def _native_order(pixels: np.ndarray, header: Header) -> np.ndarray:
+    if header.mode in ('I', 'F') and not pixels.dtype.isnative:
+        return pixels.byteswap()  # Written on a machine of the other byte order
+    return pixels
+
+def pixels_to_image(pixels: np.ndarray, header: Header) -> Image.Image:
+    """
+    Wraps decrypted pixels as a Pillow image, without a copy where Pillow allows it.
+
+    Native pixels keep their mode and palette, with transparency and ICC
+    profile in ``img.info``; the image shares ``pixels``' memory for modes
+    Pillow stores as-is (L, P, I, F, RGBA, CMYK, I;16, ...), so it is only
+    valid while ``pixels`` is. RGB pixels of files written with ``native=False``
+    are converted back to the original mode.
 
     Args:
-        encrypted_path: Path to encrypted file.
-        output_path: Path to save decrypted image.
+        pixels: Output of :func:`decrypt_to_array` for ``header``.
+        header: The file's header.
+    """
+    height, width = header.shape[:2]
+    if not header.flags & FLAG_NATIVE:
+        img = Image.fromarray(pixels, 'RGB')
+        return img if img.mode == header.mode else img.convert(header.mode)
+    attributes = unpack_extra(header.extra)
+    img = native_image(_native_order(pixels, header), header.mode, (width, height), attributes)
+    img.info.update({name: attributes[name] for name in ('transparency', 'icc_profile') if name in attributes})
+    return img
+
+def _save_pixels(pixels: np.ndarray, output_path, header: Header, image_format: str = None):
+    if not header.flags & FLAG_NATIVE:
+        save_image(pixels, output_path, header.mode, image_format)
+        return
+    pixels = _native_order(pixels, header)
+    height, width = header.shape[:2]
+    save_native(pixels, output_path, header.mode, (width, height), unpack_extra(header.extra), image_format)
+
+def decrypt_image(encrypted_path, output_path, password: str = None,
+                  key: bytes = None, chunk_size: int = CHUNK_SIZE, workers: int = None,
+                  progress=None, verbose: bool = True):
+    """
+    Decrypts an encrypted image using the password and stored salt.
+
+    Ciphertext is decrypted directly into a preallocated pixel array, so peak
+    memory is one decoded image plus one chunk. Chunked AES-GCM files are
+    authenticated chunk by chunk, decrypted across ``workers`` threads and
+    fail on the first chunk when the password is wrong. Files holding the
+    original encoded bytes are streamed back to disk unchanged, with the
+    original extension in place of ``output_path``'s. Pixels stored in their
+    own mode are saved exactly, with their palette and transparency, as TIFF
+    if PNG cannot hold the mode.
+
+    TIFF outputs (``.tif``/``.tiff``, including that fallback) are written
+    strip by strip, one strip per chunk, as the payload is decrypted in order
+    (see :func:`tiff_streamable`), so memory stays at one chunk however large
+    the image is.
+
+    Both ends may be open binary file objects instead of paths. An
+    ``io.BytesIO`` input is decrypted in place without a copy; a file object
+    output receives the bytes of the file :func:`output_extension` names
+    (PNG or TIFF pixels, or the original encoded file).
+
+    Args:
+        encrypted_path: Path to encrypted file, or a binary file object
+            holding only the container.
+        output_path: Path to save decrypted image, or a writable binary file object.
         password: Password for key derivation.
+        key: Already derived key; skips key derivation when given.
+        chunk_size: Bytes decrypted per cipher update (AES-CFB files).
+        workers: Decryption threads for chunked files; defaults to the CPU count.
+        progress: Optional ``progress(done, total)`` callback, called with the
+            number of payload bytes decrypted so far after every chunk (from
+            the worker threads for chunked files). An exception raised by the
+            callback aborts decryption.
+        verbose: Print a confirmation when done.
+
+    Returns:
+        The path the decrypted image was written to, or ``output_path``
+        itself for a file object.
     """
-    with open(encrypted_path, 'rb') as f:
-        file_data = f.read()
+    with job('decrypt', path=display_name(encrypted_path)):
+        with open_input(encrypted_path) as f:
+            with stage('header'):
+                header = parse_header(f)
+            annotate(payload=header.payload, cipher=header.cipher, version=header.version)
+            count('payload_bytes', header.payload_size)
+            key = resolve_key(header, password, key)
+            image_format = None
+            if is_path(output_path):
+                output_path = output_path_for(output_path, header)
+                tiff = os.path.splitext(output_path)[1].lower() in ('.tif', '.tiff')
+            else:
+                image_format = output_extension(header)[1:].upper()
+                tiff = image_format == 'TIFF'
+            tiff = tiff and tiff_streamable(header)
+            advance = progress_counter(progress, header.payload_size)
+            with stage('cipher'):
+                decrypted_array = _decrypt_payload(f, header, key, chunk_size, workers, output_path, advance,
+                                                   tiff=tiff)
+
+        if decrypted_array is not None:
+            _save_pixels(decrypted_array, output_path, header, image_format)
+
+    if verbose:
+        print(f"✅ Image decrypted successfully: {display_name(output_path)}")
+    return output_path
+
+def decrypt_to_array(encrypted_path, password: str = None, key: bytes = None, out: np.ndarray = None,
+                     memmap_path: str = None, chunk_size: int = CHUNK_SIZE, workers: int = None,
+                     progress=None) -> np.ndarray:
+    """
+    Decrypts a pixel file straight into a NumPy array, without encoding an image.
+
+    The container is memory-mapped (chunked AES-GCM) or streamed (AES-CFB)
+    and every chunk is decrypted in place into the array, so the only
+    full-size allocation is the array itself; use :func:`pixels_to_image` to
+    hand it to Pillow. With ``memmap_path`` the array is a ``.npy`` file
+    mapped from disk instead, so even images larger than memory can be
+    decrypted; reopen it later with ``np.load(memmap_path, mmap_mode='r')``.
+
+    Args:
+        encrypted_path: Path to encrypted file, or a binary file object.
+        password: Password for key derivation.
+        key: Already derived key; skips key derivation when given.
+        out: Preallocated C-contiguous array of :func:`pixel_layout`'s shape
+            and dtype to decrypt into.
+        memmap_path: Create the output as a memory-mapped ``.npy`` file here;
+            cannot be combined with ``out``.
+        chunk_size: Bytes decrypted per cipher update (AES-CFB files).
+        workers: Decryption threads for chunked files; defaults to the CPU count.
+        progress: Optional ``progress(done, total)`` callback (see :func:`decrypt_image`).
+
+    Returns:
+        The pixels: ``out``, an ``np.memmap`` or a new array.
+
+    Raises:
+        ValueError: If both ``out`` and ``memmap_path`` are given, or ``out``
+            does not match the image.
+    """
+    if out is not None and memmap_path is not None:
+        raise ValueError("Pass either out or memmap_path, not both.")
+    with job('decrypt_array', path=display_name(encrypted_path)):
+        with open_input(encrypted_path) as f:
+            with stage('header'):
+                header = parse_header(f)
+            if header.payload == PAYLOAD_FILE:
+                raise ValueError("The file holds the original encoded image, not pixels; use decrypt_image.")
+            shape, dtype = pixel_layout(header)
+            if out is not None and (out.shape != shape or out.dtype != dtype
+                                    or not out.flags.c_contiguous or not out.flags.writeable):
+                raise ValueError(f"Output must be a writable C-contiguous {dtype} array of shape {shape}.")
+            key = resolve_key(header, password, key)
+            if memmap_path is not None:
+                out = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=dtype, shape=shape)
+            count('payload_bytes', header.payload_size)
+            advance = progress_counter(progress, header.payload_size)
+            try:
+                with stage('cipher'):
+                    pixels = _decrypt_payload(f, header, key, chunk_size, workers, None, advance, out)
+            except BaseException:
+                if memmap_path is not None:
+                    del out
+                    with contextlib.suppress(OSError):  # Still mapped on Windows
+                        os.remove(memmap_path)
+                raise
+        if memmap_path is not None:
+            pixels.flush()
+    return pixels
 
-    padded_metadata = file_data[:512].decode('utf-8').strip()
-    encrypted_content = file_data[512:]
+def decrypt_rows(encrypted_path: str, row_start: int, row_stop: int, password: str = None,
+                 key: bytes = None, workers: int = None) -> np.ndarray:
+    """
+    Decrypts only the rows ``row_start``..``row_stop - 1`` of a chunked pixel file.
 
-    metadata = json.loads(padded_metadata)
-    shape = tuple(metadata['shape'])
-    mode = metadata['mode']
-    iv = bytes.fromhex(metadata['iv'])
-    salt = bytes.fromhex(metadata['salt'])
+    Only the chunks covering the requested rows are read and authenticated.
 
-    key_manager = KeyManager()
-    key, _ = key_manager.generate_key_from_password(password, salt)
+    Args:
+        encrypted_path: Path to encrypted file.
+        row_start: First row to return.
+        row_stop: One past the last row to return.
+        password: Password for key derivation.
+        key: Already derived key; skips key derivation when given.
+        workers: Decryption threads; defaults to the CPU count.
 
-    cipher = Cipher(algorithms.AES(key), modes.CFB(iv), backend=default_backend())
-    decryptor = cipher.decryptor()
-    decrypted_data = decryptor.update(encrypted_content) + decryptor.finalize()
+    Returns:
+        A NumPy array of shape ``(row_stop - row_start, width, channels)``.
+    """
+    with open(encrypted_path, 'rb') as f:
+        header = parse_header(f)
+        if header.cipher != CIPHER_AES_GCM or header.payload != PAYLOAD_PIXELS:
+            raise ValueError("Row access needs a chunked AES-GCM file with a pixel payload.")
+        if header.flags & FLAG_NATIVE and header.mode == '1':
+            raise ValueError("Row access is not supported for packed 1-bit images.")
+        height = header.shape[0]
+        if not 0 <= row_start < row_stop <= height:
+            raise ValueError(f"Row range {row_start}:{row_stop} is outside 0:{height}.")
+        key = resolve_key(header, password, key)
 
-    decrypted_array = np.frombuffer(decrypted_data, dtype=np.uint8).reshape(shape)
-    save_image(decrypted_array, output_path, mode)
+        row_bytes = int(np.prod(header.shape[1:])) * np.dtype(header.dtype).itemsize
+        rows_per_chunk = header.chunk_size // row_bytes
+        first, stop = row_start // rows_per_chunk, (row_stop - 1) // rows_per_chunk + 1
+        band_start, band_stop = first * rows_per_chunk, min(stop * rows_per_chunk, height)
+        band = np.empty((band_stop - band_start,) + tuple(header.shape[1:]), dtype=np.dtype(header.dtype))
+        with map_file(f) as buf:
+            decrypt_chunks_into(key, header, buf, memoryview(band).cast('B'), workers, first, stop)
 
-    print(f"✅ Image decrypted successfully: {output_path}")
+    return band[row_start - band_start:row_stop - band_start]
@@ -0,0 +1,230 @@
+"""
+Content-addressed reuse of encrypted outputs.
+
+Ingest often re-encrypts images it has already encrypted. With a
+:class:`DedupIndex`, the source bytes are hashed (SHA-256, streamed) and
+looked up together with a key id and the encryption options; if an encrypted
+file for the same content, key and options still exists, it is reused and
+the decode and encrypt are skipped.
+
+The key id never reveals the password: it is an HMAC under a key derived
+from the password with the index's own random salt and the configured KDF,
+so guessing passwords from the index costs a full key derivation per guess.
+A reused file is decryptable with the same password, though its salt is the
+one of the original encryption.
+
+The index is a SQLite file holding at most ``max_entries`` rows; the least
+recently used are evicted first. Evicting a row never deletes the encrypted
+file itself. Hit, miss, stale and eviction counts are kept in the index.
+"""
+import hashlib
+import hmac
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from config import CHUNK_SIZE, DEDUP_MAX_ENTRIES
+from encryption.container import MAGIC, PAYLOAD_PIXELS, CIPHER_AES_GCM
+from encryption.key_manager import Kdf, KeyManager, make_kdf
+
+STATS = ('hits', 'misses', 'stale', 'evictions')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    content_hash BLOB NOT NULL,
+    key_id BLOB NOT NULL,
+    options TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (content_hash, key_id, options)
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value BLOB NOT NULL);
+"""
+
+
+def content_hash(source) -> bytes:
+    """Returns the SHA-256 digest of a file (path or binary file object), read in chunks."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return hashlib.file_digest(f, 'sha256').digest()
+    digest = hashlib.sha256()
+    while chunk := source.read(CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.digest()
+
+
+def options_tag(payload: str = PAYLOAD_PIXELS, cipher: str = CIPHER_AES_GCM, native: bool = True,
+                kdf: Kdf = None) -> str:
+    """Returns the encryption options an output must have been made with, as one string."""
+    kdf = kdf or make_kdf()
+    params = ','.join(str(value) for value in kdf.params)
+    return f"{payload}/{cipher}/{'native' if native else 'rgb'}/{kdf.name}:{params}"
+
+
+class DedupIndex:
+    """
+    SQLite index from (content hash, key id, options) to an encrypted file.
+
+    Safe to share between threads; use one process at a time.
+
+    Args:
+        path: SQLite file; created if missing.
+        max_entries: Rows kept before the least recently used are evicted.
+    """
+    def __init__(self, path: str, max_entries: int = DEDUP_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # The index only saves work, so a lost last write after a power cut is acceptable
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.execute("INSERT OR IGNORE INTO meta VALUES ('salt', ?)", (os.urandom(16),))
+        for name in STATS:
+            self._db.execute("INSERT OR IGNORE INTO meta VALUES (?, 0)", (name,))
+        self._salt = self._db.execute("SELECT value FROM meta WHERE name = 'salt'").fetchone()[0]
+        self._rows = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def key_id(self, password: str, kdf: Kdf = None) -> bytes:
+        """Returns the id files encrypted with ``password`` are indexed under (cached per session)."""
+        key, _ = KeyManager().generate_key_from_password(password, self._salt, kdf)
+        return hmac.new(key, b'dedup key id', hashlib.sha256).digest()[:16]
+
+    def _count(self, name: str, n: int = 1):
+        self._db.execute("UPDATE meta SET value = value + ? WHERE name = ?", (n, name))
+
+    def lookup(self, digest: bytes, key_id: bytes, options: str) -> str:
+        """
+        Returns the path of a still valid encrypted file for this content, or None.
+
+        A file counts as valid if its size and modification time are as
+        recorded and it starts with a container header; rows for files that
+        changed or vanished are dropped.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, size, mtime_ns FROM entries WHERE content_hash = ? AND key_id = ? AND options = ?",
+                (digest, key_id, options)).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+            path, size, mtime_ns = row
+            if not _unchanged(path, size, mtime_ns):
+                self._db.execute("DELETE FROM entries WHERE content_hash = ? AND key_id = ? AND options = ?",
+                                 (digest, key_id, options))
+                self._rows -= 1
+                self._count('stale')
+                self._count('misses')
+                return None
+            self._db.execute("UPDATE entries SET last_used = ? WHERE content_hash = ? AND key_id = ? AND options = ?",
+                             (time.time(), digest, key_id, options))
+            self._count('hits')
+            return path
+
+    def record(self, digest: bytes, key_id: bytes, options: str, path: str):
+        """Indexes a freshly written encrypted file, evicting the oldest rows beyond ``max_entries``."""
+        st = os.stat(path)
+        with self._lock:
+            replaced = self._db.execute(
+                "SELECT 1 FROM entries WHERE content_hash = ? AND key_id = ? AND options = ?",
+                (digest, key_id, options)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (digest, key_id, options, os.path.abspath(path), st.st_size, st.st_mtime_ns,
+                              time.time()))
+            self._rows += not replaced
+            excess = self._rows - self.max_entries
+            if excess > 0:
+                self._db.execute("DELETE FROM entries WHERE rowid IN "
+                                 "(SELECT rowid FROM entries ORDER BY last_used LIMIT ?)", (excess,))
+                self._rows -= excess
+                self._count('evictions', excess)
+
+    def prune(self) -> int:
+        """Drops rows whose encrypted file changed or vanished; returns how many."""
+        with self._lock:
+            rows = self._db.execute("SELECT rowid, path, size, mtime_ns FROM entries").fetchall()
+            stale = [(rowid,) for rowid, path, size, mtime_ns in rows if not _unchanged(path, size, mtime_ns)]
+            self._db.executemany("DELETE FROM entries WHERE rowid = ?", stale)
+            self._rows -= len(stale)
+            self._count('stale', len(stale))
+        return len(stale)
+
+    def stats(self) -> dict:
+        """Returns the entry count, the size bound and the hit/miss/stale/eviction counters."""
+        with self._lock:
+            counters = dict(self._db.execute(
+                f"SELECT name, value FROM meta WHERE name IN ({','.join('?' * len(STATS))})", STATS))
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = counters['hits'] + counters['misses']
+        return {"entries": entries, "max_entries": self.max_entries, **counters,
+                "hit_rate": round(counters['hits'] / lookups, 4) if lookups else 0.0}
+
+    def close(self):
+        """Closes the database."""
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _unchanged(path: str, size: int, mtime_ns: int) -> bool:
+    try:
+        st = os.stat(path)
+        if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+            return False
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def link_or_copy(source: str, target: str):
+    """Hard-links ``source`` to ``target``, or copies it where links are not possible."""
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def encrypt_deduplicated(index: DedupIndex, image_path: str, output_path: str, password: str,
+                         kdf: Kdf = None, **options) -> tuple[str, bool]:
+    """
+    Encrypts an image unless the index already has an encrypted file for its content.
+
+    Args:
+        index: The dedup index.
+        image_path: Path to the image.
+        output_path: Where a new encrypted file is written on a miss.
+        password: Password; the key is derived with a fresh salt on a miss.
+        kdf: KDF and parameters (see :func:`make_kdf`).
+        **options: ``payload``, ``cipher``, ``native`` and the other
+            :func:`encrypt_image` options.
+
+    Returns:
+        (path, reused): the existing file and True on a hit, else
+        ``output_path`` and False.
+    """
+    from encryption.encryptor import encrypt_image
+
+    kdf = kdf or make_kdf()
+    digest = content_hash(image_path)
+    key_id = index.key_id(password, kdf)
+    tag = options_tag(options.get('payload', PAYLOAD_PIXELS), options.get('cipher', CIPHER_AES_GCM),
+                      options.get('native', True), kdf)
+    existing = index.lookup(digest, key_id, tag)
+    if existing is not None:
+        return existing, True
+    key, salt = KeyManager().generate_key_from_password(password, kdf=kdf)
+    encrypt_image(image_path, output_path, key, salt, kdf=kdf, **options)
+    index.record(digest, key_id, tag, output_path)
+    return output_path, False
@@ -1,43 +1,156 @@
 import os
-import json
-import numpy as np
+import zlib
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
-from utils.image_loader import load_image, save_image
+from config import CHUNK_SIZE
+from encryption.chunked import encrypt_chunks, write_index
+from encryption.container import (PAYLOAD_PIXELS, PAYLOAD_FILE, PAYLOAD_ZLIB, PAYLOAD_TYPES,
+                                  CIPHER_AES_GCM, CIPHERS, FLAG_NATIVE, Header, pack_extra)
+from encryption.key_manager import Kdf, make_kdf
+from encryption.stream import (display_name, encrypt_to_file, is_path, open_input, open_output,
+                               progress_counter, tracked)
+from utils.image_loader import format_extension, native_layout, open_image_bands, probe_image
+from utils.instrumentation import count, job, stage, timed_file
 
-def encrypt_image(image_path: str, output_path: str, key: bytes, salt: bytes):
+def _read_chunks(f, chunk_size: int):
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def _deflate(bands, level: int):
+    compressor = zlib.compressobj(level)
+    for band in bands:
+        with stage('compress'):
+            compressed = compressor.compress(band)
+        if compressed:
+            yield compressed
+    with stage('compress'):
+        tail = compressor.flush()
+    yield tail
+
+def write_container(output, header: Header, key: bytes, pieces, chunk_size: int):
     """
-    Encrypts an image using AES-CFB, stores IV + salt in metadata.
+    Writes a header and the payload encrypted from ``pieces`` with ``header.cipher``.
+
+    The header is written first and rewritten once the payload size and the
+    chunk table offset are known, so ``output`` must be seekable.
 
     Args:
-        image_path: Path to input image.
-        output_path: Path to save encrypted file.
-        key: Encryption key (bytes).
-        salt: Salt used for key derivation.
+        output: Path, or a writable binary file object.
+        header: The container header; its sizes and offsets are filled in.
+        key: AES key.
+        pieces: Iterable of plaintext buffers, in order. AES-GCM looks one
+            buffer ahead, so a buffer must stay valid while the next is produced.
+        chunk_size: Bytes encrypted per cipher update (AES-CFB).
+    """
+    with open_output(output) as raw:
+        f = timed_file(raw)
+        start = f.tell()
+        f.write(header.pack())
+        with stage('cipher'):
+            if header.cipher == CIPHER_AES_GCM:
+                entries = encrypt_chunks(key, header, pieces, f)
+                header.index_offset = f.tell() - start
+                write_index(f, entries)
+            else:
+                cipher = Cipher(algorithms.AES(key), modes.CFB(header.iv), backend=default_backend())
+                encrypt_to_file(cipher.encryptor(), pieces, f, chunk_size)
+        # Sizes and offsets are only known once the payload is written
+        end = f.tell()
+        header.payload_size = (header.index_offset or end - start) - header.data_offset
+        f.seek(start)
+        f.write(header.pack())
+        f.seek(end)
+    count('payload_bytes', header.payload_size)
+
+def encrypt_image(image_path, output_path, key: bytes, salt: bytes,
+                  chunk_size: int = CHUNK_SIZE, payload: str = PAYLOAD_PIXELS,
+                  compress_level: int = 1, cipher: str = CIPHER_AES_GCM, progress=None,
+                  native: bool = True, kdf: Kdf = None, verbose: bool = True):
     """
-    image_array, mode = load_image(image_path)
-    if image_array is None or mode is None:
-        raise ValueError("Failed to load image.")
+    Encrypts an image using chunked AES-GCM (or AES-CFB), stores IV + salt in the file header.
+
+    The decoded image is encrypted one row band at a time and streamed to
+    disk, so peak memory is the decoded image plus one chunk. By default the
+    pixels stay in the image's own mode (no RGB conversion, so grayscale and
+    paletted images are a third of the size), with palette, transparency and
+    ICC profile kept in the header; ``native=False`` or a mode outside
+    ``NATIVE_LAYOUTS`` stores RGB as before. With ``payload='file'`` the
+    original encoded bytes are encrypted as-is and nothing is decoded;
+    ``payload='zlib'`` deflates the pixel stream before encryption.
 
-    data = image_array.tobytes()
-    iv = os.urandom(16)
-    cipher = Cipher(algorithms.AES(key), modes.CFB(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
-    encrypted_data = encryptor.update(data) + encryptor.finalize()
+    With the default ``cipher='aes-gcm-chunked'`` every ``chunk_size`` piece
+    of the payload (whole row bands for pixels) is sealed independently, so
+    files can be decrypted in parallel, by row range, and are authenticated.
 
-    metadata = {
-        "shape": image_array.shape,
-        "mode": mode,
-        "iv": iv.hex(),
-        "salt": salt.hex()   # Store salt for decryption
-    }
+    Both ends may be open binary file objects instead of paths (e.g.
+    ``io.BytesIO``), so images can be encrypted in memory; the output must be
+    seekable, as the header is rewritten once the payload size is known.
 
-    metadata_json = json.dumps(metadata)
-    padded_metadata = metadata_json.ljust(512, ' ').encode('utf-8')
+    Args:
+        image_path: Path to input image, or a binary file object holding it.
+        output_path: Path to save encrypted file, or a writable binary file object.
+        key: Encryption key (bytes).
+        salt: Salt used for key derivation.
+        chunk_size: Bytes encrypted per cipher update.
+        payload: One of 'pixels', 'file' or 'zlib'.
+        compress_level: zlib level used for the 'zlib' payload.
+        cipher: 'aes-gcm-chunked' or 'aes-cfb'.
+        progress: Optional ``progress(done, total)`` callback, called with the
+            number of source bytes encrypted so far after every chunk. An
+            exception raised by the callback aborts the job and removes
+            ``output_path``.
+        native: Store pixels in the image's own mode instead of RGB.
+        kdf: KDF ``key`` was derived with, recorded in the header; defaults
+            to the configured one, as for ``generate_key_from_password``.
+        verbose: Print a confirmation when done.
+    """
+    if payload not in PAYLOAD_TYPES:
+        raise ValueError(f"Unknown payload type: {payload}")
+    if cipher not in CIPHERS:
+        raise ValueError(f"Unknown cipher: {cipher}")
 
-    final_file_data = padded_metadata + encrypted_data
+    with job('encrypt', path=display_name(image_path), payload=payload, cipher=cipher):
+        iv = os.urandom(16)
+        kdf = kdf or make_kdf()
+        chunked = cipher == CIPHER_AES_GCM
 
-    with open(output_path, 'wb') as f:
-        f.write(final_file_data)
+        if payload == PAYLOAD_FILE:
+            with open_input(image_path) as raw:
+                start = raw.tell()
+                shape, mode, image_format = probe_image(raw)
+                if is_path(image_path):
+                    ext = os.path.splitext(image_path)[1].lower()
+                else:
+                    ext = format_extension(image_format)
+                header = Header(salt=salt, iv=iv, mode=mode, shape=shape, payload=payload, cipher=cipher,
+                                kdf=kdf.name, kdf_params=kdf.params, ext=ext, chunk_size=chunk_size if chunked else 0)
+                source_bytes = raw.seek(0, os.SEEK_END) - start
+                raw.seek(start)
+                count('source_bytes', source_bytes)
+                pieces = tracked(_read_chunks(timed_file(raw), chunk_size), progress_counter(progress, source_bytes))
+                write_container(output_path, header, key, pieces, chunk_size)
+        else:
+            with open_image_bands(image_path, chunk_size, native) as (shape, mode, bands, attributes):
+                header = Header(salt=salt, iv=iv, mode=mode, shape=shape, payload=payload, cipher=cipher,
+                                kdf=kdf.name, kdf_params=kdf.params)
+                row_bytes = shape[1] * 3
+                if attributes is not None:
+                    _, header.dtype, row_bytes = native_layout(mode, shape[1], shape[0])
+                    header.flags |= FLAG_NATIVE
+                    header.extra = pack_extra(attributes)
+                source_bytes = shape[0] * row_bytes
+                count('source_bytes', source_bytes)
+                bands = tracked(bands, progress_counter(progress, source_bytes))
+                if payload == PAYLOAD_ZLIB:
+                    bands = _deflate(bands, compress_level)
+                    header.chunk_size = chunk_size if chunked else 0
+                elif chunked:
+                    # One chunk per band of whole rows, matching open_image_bands
+                    header.chunk_size = max(1, chunk_size // row_bytes) * row_bytes
+                write_container(output_path, header, key, bands, chunk_size)
 
-    print(f"✅ Image encrypted successfully: {output_path}")
+    if verbose:
+        print(f"✅ Image encrypted successfully: {display_name(output_path)}")
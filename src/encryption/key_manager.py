@@ -1,32 +1,256 @@
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from collections import OrderedDict, namedtuple
+import hashlib
+import hmac
 import os
+import threading
+import time
+
+from config import KDF, KDF_PARAMS, KEY_CACHE_SIZE, KEY_CACHE_TTL, SCRYPT_MAX_MEMORY
+from encryption.container import KDF_PBKDF2_SHA256, KDF_SCRYPT
+from utils.instrumentation import count, stage
+
+PBKDF2_ITERATIONS = 100000
+PBKDF2_MIN_ITERATIONS = 10000
+SCRYPT_MIN_N = 2 ** 14  # The interactive-login cost of RFC 7914
+SCRYPT_R, SCRYPT_P = 8, 1
+
+# KDF name -> default parameters, as stored in the header's three uint32 fields:
+# (iterations, 0, 0) for PBKDF2 and (n, r, p) for scrypt
+KDF_DEFAULTS = {KDF_PBKDF2_SHA256: (PBKDF2_ITERATIONS, 0, 0), KDF_SCRYPT: (2 ** 15, SCRYPT_R, SCRYPT_P)}
+
+Kdf = namedtuple('Kdf', 'name params')
+
+
+def scrypt_memory(n: int, r: int) -> int:
+    """Returns the bytes of memory one scrypt derivation with cost ``n`` and block size ``r`` needs."""
+    return 128 * n * r
+
+
+def make_kdf(name: str = None, params=None) -> Kdf:
+    """
+    Builds and validates a KDF choice.
+
+    Settings read from a file header go through here too, so a crafted file
+    cannot make decryption allocate more than ``SCRYPT_MAX_MEMORY``.
+
+    Args:
+        name: 'pbkdf2-sha256' or 'scrypt'; defaults to ``config.KDF``.
+        params: Up to three parameters (see ``KDF_DEFAULTS``); missing ones
+            are zero. Defaults to ``config.KDF_PARAMS`` for the configured
+            KDF, else the KDF's own defaults.
+
+    Returns:
+        A ``Kdf(name, params)`` tuple with exactly three parameters.
+
+    Raises:
+        ValueError: For an unknown KDF or out-of-range parameters.
+    """
+    name = name or KDF
+    if name not in KDF_DEFAULTS:
+        raise ValueError(f"Unknown KDF: {name}")
+    if params is None:
+        params = KDF_PARAMS if name == KDF and KDF_PARAMS else KDF_DEFAULTS[name]
+    params = tuple(int(value) for value in params)
+    if len(params) > 3:
+        raise ValueError(f"{name} takes at most three parameters.")
+    params += (0,) * (3 - len(params))
+    if name == KDF_PBKDF2_SHA256:
+        if params[0] < 1 or any(params[1:]):
+            raise ValueError(f"Invalid PBKDF2 parameters: {params}")
+    else:
+        n, r, p = params
+        if n < 2 or n & (n - 1) or r < 1 or p < 1 or r * p >= 2 ** 30:
+            raise ValueError(f"Invalid scrypt parameters: {params}")
+        if scrypt_memory(n, r) > SCRYPT_MAX_MEMORY:
+            raise ValueError(f"scrypt parameters {params} need {scrypt_memory(n, r) >> 20} MiB, "
+                             f"more than the {SCRYPT_MAX_MEMORY >> 20} MiB limit.")
+    return Kdf(name, params)
+
+
+def derive_key(password: str, salt: bytes, kdf: Kdf) -> bytes:
+    """Runs the KDF and returns a 256-bit AES key; uncached, see :class:`KeyManager`."""
+    if kdf.name == KDF_SCRYPT:
+        n, r, p = kdf.params
+        return Scrypt(salt=salt, length=32, n=n, r=r, p=p).derive(password.encode())
+    return PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,  # 256-bit AES key
+        salt=salt,
+        iterations=kdf.params[0],
+    ).derive(password.encode())
+
+
+def _time_kdf(kdf: Kdf) -> float:
+    start = time.perf_counter()
+    derive_key('calibration', bytes(16), kdf)
+    return time.perf_counter() - start
+
+
+def calibrate_kdf(name: str = None, target: float = 0.25,
+                  max_memory: int = SCRYPT_MAX_MEMORY) -> tuple[Kdf, float]:
+    """
+    Picks KDF parameters that take about ``target`` seconds on this machine.
+
+    PBKDF2 is timed at a small iteration count and scaled linearly. scrypt
+    keeps r=8, p=1 and doubles ``n`` while the measured time stays within the
+    target and the memory within ``max_memory``. Neither goes below
+    ``PBKDF2_MIN_ITERATIONS`` / ``SCRYPT_MIN_N``, however slow the machine.
+
+    Args:
+        name: KDF to calibrate; defaults to ``config.KDF``.
+        target: Wanted derivation time in seconds: short for interactive
+            decryption, longer where only batch throughput matters.
+        max_memory: Largest scrypt memory cost in bytes.
+
+    Returns:
+        (kdf, seconds): the chosen :class:`Kdf` and its measured time.
+    """
+    name = name or KDF
+    if name not in KDF_DEFAULTS:
+        raise ValueError(f"Unknown KDF: {name}")
+    if name == KDF_PBKDF2_SHA256:
+        iterations = PBKDF2_MIN_ITERATIONS
+        elapsed = _time_kdf(make_kdf(name, (iterations,)))
+        while elapsed < min(0.05, target / 2):  # Long enough to time reliably
+            iterations *= 2
+            elapsed = _time_kdf(make_kdf(name, (iterations,)))
+        iterations = max(PBKDF2_MIN_ITERATIONS, int(iterations * target / elapsed) // 1000 * 1000)
+        kdf = make_kdf(name, (iterations,))
+        return kdf, _time_kdf(kdf)
+
+    n = SCRYPT_MIN_N
+    kdf = make_kdf(name, (n, SCRYPT_R, SCRYPT_P))
+    elapsed = _time_kdf(kdf)
+    # Doubling n doubles the time; stop before the next step would overshoot
+    while elapsed * 2 <= target and scrypt_memory(n * 2, SCRYPT_R) <= min(max_memory, SCRYPT_MAX_MEMORY):
+        n *= 2
+        kdf = make_kdf(name, (n, SCRYPT_R, SCRYPT_P))
+        elapsed = _time_kdf(kdf)
+    return kdf, elapsed
+
+
+class KeyCache:
+    """
+    Bounded, time-limited in-memory cache of derived keys.
+
+    Entries are keyed by (password digest, salt, KDF and its parameters). The password is
+    never stored; its digest is an HMAC under a per-process random secret.
+    Cached keys live in bytearrays so they can be overwritten on eviction.
+    """
+    def __init__(self, max_entries: int = KEY_CACHE_SIZE, ttl: float = KEY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._secret = os.urandom(32)
+
+    def _cache_key(self, password: str, salt: bytes, kdf: Kdf) -> tuple:
+        digest = hmac.new(self._secret, password.encode(), hashlib.sha256).digest()
+        return digest, bytes(salt), kdf.name, tuple(kdf.params)
+
+    def get(self, password: str, salt: bytes, kdf: Kdf) -> bytes:
+        """Returns the cached key, or None if it is missing or expired."""
+        cache_key = self._cache_key(password, salt, kdf)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            key, expires_at = entry
+            if time.monotonic() >= expires_at:
+                self._drop(cache_key)
+                return None
+            self._entries.move_to_end(cache_key)
+            return bytes(key)
+
+    def put(self, password: str, salt: bytes, kdf: Kdf, key: bytes):
+        """Stores a derived key, evicting the least recently used entries if full."""
+        if self.max_entries <= 0:
+            return
+        cache_key = self._cache_key(password, salt, kdf)
+        with self._lock:
+            if cache_key in self._entries:
+                self._drop(cache_key)
+            self._entries[cache_key] = (bytearray(key), time.monotonic() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def evict(self, password: str, salt: bytes, kdf: Kdf) -> bool:
+        """Zeroizes and removes one entry. Returns True if it was cached."""
+        cache_key = self._cache_key(password, salt, kdf)
+        with self._lock:
+            if cache_key not in self._entries:
+                return False
+            self._drop(cache_key)
+            return True
+
+    def zeroize(self):
+        """Overwrites and removes every cached key."""
+        with self._lock:
+            for cache_key in list(self._entries):
+                self._drop(cache_key)
+
+    def _drop(self, cache_key: tuple):
+        key, _ = self._entries.pop(cache_key)
+        key[:] = bytes(len(key))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Shared by every KeyManager so separate handlers reuse each other's work
+_default_cache = KeyCache()
 
 
 class KeyManager:
     """Manages the generation of a cryptographic key from a password."""
-    def __init__(self):
+    def __init__(self, cache: KeyCache = None):
         self._salt = None
         self._key = None
+        self._cache = _default_cache if cache is None else cache
 
-    def generate_key_from_password(self, password: str, salt: bytes = None) -> tuple[bytes, bytes]:
+    def generate_key_from_password(self, password: str, salt: bytes = None,
+                                   kdf: Kdf = None) -> tuple[bytes, bytes]:
         """
-        Derives a key from a password using PBKDF2HMAC.
+        Derives a key from a password using PBKDF2HMAC or scrypt.
         If no salt is provided, a new one is generated.
-        
+        Keys already derived for the same password, salt and KDF settings
+        are served from the cache instead of rerunning the KDF.
+
+        Args:
+            password: The password.
+            salt: Salt to derive with; a new random one if None.
+            kdf: KDF and parameters (see :func:`make_kdf`); defaults to the
+                configured ones. Pass the same value to ``encrypt_image`` so
+                the header records it.
+
         Returns:
             (key, salt)
         """
+        kdf = kdf or make_kdf()
         self._salt = salt or os.urandom(16)
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,  # 256-bit AES key
-            salt=self._salt,
-            iterations=100000,
-        )
-        self._key = kdf.derive(password.encode())
+        key = self._cache.get(password, self._salt, kdf)
+        if key is None:
+            with stage('kdf'):
+                key = derive_key(password, self._salt, kdf)
+                count('kdf_cache_miss')
+            self._cache.put(password, self._salt, kdf, key)
+        else:
+            count('kdf_cache_hit')
+        self._key = key
         return self._key, self._salt
 
     def get_key(self) -> bytes:
         """Returns the derived key."""
         return self._key
+
+    def evict(self, password: str, salt: bytes, kdf: Kdf = None) -> bool:
+        """Removes one derived key from the cache and zeroizes it."""
+        return self._cache.evict(password, salt, kdf or make_kdf())
+
+    def zeroize(self):
+        """Zeroizes every cached key and forgets the last derived key."""
+        self._cache.zeroize()
+        self._key = None
@@ -0,0 +1,168 @@
+"""
+Re-keying encrypted files under a new password.
+
+The payload is decrypted with the old key and encrypted with the new one
+chunk by chunk, in the crypto layer only: no image is decoded or encoded and
+no plaintext reaches the disk, so a re-key costs about as much as reading
+and writing the file once. The output gets a fresh salt and IV, the KDF the
+new key was derived with, and keeps its payload, cipher and chunk layout;
+legacy version 1 files are upgraded to a version 2 header on the way.
+
+Chunked AES-GCM files prove the old key right on their first chunk. AES-CFB
+files are not authenticated: a wrong old password would silently turn them
+into garbage, so they are only re-keyed when the key was checked on an
+AES-GCM file of the same salt, or when the caller explicitly allows it.
+"""
+import os
+import shutil
+from contextlib import suppress
+from dataclasses import replace
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.backends import default_backend
+
+from config import CHUNK_SIZE
+from encryption.chunked import IntegrityError, iter_chunks, map_file
+from encryption.container import CIPHER_AES_GCM, VERSION, Header, parse_header
+from encryption.encryptor import write_container
+from encryption.key_manager import Kdf, KeyManager, make_kdf
+from encryption.stream import display_name, iter_decrypted, open_input
+from utils.instrumentation import count, job, stage
+
+
+def key_matches(source, header: Header, key: bytes) -> bool:
+    """
+    Returns whether ``key`` authenticates the first chunk of a chunked AES-GCM file.
+
+    Args:
+        source: Path, or a binary file object holding only the container.
+        header: The container's parsed header.
+        key: Key to check.
+
+    Raises:
+        ValueError: If the file is not chunked AES-GCM, or is corrupt.
+    """
+    if header.cipher != CIPHER_AES_GCM:
+        raise ValueError("Only chunked AES-GCM files are authenticated.")
+    with open_input(source) as f, map_file(f) as buf:
+        try:
+            for _ in iter_chunks(key, header, buf, indices=[0]):
+                pass
+        except IntegrityError:
+            return False
+    return True
+
+
+def rekey_container(source, output, old_key: bytes, new_key: bytes, salt: bytes, kdf: Kdf = None,
+                    chunk_size: int = CHUNK_SIZE) -> Header:
+    """
+    Re-encrypts a container's payload from ``old_key`` to ``new_key``, one chunk at a time.
+
+    Args:
+        source: Path, or a binary file object holding only the container.
+        output: Path, or a writable, seekable binary file object; must not be ``source``.
+        old_key: Key the file is encrypted with.
+        new_key: Key to encrypt with, derived with ``salt`` and ``kdf``.
+        salt: Salt of ``new_key``, recorded in the new header.
+        kdf: KDF of ``new_key``; defaults to the configured one.
+        chunk_size: Bytes processed per cipher update (AES-CFB files).
+
+    Returns:
+        The new header.
+
+    Raises:
+        IntegrityError: If a chunk of an AES-GCM file fails authentication
+            under ``old_key``; ``output`` is removed if it is a path.
+    """
+    kdf = kdf or make_kdf()
+    with job('rekey', path=display_name(source)):
+        with open_input(source) as f:
+            with stage('header'):
+                header = parse_header(f)
+            count('payload_bytes', header.payload_size)
+            rekeyed = replace(header, salt=salt, iv=os.urandom(16), kdf=kdf.name, kdf_params=kdf.params,
+                              payload_size=0, index_offset=0, version=VERSION)
+            if header.cipher == CIPHER_AES_GCM:
+                with map_file(f) as buf:
+                    # Copied: the chunk buffer is reused while the encryptor looks one chunk ahead
+                    pieces = (bytes(plaintext) for _, plaintext in iter_chunks(old_key, header, buf))
+                    write_container(output, rekeyed, new_key, pieces, chunk_size)
+                    del pieces  # Releases the generator's views of the map
+            else:
+                decryptor = Cipher(algorithms.AES(old_key), modes.CFB(header.iv),
+                                   backend=default_backend()).decryptor()
+                write_container(output, rekeyed, new_key, iter_decrypted(decryptor, f, chunk_size), chunk_size)
+    return rekeyed
+
+
+def rekey_file(path: str, old_key: bytes, new_key: bytes, salt: bytes, kdf: Kdf = None,
+               output_path: str = None) -> Header:
+    """
+    Re-keys an encrypted file atomically (see :func:`rekey_container`).
+
+    The new file is written next to its destination, flushed to disk and
+    renamed over it, so ``output_path`` holds either the old or the new
+    file, never a partial one.
+
+    Args:
+        path: Encrypted file.
+        old_key: Key the file is encrypted with.
+        new_key: Key to encrypt with.
+        salt: Salt of ``new_key``.
+        kdf: KDF of ``new_key``; defaults to the configured one.
+        output_path: Destination; defaults to replacing ``path`` itself.
+
+    Returns:
+        The new header.
+    """
+    output_path = output_path or path
+    partial = f"{output_path}.part"
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    try:
+        with open(partial, 'wb') as f:
+            header = rekey_container(path, f, old_key, new_key, salt, kdf)
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.copymode(path, partial)
+        os.replace(partial, output_path)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(partial)
+        raise
+    return header
+
+
+def rekey_image(path: str, old_password: str, new_password: str, output_path: str = None,
+                kdf: Kdf = None, allow_unverified: bool = False) -> Header:
+    """
+    Re-encrypts one file under a new password, without decoding the image.
+
+    Args:
+        path: Encrypted file.
+        old_password: Password the file is encrypted with.
+        new_password: Password to encrypt with; a fresh salt is generated.
+        output_path: Destination; defaults to replacing ``path`` itself.
+        kdf: KDF for the new password; defaults to the configured one.
+        allow_unverified: Re-key AES-CFB files, whose old password cannot be checked.
+
+    Returns:
+        The new header.
+
+    Raises:
+        ValueError: If ``old_password`` is wrong, or the file is AES-CFB and
+            ``allow_unverified`` is not set.
+    """
+    key_manager = KeyManager()
+    with open(path, 'rb') as f:
+        header = parse_header(f)
+    old_key, _ = key_manager.generate_key_from_password(old_password, header.salt,
+                                                        make_kdf(header.kdf, header.kdf_params))
+    if header.cipher == CIPHER_AES_GCM:
+        if not key_matches(path, header, old_key):
+            raise ValueError("Wrong password: the file does not authenticate with it.")
+    elif not allow_unverified:
+        raise ValueError("AES-CFB files are not authenticated, so the old password cannot be checked; "
+                         "a wrong one would destroy the file. Allow unverified re-keying to proceed.")
+    kdf = kdf or make_kdf()
+    new_key, salt = key_manager.generate_key_from_password(new_password, kdf=kdf)
+    return rekey_file(path, old_key, new_key, salt, kdf, output_path)
@@ -0,0 +1,203 @@
+"""
+Asyncio API for encrypting and decrypting images in memory.
+
+Requests carry the image (or container) as bytes or as an async stream and
+get bytes back; nothing touches the file system or stdout. Key derivation,
+decoding and AES all run on an executor with a fixed number of workers, so
+the event loop stays responsive, and at most ``max_queued`` further jobs wait
+for a worker: beyond that requests fail fast with :class:`ServiceBusy`
+instead of piling up in memory.
+
+Usage:
+    service = CryptoService(workers=4)
+    container = await service.encrypt(png_bytes, 'password')
+    decrypted = await service.decrypt(container, 'password')
+    decrypted.data, decrypted.ext  # b'\\x89PNG...', '.png'
+"""
+import asyncio
+import io
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from config import CHUNK_SIZE, SERVICE_MAX_BODY, SERVICE_QUEUE_SIZE, SERVICE_WORKERS
+from encryption.container import PAYLOAD_PIXELS, CIPHER_AES_GCM, parse_header
+from encryption.decryptor import decrypt_image, output_extension
+from encryption.encryptor import encrypt_image
+from encryption.key_manager import Kdf, KeyManager, make_kdf
+
+Decrypted = namedtuple('Decrypted', 'data ext')
+
+
+class ServiceBusy(RuntimeError):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+async def read_source(source, max_size: int = SERVICE_MAX_BODY) -> bytes:
+    """
+    Collects a request body into memory.
+
+    Args:
+        source: A bytes-like object, a stream with an ``async read(n)``
+            method (e.g. ``asyncio.StreamReader``) or an async iterable of
+            bytes chunks.
+        max_size: Largest accepted body in bytes.
+
+    Returns:
+        The body.
+
+    Raises:
+        ValueError: If the body is larger than ``max_size``.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+        if len(data) > max_size:
+            raise ValueError(f"Input exceeds the {max_size} byte limit.")
+        return data
+
+    async def chunks():
+        if hasattr(source, 'read'):
+            while chunk := await source.read(CHUNK_SIZE):
+                yield chunk
+        else:
+            async for chunk in source:
+                yield chunk
+
+    body = bytearray()
+    async for chunk in chunks():
+        body += chunk
+        if len(body) > max_size:
+            raise ValueError(f"Input exceeds the {max_size} byte limit.")
+    return bytes(body)
+
+
+async def write_stream(writer, data: bytes, chunk_size: int = CHUNK_SIZE):
+    """
+    Writes ``data`` to an ``asyncio.StreamWriter`` chunk by chunk, waiting for
+    the transport to drain after each one so slow readers apply backpressure.
+    """
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk_size):
+        writer.write(view[offset:offset + chunk_size])
+        await writer.drain()
+
+
+def _encrypt_job(data: bytes, password: str, key: bytes, salt: bytes, options: dict) -> bytes:
+    if key is None:
+        key, salt = KeyManager().generate_key_from_password(password, salt, options["kdf"])
+    out = io.BytesIO()
+    encrypt_image(io.BytesIO(data), out, key, salt, verbose=False, **options)
+    return out.getvalue()
+
+
+def _decrypt_job(data: bytes, password: str, key: bytes) -> Decrypted:
+    source = io.BytesIO(data)
+    header = parse_header(source)
+    source.seek(0)
+    out = io.BytesIO()
+    decrypt_image(source, out, password, key, verbose=False)
+    return Decrypted(out.getvalue(), output_extension(header))
+
+
+class CryptoService:
+    """
+    Runs encrypt/decrypt jobs for asyncio code with bounded concurrency.
+
+    Args:
+        workers: Jobs run at once; defaults to ``SERVICE_WORKERS`` or the CPU count.
+        max_queued: Jobs allowed to wait for a worker before :class:`ServiceBusy`.
+        max_size: Largest input accepted, in bytes.
+        executor: Executor to run jobs on instead of a private thread pool of
+            ``workers`` threads (e.g. a ``ProcessPoolExecutor`` of the same
+            size); it is not shut down by :meth:`close`.
+    """
+    def __init__(self, workers: int = SERVICE_WORKERS, max_queued: int = SERVICE_QUEUE_SIZE,
+                 max_size: int = SERVICE_MAX_BODY, executor=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.max_size = max_size
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(self.workers, thread_name_prefix='crypto')
+        self._active = 0
+        self._counts = {"completed": 0, "failed": 0, "rejected": 0}
+
+    def stats(self) -> dict:
+        """Returns the number of running, queued, completed, failed and rejected jobs."""
+        running = min(self._active, self.workers)
+        return {"workers": self.workers, "max_queued": self.max_queued, "running": running,
+                "queued": self._active - running, **self._counts}
+
+    async def _run(self, source, job, *args):
+        # Refuse before reading the body so rejected requests cost nothing
+        if self._active >= self.workers + self.max_queued:
+            self._counts["rejected"] += 1
+            raise ServiceBusy(f"{self._active} jobs in progress; try again later.")
+        self._active += 1
+        try:
+            data = await read_source(source, self.max_size)
+        except BaseException:
+            self._active -= 1
+            self._counts["failed"] += 1
+            raise
+        future = asyncio.get_running_loop().run_in_executor(self._executor, job, data, *args)
+        future.add_done_callback(self._finished)
+        # A cancelled caller cannot stop a running job; its slot is held until the job ends
+        return await asyncio.shield(future)
+
+    def _finished(self, future):
+        self._active -= 1
+        failed = future.cancelled() or future.exception() is not None
+        self._counts["failed" if failed else "completed"] += 1
+
+    async def encrypt(self, source, password: str = None, key: bytes = None, salt: bytes = None,
+                      payload: str = PAYLOAD_PIXELS, cipher: str = CIPHER_AES_GCM,
+                      native: bool = True, kdf: Kdf = None) -> bytes:
+        """
+        Encrypts an encoded image into a container.
+
+        Args:
+            source: The image as bytes or an async stream (see :func:`read_source`).
+            password: Password for key derivation, with a fresh salt per call.
+            key: Already derived key; skips key derivation when given with ``salt``.
+            salt: Salt ``key`` was derived with.
+            payload: Payload type passed to :func:`encrypt_image`.
+            cipher: Cipher passed to :func:`encrypt_image`.
+            native: Keep pixels in the image's own mode.
+            kdf: KDF and parameters (see :func:`make_kdf`), also the ones a
+                given ``key`` was derived with; defaults to the configured ones.
+
+        Returns:
+            The encrypted container.
+
+        Raises:
+            ServiceBusy: If the queue is full.
+        """
+        if key is None and password is None:
+            raise ValueError("Either a password or a derived key is required.")
+        if key is not None and salt is None:
+            raise ValueError("A derived key needs the salt it was derived with.")
+        options = {"payload": payload, "cipher": cipher, "native": native, "kdf": kdf or make_kdf()}
+        return await self._run(source, _encrypt_job, password, key, salt, options)
+
+    async def decrypt(self, source, password: str = None, key: bytes = None) -> Decrypted:
+        """
+        Decrypts a container back into an encoded image.
+
+        Args:
+            source: The container as bytes or an async stream.
+            password: Password for key derivation.
+            key: Already derived key; skips key derivation when given.
+
+        Returns:
+            A ``Decrypted(data, ext)`` tuple: the PNG, TIFF or original encoded
+            file and its extension.
+
+        Raises:
+            ServiceBusy: If the queue is full.
+        """
+        return await self._run(source, _decrypt_job, password, key)
+
+    def close(self):
+        """Waits for running jobs and shuts down the private executor."""
+        if self._owns_executor:
+            self._executor.shutdown()
@@ -0,0 +1,102 @@
+"""
+Migration away from ``.salt`` sidecar files.
+
+Older GUI versions wrote each file's salt to ``<file>.enc.salt`` next to it,
+although the same salt is stored in the file's header, which is all
+decryption reads. :func:`migrate_sidecars` checks every sidecar under a tree
+against its header and deletes the ones that are redundant. Sidecars that
+disagree with their header, have no encrypted file, or whose header cannot
+be read are kept and reported.
+
+Usage:
+    python cli.py sidecars encrypted_images/ --dry-run
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from encryption.container import read_header
+
+SIDECAR_SUFFIX = '.salt'
+STATUSES = ('removed', 'redundant', 'mismatch', 'orphan', 'error')
+BATCH_SIZE = 1024  # Sidecars checked per round of worker threads
+
+
+def iter_sidecars(root: str, suffix: str = '.enc' + SIDECAR_SUFFIX):
+    """Walks a directory tree and yields the path of every sidecar file."""
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    yield entry.path
+
+
+def check_sidecar(sidecar_path: str, remove: bool = False) -> dict:
+    """
+    Compares one sidecar with the header of the file it belongs to.
+
+    Args:
+        sidecar_path: Path to the ``.salt`` file.
+        remove: Delete the sidecar if it matches its header.
+
+    Returns:
+        A result dict with ``sidecar`` and ``status``: 'removed' or 'redundant'
+        (it matches the header), 'mismatch', 'orphan' (no encrypted file) or
+        'error' (with ``error``).
+    """
+    result = {"sidecar": sidecar_path}
+    encrypted_path = sidecar_path[:-len(SIDECAR_SUFFIX)]
+    try:
+        with open(sidecar_path, 'rb') as f:
+            salt = f.read()
+        if not os.path.exists(encrypted_path):
+            result["status"] = "orphan"
+            return result
+        if read_header(encrypted_path).salt != salt:
+            result["status"] = "mismatch"
+            return result
+        if remove:
+            os.remove(sidecar_path)
+        result["status"] = "removed" if remove else "redundant"
+    except (OSError, ValueError) as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def migrate_sidecars(root: str, remove: bool = True, workers: int = None) -> dict:
+    """
+    Checks every sidecar under ``root`` and deletes the redundant ones.
+
+    The work is I/O bound, so sidecars are checked on a thread pool, one
+    bounded batch at a time, keeping memory flat on trees of millions of files.
+
+    Args:
+        root: Directory to scan, e.g. ``encrypted_images/``.
+        remove: False for a dry run that only reports.
+        workers: Worker threads (default: the ThreadPoolExecutor default).
+
+    Returns:
+        Report dict with per-status ``counts`` and ``problems``, the results
+        of every sidecar that was kept for a reason other than a dry run.
+    """
+    counts = dict.fromkeys(STATUSES, 0)
+    problems = []
+
+    def record(results):
+        for result in results:
+            counts[result["status"]] += 1
+            if result["status"] not in ('removed', 'redundant'):
+                problems.append(result)
+
+    with ThreadPoolExecutor(workers) as pool:
+        batch = []
+        for path in iter_sidecars(root):
+            batch.append(path)
+            if len(batch) == BATCH_SIZE:
+                record(pool.map(check_sidecar, batch, [remove] * len(batch)))
+                batch = []
+        record(pool.map(check_sidecar, batch, [remove] * len(batch)))
+    return {"root": root, "dry_run": not remove, "counts": counts, "problems": problems}
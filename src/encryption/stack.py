@@ -0,0 +1,398 @@
+"""
+Stacks: many same-size images encrypted as one container.
+
+High-volume ingest of small images (camera frames, thumbnails) pays a fixed
+cost per image: an RGB conversion and array copy, a cipher setup, a header
+and a file. A stack decodes a group of images of the same size and mode into
+one preallocated NumPy array and encrypts it in a single streaming pass, so
+those costs are paid once per group.
+
+On disk a stack is an ordinary pixel container whose image is the frames on
+top of each other (``header.shape`` is ``(count * height, width, ...)``).
+An ``EXTRA_STACK`` header record holds the frame height and every frame's
+name and payload offset, so frames can be split back out, or one frame read
+on its own from a chunked file. Tools that do not know about stacks still
+decrypt it as one tall image.
+
+Frames are stored in the stack's mode without palette, transparency or ICC
+profile; paletted images are stacked as RGB.
+"""
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+import numpy as np
+from PIL import Image
+
+from config import CHUNK_SIZE, STACK_MAX_BYTES
+from encryption.archive import check_name
+from encryption.container import (CIPHER_AES_GCM, CIPHERS, FLAG_NATIVE, Header, pack_extra, read_header,
+                                  unpack_extra)
+from encryption.decryptor import decrypt_rows, decrypt_to_array
+from encryption.encryptor import write_container
+from encryption.key_manager import Kdf, make_kdf
+from encryption.stream import display_name
+from utils.image_loader import NATIVE_LAYOUTS, PNG_MODES, native_layout, save_native
+from utils.instrumentation import count, job, stage
+
+REPORT_NAME = 'stack_report.json'
+_STACK_NAME = re.compile(r'stack_(\d+)\.enc')
+
+# Modes whose raw buffer is a plain (height, width[, bands]) array and needs no per-image palette
+STACK_MODES = tuple(mode for mode, (bands, _) in NATIVE_LAYOUTS.items() if bands and mode not in ('P', 'PA'))
+
+
+def stack_mode(mode: str) -> str:
+    """Returns the mode an image of ``mode`` is stacked in: its own, or RGB."""
+    return mode if mode in STACK_MODES else 'RGB'
+
+
+def _describe(e: Exception) -> str:
+    return f"{type(e).__name__}: {e}"
+
+
+def decode_stack(paths: list, mode: str = None, workers: int = None) -> tuple[np.ndarray, str, dict]:
+    """
+    Decodes same-size images into one contiguous, preallocated array.
+
+    Each image is decoded straight into its slot of the stack; only images
+    in another mode are converted. An image that cannot be decoded, or whose
+    size differs from the first readable one's, is left out of the stack.
+
+    Args:
+        paths: Image paths (or binary file objects), all of the same size.
+        mode: Mode to stack in; defaults to :func:`stack_mode` of the first readable image.
+        workers: Decoding threads; defaults to the number of CPU cores.
+
+    Returns:
+        (stack, mode, failed): an array of shape ``(count, height, width[, bands])``
+        holding the decoded images in input order, and ``{index: error}``
+        for the images left out.
+
+    Raises:
+        ValueError: If no image can be decoded, or ``mode`` cannot be stacked.
+    """
+    if not paths:
+        raise ValueError("A stack needs at least one image.")
+    errors = [None] * len(paths)
+    size = None
+    for index, path in enumerate(paths):
+        try:
+            with Image.open(path) as img:
+                size, first_mode = img.size, img.mode
+            break
+        except Exception as e:
+            errors[index] = _describe(e)
+    if size is None:
+        raise ValueError("None of the images of the stack can be opened.")
+    mode = mode or stack_mode(first_mode)
+    if mode not in STACK_MODES:
+        raise ValueError(f"Images cannot be stacked in mode {mode}.")
+    shape, dtype, _ = native_layout(mode, *size)
+    stack = np.empty((len(paths),) + shape, dtype=dtype)
+
+    def decode(index: int):
+        if errors[index] is not None:
+            return
+        try:
+            with Image.open(paths[index]) as img:
+                if img.size != size:
+                    raise ValueError(f"{display_name(paths[index])} is {img.width}x{img.height}, "
+                                     f"not {size[0]}x{size[1]} like the rest of the stack.")
+                with stage('decode'):
+                    img.load()
+                if img.mode != mode:
+                    with stage('convert'):
+                        img = img.convert(mode)
+                stack[index] = np.asarray(img)
+        except Exception as e:
+            errors[index] = _describe(e)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for index in range(len(paths)):
+            decode(index)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(decode, range(len(paths))))
+    failed = {index: error for index, error in enumerate(errors) if error is not None}
+    if failed:
+        decoded = [index for index in range(len(paths)) if index not in failed]
+        if not decoded:
+            raise ValueError("None of the images of the stack can be decoded.")
+        stack = stack[decoded]  # Only copied when something failed
+    return stack, mode, failed
+
+
+def encrypt_stack(paths: list, output_path, key: bytes, salt: bytes, names: list[str] = None,
+                  mode: str = None, cipher: str = CIPHER_AES_GCM, chunk_size: int = CHUNK_SIZE,
+                  kdf: Kdf = None, workers: int = None, verbose: bool = True) -> tuple[Header, dict]:
+    """
+    Encrypts same-size images as one stack container in a single cipher pass.
+
+    Peak memory is the decoded stack; :func:`plan_stacks` splits a large
+    set of images into groups of bounded size. Images that cannot be
+    decoded are left out (see :func:`decode_stack`).
+
+    Args:
+        paths: Image paths, all of the same size.
+        output_path: Path to save the stack, or a writable, seekable binary file object.
+        key: Encryption key (bytes).
+        salt: Salt used for key derivation.
+        names: Frame names, stored in the header; default to the file names. Must be
+            relative paths (see :func:`encryption.archive.check_name`).
+        mode: Mode to stack in (see :func:`decode_stack`).
+        cipher: 'aes-gcm-chunked' or 'aes-cfb'.
+        chunk_size: Bytes encrypted per chunk or cipher update.
+        kdf: KDF ``key`` was derived with, recorded in the header.
+        workers: Decoding threads; defaults to the number of CPU cores.
+        verbose: Print a confirmation when done.
+
+    Returns:
+        (header, failed): the stack's header, and ``{index: error}`` for the
+        images left out.
+    """
+    if cipher not in CIPHERS:
+        raise ValueError(f"Unknown cipher: {cipher}")
+    names = [os.path.basename(path) for path in paths] if names is None else names
+    names = [check_name(name) for name in names]
+    if len(names) != len(paths):
+        raise ValueError("Every image of a stack needs exactly one name.")
+
+    with job('encrypt_stack', path=display_name(output_path), images=len(paths), cipher=cipher):
+        stack, mode, failed = decode_stack(paths, mode, workers)
+        names = [name for index, name in enumerate(names) if index not in failed]
+        height, width = stack.shape[1:3]
+        shape, dtype, row_bytes = native_layout(mode, width, height)
+        frame_bytes = height * row_bytes
+        kdf = kdf or make_kdf()
+        header = Header(salt=salt, iv=os.urandom(16), mode=mode, shape=(len(names) * height,) + shape[1:],
+                        cipher=cipher, kdf=kdf.name, kdf_params=kdf.params, dtype=dtype, flags=FLAG_NATIVE,
+                        extra=pack_extra({'stack': (height, [(name, index * frame_bytes)
+                                                             for index, name in enumerate(names)])}))
+        if cipher == CIPHER_AES_GCM:
+            header.chunk_size = max(1, chunk_size // row_bytes) * row_bytes  # Whole rows per chunk
+        count('source_bytes', stack.nbytes)
+        # Views of the stack, so the encryptor seals them without copying
+        view = memoryview(stack).cast('B')
+        step = header.chunk_size or chunk_size
+        pieces = [view[offset:offset + step] for offset in range(0, len(view), step)]
+        write_container(output_path, header, key, pieces, chunk_size)
+
+    if verbose:
+        skipped = f" ({len(failed)} could not be decoded)" if failed else ''
+        print(f"✅ {len(names)} images encrypted as a stack: {display_name(output_path)}{skipped}")
+    return header, failed
+
+
+def stack_layout(header: Header) -> tuple[int, list[tuple[str, int]]]:
+    """
+    Returns a stack's frame height and its (name, payload offset) entries.
+
+    Raises:
+        ValueError: If the file is not a stack.
+    """
+    layout = unpack_extra(header.extra).get('stack')
+    if layout is None:
+        raise ValueError("Not a stack: the header has no stack record.")
+    return layout
+
+
+def _frame_bytes(header: Header, height: int) -> int:
+    return height * native_layout(header.mode, header.shape[1], height)[2]
+
+
+def decrypt_stack(encrypted_path: str, password: str = None, key: bytes = None,
+                  workers: int = None) -> tuple[list[str], np.ndarray]:
+    """
+    Decrypts a stack and splits it back into frames.
+
+    Args:
+        encrypted_path: Path to the stack.
+        password: Password for key derivation.
+        key: Already derived key; skips key derivation when given.
+        workers: Decryption threads for chunked files; defaults to the CPU count.
+
+    Returns:
+        (names, frames): the frame names and an array of shape
+        ``(count, height, width[, bands])``, one frame per name.
+    """
+    header = read_header(encrypted_path)
+    height, entries = stack_layout(header)
+    frame_bytes = _frame_bytes(header, height)
+    if any(offset != index * frame_bytes for index, (_, offset) in enumerate(entries)):
+        raise ValueError("Stack offsets do not match its frame size.")
+    pixels = decrypt_to_array(encrypted_path, password, key, workers=workers)
+    return [name for name, _ in entries], pixels.reshape((len(entries), height) + pixels.shape[1:])
+
+
+def read_stack_image(encrypted_path: str, name: str, password: str = None, key: bytes = None) -> np.ndarray:
+    """
+    Decrypts a single frame of a chunked AES-GCM stack, reading only the chunks that hold it.
+
+    Raises:
+        KeyError: If the stack has no frame called ``name``.
+    """
+    header = read_header(encrypted_path)
+    height, entries = stack_layout(header)
+    offset = dict(entries)[name]
+    row = offset // native_layout(header.mode, header.shape[1], height)[2]
+    return decrypt_rows(encrypted_path, row, row + height, password, key)
+
+
+def _output_name(name: str, mode: str) -> str:
+    # Names come from the file; keep them inside the output directory
+    parts = check_name(name).replace('\\', '/').split('/')
+    return os.path.splitext(os.path.join(*parts))[0] + ('.png' if mode in PNG_MODES else '.tiff')
+
+
+def extract_stack(encrypted_path: str, output_dir: str, password: str = None, key: bytes = None,
+                  names: list[str] = None, workers: int = None) -> list[str]:
+    """
+    Decrypts a stack and saves its frames as PNG (TIFF for modes PNG cannot hold).
+
+    Args:
+        encrypted_path: Path to the stack.
+        output_dir: Directory receiving one file per frame, named after it.
+        password: Password for key derivation.
+        key: Already derived key; skips key derivation when given.
+        names: Frames to save; defaults to all.
+        workers: Decryption and encoding threads; defaults to the CPU count.
+
+    Returns:
+        The paths written, in stack order.
+    """
+    header = read_header(encrypted_path)
+    all_names, frames = decrypt_stack(encrypted_path, password, key, workers)
+    wanted = set(all_names if names is None else names)
+    missing = wanted - set(all_names)
+    if missing:
+        raise KeyError(f"Not in the stack: {', '.join(sorted(missing))}")
+    size = (frames.shape[2], frames.shape[1])
+    if header.mode in ('I', 'F') and not frames.dtype.isnative:
+        frames = frames.byteswap()  # Written on a machine of the other byte order; 'I;16B' stays as is
+    outputs = [(index, os.path.join(output_dir, _output_name(name, header.mode)))
+               for index, name in enumerate(all_names) if name in wanted]
+
+    def save(item):
+        index, output = item
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        save_native(frames[index], output, header.mode, size)
+        return output
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        return list(executor.map(save, outputs))
+
+
+def plan_stacks(paths: list[str], max_bytes: int = STACK_MAX_BYTES) -> tuple[list[list[str]], dict]:
+    """
+    Groups images into stacks of one size and mode, each at most ``max_bytes`` decoded.
+
+    Only image headers are read.
+
+    Returns:
+        (plans, unreadable): lists of paths, in input order within each
+        group, and ``{path: error}`` for the files that could not be opened as images.
+    """
+    groups, unreadable = {}, {}
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                size, mode = img.size, stack_mode(img.mode)
+        except Exception as e:
+            unreadable[path] = _describe(e)
+            continue
+        groups.setdefault((size, mode), []).append(path)
+    plans = []
+    for (size, mode), members in groups.items():
+        frame_bytes = size[1] * native_layout(mode, *size)[2]
+        per_stack = max(1, max_bytes // frame_bytes)
+        plans.extend(members[start:start + per_stack] for start in range(0, len(members), per_stack))
+    return plans, unreadable
+
+
+def _next_stack_number(output_dir: str) -> int:
+    numbers = [int(match.group(1)) for match in map(_STACK_NAME.fullmatch, os.listdir(output_dir)) if match]
+    return max(numbers, default=-1) + 1
+
+
+def encrypt_stacks(source_dir: str, output_dir: str, password: str, manifest: str = None,
+                   max_bytes: int = STACK_MAX_BYTES, cipher: str = CIPHER_AES_GCM, kdf: Kdf = None,
+                   workers: int = None, report_path: str = None) -> dict:
+    """
+    Encrypts every image under ``source_dir`` into stacks (``stack_00000.enc``, ...) in ``output_dir``.
+
+    Images are grouped by :func:`plan_stacks` and named by their path
+    relative to ``source_dir``; the key is derived once for the whole run.
+    Numbering continues after the stacks already in ``output_dir``, and each
+    stack is written under a temporary name and renamed when complete, so
+    earlier stacks are never overwritten and no partial stack is left behind.
+    Images that cannot be read are left out of their stack and reported as
+    errors, as in :func:`~encryption.batch.encrypt_batch`.
+
+    Args:
+        source_dir: Root directory of the images.
+        output_dir: Directory receiving the stacks.
+        password: Password for key derivation.
+        manifest: Optional list of files to process instead of walking the tree.
+        max_bytes: Largest decoded size of one stack.
+        cipher: 'aes-gcm-chunked' or 'aes-cfb'.
+        kdf: KDF and parameters (see :func:`make_kdf`); defaults to the configured ones.
+        workers: Decoding threads per stack; defaults to the number of CPU cores.
+        report_path: Where to write the JSON summary; defaults to
+            ``output_dir/stack_report.json``.
+
+    Returns:
+        The summary report: status ``counts``, every written stack's
+        ``output`` and ``images``, and a result per image under ``files``.
+    """
+    from encryption.batch import IMAGE_EXTENSIONS, collect_files
+    from encryption.key_manager import KeyManager
+
+    started = time.time()
+    files = collect_files(source_dir, IMAGE_EXTENSIONS, manifest)
+    plans, unreadable = plan_stacks([os.path.join(source_dir, rel) for rel in files], max_bytes)
+    results = [{"source": path, "output": None, "status": "error", "error": error}
+               for path, error in unreadable.items()]
+    kdf = kdf or make_kdf()
+    key, salt = KeyManager().generate_key_from_password(password, kdf=kdf)
+    os.makedirs(output_dir, exist_ok=True)
+    stacks = []
+    number = _next_stack_number(output_dir)
+    for paths in plans:
+        output = os.path.join(output_dir, f"stack_{number:05d}.enc")
+        partial = f"{output}.part"
+        names = [os.path.relpath(path, source_dir).replace(os.sep, '/') for path in paths]
+        try:
+            _, failed = encrypt_stack(paths, partial, key, salt, names, cipher=cipher, kdf=kdf, workers=workers,
+                                      verbose=False)
+            os.replace(partial, output)
+        except Exception as e:
+            with suppress(OSError):
+                os.remove(partial)
+            output, failed = None, dict.fromkeys(range(len(paths)), _describe(e))
+        else:
+            stacks.append({"output": output, "images": len(paths) - len(failed)})
+            number += 1
+        for index, path in enumerate(paths):
+            if index in failed:
+                results.append({"source": path, "output": None, "status": "error", "error": failed[index]})
+            else:
+                results.append({"source": path, "output": output, "status": "ok"})
+
+    counts = {"ok": 0, "error": 0}
+    for result in results:
+        counts[result["status"]] += 1
+    report = {
+        "started": started,
+        "seconds": round(time.time() - started, 3),
+        "counts": counts,
+        "stacks": stacks,
+        "files": results,
+    }
+    with open(report_path or os.path.join(output_dir, REPORT_NAME), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
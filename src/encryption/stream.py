@@ -0,0 +1,196 @@
+import os
+import threading
+from contextlib import contextmanager, suppress
+
+AES_BLOCK_SIZE = 16
+
+
+def is_path(target) -> bool:
+    """Returns True for file system paths, False for open file objects."""
+    return isinstance(target, (str, os.PathLike))
+
+
+def display_name(target) -> str:
+    """Returns a path, or the name of a file object (``'<stream>'`` if it has none), for messages."""
+    if is_path(target):
+        return os.fspath(target)
+    name = getattr(target, 'name', None)
+    return name if isinstance(name, str) else '<stream>'
+
+
+@contextmanager
+def open_input(source):
+    """Opens a path for binary reading; open file objects are passed through and left open."""
+    if not is_path(source):
+        yield source
+        return
+    with open(source, 'rb') as f:
+        yield f
+
+
+@contextmanager
+def open_output(target):
+    """
+    Opens a path for binary writing; open file objects are passed through and left open.
+
+    If the body raises (including cancellation from a progress callback), a
+    partially written path is removed. Partial output written to a caller's
+    file object is left for the caller to discard.
+    """
+    if not is_path(target):
+        yield target
+        return
+    try:
+        with open(target, 'wb') as f:
+            yield f
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(target)
+        raise
+
+
+def progress_counter(progress, total: int):
+    """
+    Adapts a ``progress(done, total)`` callback to per-chunk byte increments.
+
+    Args:
+        progress: Callback receiving the running byte count and ``total``, or None.
+        total: Number of bytes the operation will process.
+
+    Returns:
+        A thread-safe ``advance(nbytes)`` function, or None when ``progress`` is None.
+    """
+    if progress is None:
+        return None
+    lock = threading.Lock()
+    done = 0
+
+    def advance(nbytes: int):
+        nonlocal done
+        with lock:
+            done += nbytes
+            current = done
+        progress(current, total)
+
+    return advance
+
+
+def tracked(pieces, advance):
+    """Passes buffers through unchanged, reporting each one to ``advance`` once it has been consumed."""
+    if advance is None:
+        yield from pieces
+        return
+    for piece in pieces:
+        yield piece
+        advance(len(piece))
+
+
+def encrypt_to_file(encryptor, pieces, f, chunk_size: int):
+    """
+    Encrypts a sequence of plaintext buffers into an open file in fixed-size chunks.
+
+    The ciphertext is produced with ``update_into`` into a single reusable
+    buffer, so no full-size ciphertext copy is ever allocated.
+
+    Args:
+        encryptor: A cryptography cipher context from ``Cipher.encryptor()``.
+        pieces: Iterable of bytes-like plaintext buffers, encrypted in order.
+        f: Binary file object opened for writing.
+        chunk_size: Maximum number of plaintext bytes processed per update.
+    """
+    out = bytearray(chunk_size + AES_BLOCK_SIZE - 1)
+    out_view = memoryview(out)
+    for piece in pieces:
+        data = memoryview(piece).cast('B')
+        for offset in range(0, len(data), chunk_size):
+            n = encryptor.update_into(data[offset:offset + chunk_size], out)
+            f.write(out_view[:n])
+    tail = encryptor.finalize()
+    if tail:
+        f.write(tail)
+
+
+def decrypt_from_file(decryptor, f, out: memoryview, chunk_size: int, advance=None):
+    """
+    Decrypts ciphertext read from an open file straight into a preallocated buffer.
+
+    Args:
+        decryptor: A cryptography cipher context from ``Cipher.decryptor()``.
+        f: Binary file object positioned at the start of the ciphertext.
+        out: Writable byte view sized to the expected plaintext length.
+        chunk_size: Number of ciphertext bytes read per update.
+        advance: Optional callback receiving the number of ciphertext bytes
+            processed after every update.
+
+    Raises:
+        ValueError: If the file holds less ciphertext than ``out`` expects.
+    """
+    chunk = bytearray(chunk_size)
+    chunk_view = memoryview(chunk)
+    scratch = bytearray(chunk_size + AES_BLOCK_SIZE - 1)
+    offset = 0
+    while offset < len(out):
+        n = f.readinto(chunk_view[:min(chunk_size, len(out) - offset)])
+        if not n:
+            raise ValueError("Encrypted payload is truncated.")
+        offset += update_into(decryptor, chunk_view[:n], out[offset:], scratch)
+        if advance is not None:
+            advance(n)
+    decryptor.finalize()
+
+
+def iter_decrypted(decryptor, f, chunk_size: int, advance=None):
+    """
+    Decrypts the rest of an open file chunk by chunk.
+
+    Each yielded view aliases one reusable buffer and is only valid until the
+    next iteration.
+
+    Args:
+        decryptor: A cryptography cipher context from ``Cipher.decryptor()``.
+        f: Binary file object positioned at the start of the ciphertext.
+        chunk_size: Number of ciphertext bytes read per update.
+        advance: Optional callback receiving the number of ciphertext bytes
+            processed after every update.
+
+    Yields:
+        memoryview slices of plaintext.
+    """
+    chunk = bytearray(chunk_size)
+    chunk_view = memoryview(chunk)
+    out = bytearray(chunk_size + AES_BLOCK_SIZE - 1)
+    out_view = memoryview(out)
+    while True:
+        n = f.readinto(chunk_view)
+        if not n:
+            break
+        yield out_view[:decryptor.update_into(chunk_view[:n], out)]
+        if advance is not None:
+            advance(n)
+    tail = decryptor.finalize()
+    if tail:
+        yield memoryview(tail)
+
+
+def update_into(ctx, data: memoryview, out: memoryview, scratch: bytearray = None) -> int:
+    """
+    Runs ``ctx.update_into`` writing directly into ``out`` whenever possible.
+
+    Older cryptography releases require the output buffer to be a block
+    larger than the input even for stream modes. When ``out`` is too small
+    for them the update goes through ``scratch`` and only the produced bytes
+    are copied back.
+
+    Returns:
+        The number of bytes written to ``out``.
+    """
+    if len(out) < len(data) + AES_BLOCK_SIZE - 1:
+        try:
+            return ctx.update_into(data, out)
+        except ValueError:
+            # The buffer length is checked before any input is consumed
+            scratch = scratch if scratch is not None else bytearray(len(data) + AES_BLOCK_SIZE - 1)
+            n = ctx.update_into(data, scratch)
+            out[:n] = memoryview(scratch)[:n]
+            return n
+    return ctx.update_into(data, out)
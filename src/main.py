@@ -1,4 +1,14 @@
-from ui.gui_interface import start_gui
+import sys
 
 if __name__ == "__main__":
+    # Any arguments select the headless CLI; the GUI (and Tk) is only
+    # imported when started without them.
+    if len(sys.argv) > 1:
+        from cli import main
+        sys.exit(main())
+
+    from utils.instrumentation import configure_from_env
+    configure_from_env()
+
+    from ui.gui_interface import start_gui
     start_gui()
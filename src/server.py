@@ -0,0 +1,186 @@
+"""
+Minimal HTTP front end for the asyncio service, built on asyncio streams only.
+
+It is a local stand-in for a real deployment, for integration and load
+testing: HTTP/1.1 with keep-alive and ``Content-Length`` bodies, nothing else.
+
+Endpoints:
+    POST /encrypt  body: image, header ``X-Password``; query: ``payload``,
+                   ``cipher``, ``rgb=1``. Returns the container.
+    POST /decrypt  body: container, header ``X-Password``. Returns the image,
+                   with its extension in ``X-Extension``.
+    GET  /stats    Returns :meth:`CryptoService.stats` as JSON.
+
+A full queue answers ``503`` with ``Retry-After``; bad input or a wrong
+password answers ``400``.
+
+Usage:
+    python cli.py serve --port 8080 --workers 4
+"""
+import asyncio
+import json
+import logging
+import mimetypes
+from urllib.parse import parse_qs, urlsplit
+
+from config import CHUNK_SIZE
+from encryption.service import CryptoService, ServiceBusy, write_stream
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_LINES = 100
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           411: 'Length Required', 413: 'Content Too Large', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str = None, headers: dict = None):
+        super().__init__(message or REASONS[status])
+        self.status = status
+        self.headers = headers or {}
+
+
+class _Body:
+    """Reads at most ``length`` bytes of a request body from the connection."""
+    def __init__(self, reader: asyncio.StreamReader, length: int):
+        self._reader = reader
+        self.remaining = length
+
+    async def read(self, n: int = CHUNK_SIZE) -> bytes:
+        if not self.remaining:
+            return b''
+        chunk = await self._reader.read(min(n, self.remaining))
+        if not chunk:
+            raise ConnectionError("Client closed the connection mid-body.")
+        self.remaining -= len(chunk)
+        return chunk
+
+
+async def _read_request(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400, "Malformed request line.")
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise HttpError(400, "Too many headers.")
+    return method, target, version, headers
+
+
+async def _send(writer: asyncio.StreamWriter, status: int, body: bytes = b'',
+                content_type: str = 'text/plain; charset=utf-8', headers: dict = None,
+                keep_alive: bool = True):
+    head = [f"HTTP/1.1 {status} {REASONS[status]}", f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+    await write_stream(writer, body)
+
+
+class Server:
+    """
+    Serves one :class:`CryptoService` over HTTP.
+
+    Args:
+        service: The service requests are run on.
+    """
+    def __init__(self, service: CryptoService):
+        self.service = service
+
+    async def _dispatch(self, method: str, target: str, headers: dict, body: _Body):
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if url.path == '/stats':
+            if method != 'GET':
+                raise HttpError(405)
+            return 200, json.dumps(self.service.stats()).encode(), 'application/json', {}
+        if url.path not in ('/encrypt', '/decrypt'):
+            raise HttpError(404)
+        if method != 'POST':
+            raise HttpError(405)
+        password = headers.get('x-password')
+        if not password:
+            raise HttpError(400, "The X-Password header is required.")
+
+        if url.path == '/encrypt':
+            data = await self.service.encrypt(body, password, payload=query.get('payload', 'pixels'),
+                                              cipher=query.get('cipher', 'aes-gcm-chunked'),
+                                              native=query.get('rgb') != '1')
+            return 200, data, 'application/octet-stream', {}
+        data, ext = await self.service.decrypt(body, password)
+        content_type = mimetypes.guess_type('image' + ext)[0] or 'application/octet-stream'
+        return 200, data, content_type, {"X-Extension": ext}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serves the requests of one connection until either side closes it."""
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HttpError as e:
+                    await _send(writer, e.status, str(e).encode(), keep_alive=False)
+                    return
+                if request is None:
+                    return
+                method, target, version, headers = request
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                body = _Body(reader, 0)
+                try:
+                    if 'transfer-encoding' in headers:
+                        raise HttpError(411, "Send a Content-Length body.")
+                    try:
+                        body.remaining = int(headers.get('content-length', 0))
+                    except ValueError:
+                        raise HttpError(400, "Invalid Content-Length.")
+                    if body.remaining > self.service.max_size:
+                        raise HttpError(413)
+                    status, data, content_type, extra = await self._dispatch(method, target, headers, body)
+                except HttpError as e:
+                    status, data, content_type, extra = e.status, str(e).encode(), 'text/plain', e.headers
+                except ServiceBusy as e:
+                    status, data, content_type, extra = 503, str(e).encode(), 'text/plain', {"Retry-After": "1"}
+                except ConnectionError:
+                    raise
+                except (ValueError, OSError) as e:
+                    status, data, content_type, extra = 400, str(e).encode(), 'text/plain', {}
+                except Exception as e:
+                    logger.exception("Request failed: %s %s", method, target)
+                    status, data, content_type, extra = 500, f"{type(e).__name__}".encode(), 'text/plain', {}
+                # An unread body would be parsed as the next request
+                keep_alive = keep_alive and not body.remaining
+                await _send(writer, status, data, content_type, extra, keep_alive)
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080) -> asyncio.Server:
+        """Starts listening; ``port=0`` picks a free port (see ``server.sockets``)."""
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def serve(host: str = '127.0.0.1', port: int = 8080, workers: int = None, max_queued: int = None):
+    """Runs the HTTP server until cancelled."""
+    options = {} if max_queued is None else {"max_queued": max_queued}
+    service = CryptoService(workers, **options)
+    server = await Server(service).start(host, port)
+    address = server.sockets[0].getsockname()
+    print(f"✅ Serving on http://{address[0]}:{address[1]} "
+          f"({service.workers} workers, {service.max_queued} queued)", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
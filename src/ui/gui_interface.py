@@ -3,12 +3,16 @@ import time
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 from ttkbootstrap.widgets import Meter
-from tkinter import filedialog, messagebox, PhotoImage
+from tkinter import filedialog, messagebox
 import pyperclip
 
 from encryption.encryptor import encrypt_image
 from encryption.decryptor import decrypt_image
+from config import DEDUP_INDEX
+from encryption.dedup import DedupIndex, encrypt_deduplicated
 from encryption.key_manager import KeyManager
+from ui.jobs import JobRunner
+from ui.preview import PreviewService
 
 
 def start_gui():
@@ -27,6 +31,8 @@ def start_gui():
     app.place_window_center()
 
     key_manager_instance = KeyManager()
+    jobs = JobRunner(app)
+    previews = PreviewService(app)
 
     # --- UI Variables ---
     encrypt_path_var = ttk.StringVar()
@@ -133,26 +139,31 @@ def start_gui():
     meter.pack(pady=10)
     meter_text = ttk.Label(app, text="Status: Idle 💤", font=("Segoe UI", 12))
     meter_text.pack()
+    ttk.Button(app, text="⛔ Cancel", bootstyle="outline-warning",
+               command=lambda: jobs.cancel_all()).pack(pady=5)
 
     # --- HELPER FUNCTIONS ---
-    def update_meter_smooth(task_name):
-        for i in range(101):
-            meter.configure(amountused=i)
-            meter_text.config(text=f"{task_name}... {i}%")
-            app.update()
-            time.sleep(0.01)
+    def show_progress(task_name, done=0, total=0):
+        percent = done * 100 // total if total else 0
+        queued = jobs.pending - 1
+        meter.configure(amountused=percent)
+        meter_text.config(text=f"{task_name}... {percent}%" + (f" ({queued} queued)" if queued > 0 else ""))
+
+    def reset_meter(job=None):
+        # Called as a job finishes; it still counts as pending here
+        if jobs.pending <= 1:
+            meter.configure(amountused=0)
+            meter_text.config(text="Status: Idle 💤")
+
+    def cancelled(job):
+        reset_meter()
+        meter_text.config(text=f"⛔ Cancelled: {job.name}")
 
     def toggle_password(entry, var):
         entry.configure(show="" if var.get() else "*")
 
     def show_preview(path, label):
-        try:
-            img = PhotoImage(file=path)
-            img = img.subsample(max(img.width() // 150, 1), max(img.height() // 150, 1))
-            label.configure(image=img)
-            label.image = img
-        except:
-            label.configure(image='')
+        previews.show(path, label)
 
     def select_encrypt_file():
         path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png;*.jpg;*.jpeg")])
@@ -171,29 +182,37 @@ def start_gui():
         if not image_path or not password:
             messagebox.showwarning("Missing Input", "Please select an image and enter a password.")
             return
-        try:
+        filename = os.path.basename(image_path)
+        timestamp = int(time.time())
+        output_path = os.path.join('encrypted_images', f"encrypted_{timestamp}_{filename}.enc")
+
+        def work(progress):
+            if DEDUP_INDEX:
+                # Content already encrypted with this password is reused, not re-encrypted
+                with DedupIndex(DEDUP_INDEX) as index:
+                    path, _ = encrypt_deduplicated(index, image_path, output_path, password, progress=progress)
+                return path
             key, salt = key_manager_instance.generate_key_from_password(password)
-            filename = os.path.basename(image_path)
-            timestamp = int(time.time())
-            output_path = os.path.join('encrypted_images', f"encrypted_{timestamp}_{filename}.enc")
-            salt_path = output_path + ".salt"
-
-            update_meter_smooth("Encrypting 🔥")
+            encrypt_image(image_path, output_path, key, salt, progress=progress)
+            return output_path
 
-            encrypt_image(image_path, output_path, key, salt)
-            with open(salt_path, "wb") as f:
-                f.write(salt)
-
-            meter.configure(amountused=100)
+        def done(job, output_path):
+            reset_meter()
             meter_text.config(text="✅ Encryption Complete!")
             pyperclip.copy(output_path)
             messagebox.showinfo("Success", f"Image encrypted!\nSaved as:\n{output_path}\n(Path copied to clipboard)")
 
-        except Exception as e:
+        def failed(job, e):
+            reset_meter()
             messagebox.showerror("Error", f"Encryption Failed:\n{str(e)}")
-        finally:
-            meter.configure(amountused=0)
-            meter_text.config(text="Status: Idle 💤")
+
+        task_name = f"Encrypting 🔥 {filename}"
+        jobs.submit(filename, work,
+                    on_start=lambda job: show_progress(task_name),
+                    on_progress=lambda job, n, total: show_progress(task_name, n, total),
+                    on_done=done, on_error=failed, on_cancel=cancelled)
+        if jobs.pending > 1:
+            meter_text.config(text=f"Queued: {filename} ({jobs.pending - 1} ahead)")
 
     def decrypt_action():
         enc_path = decrypt_path_var.get()
@@ -201,33 +220,37 @@ def start_gui():
         if not enc_path or not password:
             messagebox.showwarning("Missing Input", "Please select a file and enter a password.")
             return
-        salt_path = enc_path + ".salt"
-        if not os.path.exists(salt_path):
-            messagebox.showerror("Error", f"Missing salt file:\n{salt_path}")
-            return
-        with open(salt_path, "rb") as f:
-            salt = f.read()
-        try:
-            key, _ = key_manager_instance.generate_key_from_password(password, salt)
-            filename = os.path.basename(enc_path).replace('.enc', '')
-            timestamp = int(time.time())
-            output_path = os.path.join('decrypted_images', f"decrypted_{timestamp}_{filename}.png")
+        filename = os.path.basename(enc_path).replace('.enc', '')
+        timestamp = int(time.time())
+        output_path = os.path.join('decrypted_images', f"decrypted_{timestamp}_{filename}.png")
 
-            update_meter_smooth("Decrypting 🧩")
+        def work(progress):
+            # The salt and KDF settings are read from the file header
+            return decrypt_image(enc_path, output_path, password, progress=progress)
 
-            decrypt_image(enc_path, output_path, password)
+        def done(job, output_path):
             show_preview(output_path, decrypt_preview_label)
-
-            meter.configure(amountused=100)
+            reset_meter()
             meter_text.config(text="✅ Decryption Complete!")
             pyperclip.copy(output_path)
             messagebox.showinfo("Success", f"Decrypted image saved as:\n{output_path}\n(Path copied to clipboard)")
 
-        except Exception as e:
+        def failed(job, e):
+            reset_meter()
             messagebox.showerror("Error", f"Decryption Failed:\n{str(e)}")
-        finally:
-            meter.configure(amountused=0)
-            meter_text.config(text="Status: Idle 💤")
+
+        task_name = f"Decrypting 🧩 {filename}"
+        jobs.submit(filename, work,
+                    on_start=lambda job: show_progress(task_name),
+                    on_progress=lambda job, n, total: show_progress(task_name, n, total),
+                    on_done=done, on_error=failed, on_cancel=cancelled)
+        if jobs.pending > 1:
+            meter_text.config(text=f"Queued: {filename} ({jobs.pending - 1} ahead)")
+
+    def close():
+        jobs.shutdown()
+        previews.shutdown()
+        app.destroy()
 
     # --- FOOTER ---
     ttk.Label(
@@ -237,4 +260,5 @@ def start_gui():
         foreground="#FF073A"
     ).pack(pady=15)
 
+    app.protocol("WM_DELETE_WINDOW", close)
     app.mainloop()
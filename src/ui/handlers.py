@@ -6,14 +6,18 @@ from tkinter import filedialog, messagebox
 
 from encryption.encryptor import encrypt_image
 from encryption.decryptor import decrypt_image
+from config import DEDUP_INDEX
+from encryption.dedup import DedupIndex, encrypt_deduplicated
 from encryption.key_manager import KeyManager
-from utils import show_preview, update_meter_smooth, toggle_password
+from ui.jobs import JobRunner
+from ui.utils import show_preview, show_progress, reset_meter, toggle_password
 
 
 class EncryptHandler:
-    def __init__(self, root):
+    def __init__(self, root, jobs=None):
         self.root = root
         self.key_manager = KeyManager()
+        self.jobs = jobs or JobRunner(root)
 
     def create_widgets(self, parent, path_var, pass_var, show_var, preview_label, meter, meter_text):
         from ttkbootstrap import ttk
@@ -48,34 +52,41 @@ class EncryptHandler:
         if not image_path or not password:
             messagebox.showwarning("Missing Input", "Please select an image and enter a password.")
             return
-        try:
+        filename = os.path.basename(image_path)
+        timestamp = int(time.time())
+        output_path = os.path.join('encrypted_images', f"encrypted_{timestamp}_{filename}.enc")
+
+        def work(progress):
+            if DEDUP_INDEX:
+                # Content already encrypted with this password is reused, not re-encrypted
+                with DedupIndex(DEDUP_INDEX) as index:
+                    path, _ = encrypt_deduplicated(index, image_path, output_path, password, progress=progress)
+                return path
             key, salt = self.key_manager.generate_key_from_password(password)
-            filename = os.path.basename(image_path)
-            timestamp = int(time.time())
-            output_path = os.path.join('encrypted_images', f"encrypted_{timestamp}_{filename}.enc")
-            salt_path = output_path + ".salt"
+            encrypt_image(image_path, output_path, key, salt, progress=progress)
+            return output_path
 
-            update_meter_smooth("Encrypting 🔥", meter, meter_text)
-
-            encrypt_image(image_path, output_path, key, salt)
-            with open(salt_path, "wb") as f:
-                f.write(salt)
-
-            meter.configure(amountused=100)
+        def done(job, output_path):
+            reset_meter(meter, meter_text)
             meter_text.config(text="✅ Encryption Complete!")
             pyperclip.copy(output_path)
             messagebox.showinfo("Success", f"Image encrypted!\nSaved as:\n{output_path}\n(Path copied to clipboard)")
-        except Exception as e:
+
+        def failed(job, e):
+            reset_meter(meter, meter_text)
             messagebox.showerror("Error", f"Encryption Failed:\n{str(e)}")
-        finally:
-            meter.configure(amountused=0)
-            meter_text.config(text="Status: Idle 💤")
+
+        self.jobs.submit(filename, work,
+                         on_start=lambda job: show_progress("Encrypting 🔥", meter, meter_text),
+                         on_progress=lambda job, n, total: show_progress("Encrypting 🔥", meter, meter_text, n, total),
+                         on_done=done, on_error=failed,
+                         on_cancel=lambda job: reset_meter(meter, meter_text))
 
 
 class DecryptHandler:
-    def __init__(self, root):
+    def __init__(self, root, jobs=None):
         self.root = root
-        self.key_manager = KeyManager()
+        self.jobs = jobs or JobRunner(root)
 
     def create_widgets(self, parent, path_var, pass_var, show_var, preview_label, meter, meter_text):
         from ttkbootstrap import ttk
@@ -106,33 +117,30 @@ class DecryptHandler:
             path_var.set(path)
 
     def decrypt_action(self, enc_path, password, preview_label, meter, meter_text):
-        from tkinter import messagebox
-
         if not enc_path or not password:
             messagebox.showwarning("Missing Input", "Please select a file and enter a password.")
             return
-        salt_path = enc_path + ".salt"
-        if not os.path.exists(salt_path):
-            messagebox.showerror("Error", f"Missing salt file:\n{salt_path}")
-            return
-        with open(salt_path, "rb") as f:
-            salt = f.read()
-        try:
-            key, _ = self.key_manager.generate_key_from_password(password, salt)
-            filename = os.path.basename(enc_path).replace('.enc', '')
-            timestamp = int(time.time())
-            output_path = os.path.join('decrypted_images', f"decrypted_{timestamp}_{filename}.png')
-
-            update_meter_smooth("Decrypting 🧩", meter, meter_text)
-            decrypt_image(enc_path, output_path, password)
-            show_preview(output_path, preview_label)
+        filename = os.path.basename(enc_path).replace('.enc', '')
+        timestamp = int(time.time())
+        output_path = os.path.join('decrypted_images', f"decrypted_{timestamp}_{filename}.png")
+
+        def work(progress):
+            # The salt and KDF settings are read from the file header
+            return decrypt_image(enc_path, output_path, password, progress=progress)
 
-            meter.configure(amountused=100)
+        def done(job, output_path):
+            show_preview(output_path, preview_label)
+            reset_meter(meter, meter_text)
             meter_text.config(text="✅ Decryption Complete!")
             pyperclip.copy(output_path)
             messagebox.showinfo("Success", f"Decrypted image saved as:\n{output_path}\n(Path copied to clipboard)")
-        except Exception as e:
+
+        def failed(job, e):
+            reset_meter(meter, meter_text)
             messagebox.showerror("Error", f"Decryption Failed:\n{str(e)}")
-        finally:
-            meter.configure(amountused=0)
-            meter_text.config(text="Status: Idle 💤")
+
+        self.jobs.submit(filename, work,
+                         on_start=lambda job: show_progress("Decrypting 🧩", meter, meter_text),
+                         on_progress=lambda job, n, total: show_progress("Decrypting 🧩", meter, meter_text, n, total),
+                         on_done=done, on_error=failed,
+                         on_cancel=lambda job: reset_meter(meter, meter_text))
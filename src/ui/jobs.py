@@ -0,0 +1,130 @@
+"""
+Background jobs for the GUI.
+
+Key derivation, encryption and decryption run on a worker thread so the Tk
+event loop never blocks. Workers never touch widgets: their progress and
+results are put on a queue that the Tk thread drains with ``after()``.
+Jobs submitted while another one is running wait their turn in order.
+"""
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    """Raised inside a job (from its progress callback) once it has been cancelled."""
+
+
+class Job:
+    """One submitted unit of work; ``cancel()`` may be called at any time."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Stops the job at its next progress report, or before it starts if still queued."""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+
+class JobRunner:
+    """
+    Runs GUI jobs on background threads and reports back on the Tk thread.
+
+    Args:
+        root: Any Tk widget; its ``after()`` drives the event queue.
+        workers: Jobs run at the same time; further jobs are queued.
+        poll_ms: Interval at which the Tk thread picks up job events.
+    """
+
+    def __init__(self, root, workers: int = 1, poll_ms: int = 50):
+        self._root = root
+        self._poll_ms = poll_ms
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gui-job')
+        self._events = queue.SimpleQueue()
+        self._jobs = []  # Submitted and not yet finished; only touched on the Tk thread
+        self._closed = False
+        self._root.after(self._poll_ms, self._poll)
+
+    def submit(self, name: str, work, on_start=None, on_progress=None, on_done=None,
+               on_error=None, on_cancel=None) -> Job:
+        """
+        Queues ``work(progress)`` to run in the background.
+
+        ``work`` receives a ``progress(done, total)`` callback to pass on to
+        :func:`~encryption.encryptor.encrypt_image` /
+        :func:`~encryption.decryptor.decrypt_image`; it raises
+        :class:`JobCancelled` once the job is cancelled. All ``on_*``
+        callbacks are invoked on the Tk thread with the job as first argument:
+        ``on_progress(job, done, total)``, ``on_done(job, result)`` and
+        ``on_error(job, exception)``.
+
+        Returns:
+            The :class:`Job`, which can be cancelled.
+        """
+        job = Job(name)
+        self._jobs.append(job)
+        percent = -1
+
+        def progress(done: int, total: int):
+            nonlocal percent
+            if job.cancelled:
+                raise JobCancelled(name)
+            # Only forward visible changes so fast jobs don't flood the Tk thread
+            current = done * 100 // total if total else 100
+            if current != percent:
+                percent = current
+                self._post(on_progress, job, done, total)
+
+        def run():
+            try:
+                if job.cancelled:
+                    raise JobCancelled(name)
+                self._post(on_start, job)
+                result = work(progress)
+            except JobCancelled:
+                self._post(on_cancel, job)
+            except Exception as e:
+                self._post(on_error, job, e)
+            else:
+                self._post(on_done, job, result)
+            finally:
+                self._post(self._jobs.remove, job)
+
+        self._executor.submit(run)
+        return job
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs running or waiting to run."""
+        return len(self._jobs)
+
+    def cancel_all(self):
+        """Cancels the running job and everything queued behind it."""
+        for job in self._jobs:
+            job.cancel()
+
+    def shutdown(self):
+        """Cancels all jobs and stops polling; call before destroying the window."""
+        self._closed = True
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _post(self, callback, *args):
+        if callback is not None:
+            self._events.put((callback, args))
+
+    def _poll(self):
+        if self._closed:
+            return
+        self._root.after(self._poll_ms, self._poll)
+        while True:
+            try:
+                callback, args = self._events.get_nowait()
+            except queue.Empty:
+                return
+            callback(*args)
@@ -0,0 +1,221 @@
+"""
+Thumbnail previews for the GUI.
+
+Previews are decoded at reduced size: JPEGs through Pillow's ``draft()``
+(the decoder skips straight to 1/2, 1/4 or 1/8 scale) and ``thumbnail()``,
+and large rasters a :class:`~utils.strip_reader.StripReader` can read band
+by band, so a 50 MP photo never decodes in full. Thumbnails are kept in an
+in-memory LRU keyed by path and modification time, optionally backed by a
+directory of PNG thumbnails, and are generated on background threads so
+selecting a file never stalls the Tk event loop.
+
+The disk cache is off by default: thumbnails of decrypted images are
+unencrypted copies of their content.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from config import PREVIEW_CACHE_SIZE, PREVIEW_DISK_CACHE, PREVIEW_SIZE
+from ui.jobs import JobRunner
+from utils.strip_reader import strip_reader
+
+logger = logging.getLogger(__name__)
+
+
+def _to_display(img: Image.Image) -> Image.Image:
+    if img.mode.startswith('I;16'):
+        img = img.convert('I').point(lambda value: value / 256).convert('L')  # Keep the top 8 bits
+    return img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+
+
+def _banded_thumbnail(img: Image.Image, reader, size: tuple) -> Image.Image:
+    # Shrink each band by an integer factor as it is decoded; memory stays at one band
+    factor = max(1, min(img.width // size[0], img.height // size[1]))
+    rows = max(factor, reader.strip_rows - reader.strip_rows % factor)
+    small = None
+    for top in range(0, img.height, rows):
+        band = reader.rows(top, min(top + rows, img.height))
+        band = _to_display(band).reduce(factor)
+        if small is None:
+            small = Image.new(band.mode, (-(-img.width // factor), -(-img.height // factor)))
+        small.paste(band, (0, top // factor))
+    small.thumbnail(size)
+    return small
+
+
+def make_thumbnail(path: str, size: tuple = PREVIEW_SIZE) -> Image.Image:
+    """
+    Decodes an image at reduced size and returns an RGB or RGBA thumbnail that fits ``size``.
+
+    Raises:
+        OSError: If the file cannot be read or is not an image.
+    """
+    with Image.open(path) as img:
+        if img.width > size[0] * 2 or img.height > size[1] * 2:
+            reader = strip_reader(img)
+            if reader is not None:
+                return _banded_thumbnail(img, reader, size)
+        img.draft('RGB', size)  # JPEG: decode at the smallest of 1/2 to 1/8 scale still covering size
+        img.thumbnail((size[0] * 2, size[1] * 2), reducing_gap=2.0)
+        thumbnail = _to_display(img)
+    thumbnail.thumbnail(size)
+    return thumbnail
+
+
+class ThumbnailCache:
+    """
+    LRU cache of thumbnails keyed by (path, mtime, size), optionally persisted as PNGs.
+
+    A file that changes on disk gets a new modification time and so a new
+    entry; the stale one ages out.
+
+    Args:
+        max_entries: Thumbnails kept in memory.
+        directory: Directory for PNG copies of the thumbnails, or None.
+    """
+    def __init__(self, max_entries: int = PREVIEW_CACHE_SIZE, directory: str = PREVIEW_DISK_CACHE):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.disk_hits = 0
+
+    @staticmethod
+    def key(path: str, size: tuple = PREVIEW_SIZE) -> tuple:
+        """Returns the cache key of ``path`` as it is now; raises OSError if it is gone."""
+        path = os.path.abspath(path)
+        return path, os.stat(path).st_mtime_ns, tuple(size)
+
+    def _disk_path(self, key: tuple) -> str:
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.png')
+
+    def get(self, key: tuple):
+        """Returns the cached thumbnail or None; consults the disk cache on a memory miss."""
+        with self._lock:
+            thumbnail = self._entries.get(key)
+            if thumbnail is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return thumbnail
+        if self.directory:
+            try:
+                with Image.open(self._disk_path(key)) as img:
+                    thumbnail = img.copy()
+            except OSError:
+                pass
+            else:
+                self.disk_hits += 1
+                self._remember(key, thumbnail)
+                return thumbnail
+        self.misses += 1
+        return None
+
+    def put(self, key: tuple, thumbnail: Image.Image):
+        """Caches a thumbnail in memory and, if enabled, on disk."""
+        self._remember(key, thumbnail)
+        if self.directory:
+            disk_path = self._disk_path(key)
+            partial = f"{disk_path}.{threading.get_ident()}.part"
+            try:
+                os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+                thumbnail.save(partial, 'PNG')
+                os.replace(partial, disk_path)
+            except OSError:
+                logger.warning("Could not write preview cache file %s", disk_path, exc_info=True)
+
+    def _remember(self, key: tuple, thumbnail: Image.Image):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = thumbnail
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def thumbnail(self, path: str, size: tuple = PREVIEW_SIZE) -> Image.Image:
+        """Returns the thumbnail of ``path``, from the cache or freshly decoded."""
+        key = self.key(path, size)
+        thumbnail = self.get(key)
+        if thumbnail is None:
+            thumbnail = make_thumbnail(path, size)
+            self.put(key, thumbnail)
+        return thumbnail
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class PreviewService:
+    """
+    Shows thumbnails in Tk labels, decoding them on background threads.
+
+    A cached thumbnail is shown at once. Otherwise the label is cleared and
+    filled in when the thumbnail is ready, unless another preview was
+    requested for the same label in the meantime.
+
+    Args:
+        root: Any Tk widget.
+        cache: Thumbnail cache; a new :class:`ThumbnailCache` by default.
+        size: Largest thumbnail width and height.
+        workers: Previews decoded at the same time.
+    """
+    def __init__(self, root, cache: ThumbnailCache = None, size: tuple = PREVIEW_SIZE, workers: int = 2):
+        self.cache = ThumbnailCache() if cache is None else cache
+        self.size = size
+        self._jobs = JobRunner(root, workers=workers)
+        self._requests = {}  # Label -> its latest preview job; only touched on the Tk thread
+
+    def show(self, path: str, label):
+        """Shows the preview of ``path`` in ``label``, now if cached, else once it is decoded."""
+        previous = self._requests.pop(label, None)
+        if previous is not None:
+            previous.cancel()  # Not decoded yet: no longer wanted
+        try:
+            key = self.cache.key(path, self.size)
+        except OSError:
+            key, thumbnail = None, None
+        else:
+            thumbnail = self.cache.get(key)
+        if thumbnail is not None:
+            self._display(label, thumbnail)
+            return
+        label.configure(image='')
+        label.image = None
+
+        def work(progress):
+            if key is None:
+                raise FileNotFoundError(path)
+            thumbnail = make_thumbnail(path, self.size)
+            self.cache.put(key, thumbnail)
+            return thumbnail
+
+        def done(job, thumbnail):
+            if self._requests.get(label) is job:
+                del self._requests[label]
+                self._display(label, thumbnail)
+
+        def failed(job, e):
+            if self._requests.get(label) is job:
+                del self._requests[label]
+            logger.info("No preview for %s: %s", path, e)
+
+        self._requests[label] = self._jobs.submit(
+            path, work, on_done=done, on_error=failed)
+
+    @staticmethod
+    def _display(label, thumbnail: Image.Image):
+        from PIL import ImageTk
+
+        photo = ImageTk.PhotoImage(thumbnail, master=label)
+        label.configure(image=photo)
+        label.image = photo  # Tk does not keep a reference
+
+    def shutdown(self):
+        """Drops pending previews; call before destroying the window."""
+        self._jobs.shutdown()
@@ -1,17 +1,20 @@
 # utils.py
-import time
-from tkinter import PhotoImage
+from ui.preview import PreviewService
+
+_previews = None
+
+
+def preview_service(root) -> PreviewService:
+    """Return the window's shared preview service, creating it on first use"""
+    global _previews
+    if _previews is None:
+        _previews = PreviewService(root.winfo_toplevel())
+    return _previews
 
 
 def show_preview(path, label):
-    """Show image preview in label"""
-    try:
-        img = PhotoImage(file=path)
-        img = img.subsample(max(img.width() // 150, 1), max(img.height() // 150, 1))
-        label.configure(image=img)
-        label.image = img
-    except:
-        label.configure(image='')
+    """Show image preview in label (decoded in the background; see ui.preview)"""
+    preview_service(label).show(path, label)
 
 
 def toggle_password(entry, var):
@@ -19,10 +22,14 @@ def toggle_password(entry, var):
     entry.configure(show="" if var.get() else "*")
 
 
-def update_meter_smooth(task_name, meter, meter_text):
-    """Animate the progress meter"""
-    for i in range(101):
-        meter.configure(amountused=i)
-        meter_text.config(text=f"{task_name}... {i}%")
-        meter_text.update()
-        time.sleep(0.01)
+def show_progress(task_name, meter, meter_text, done=0, total=0):
+    """Show real job progress on the meter"""
+    percent = done * 100 // total if total else 0
+    meter.configure(amountused=percent)
+    meter_text.config(text=f"{task_name}... {percent}%")
+
+
+def reset_meter(meter, meter_text):
+    """Return the meter to idle"""
+    meter.configure(amountused=0)
+    meter_text.config(text="Status: Idle 💤")
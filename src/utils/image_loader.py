@@ -1,6 +1,20 @@
 import os
+from contextlib import contextmanager
 from PIL import Image
 import numpy as np
+from utils.strip_reader import strip_reader
+from utils.instrumentation import error, stage
+
+# Modes whose raw Image.tobytes() buffer is encrypted as-is: (bands per pixel, dtype).
+# '1' packs 8 pixels per byte with each row padded to a whole byte. 'I' and 'F'
+# use the machine's byte order, which the header dtype records.
+NATIVE_LAYOUTS = {
+    '1': (None, '|u1'), 'L': (1, '|u1'), 'P': (1, '|u1'), 'LA': (2, '|u1'), 'PA': (2, '|u1'),
+    'RGB': (3, '|u1'), 'RGBA': (4, '|u1'), 'CMYK': (4, '|u1'), 'LAB': (3, '|u1'),
+    'I': (1, '=i4'), 'F': (1, '=f4'), 'I;16': (1, '<u2'), 'I;16L': (1, '<u2'), 'I;16B': (1, '>u2'),
+}
+# Native modes PNG stores losslessly; the others are written as TIFF
+PNG_MODES = ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I;16')
 
 def load_image(image_path: str):
     """
@@ -16,33 +30,226 @@ def load_image(image_path: str):
     try:
         with Image.open(image_path) as img:
             original_mode = img.mode
-            img_rgb = img.convert('RGB')
-            return np.array(img_rgb), original_mode
-    except FileNotFoundError:
+            with stage('decode'):
+                img.load()
+            with stage('convert'):
+                img_rgb = img.convert('RGB')
+                # asarray wraps Pillow's exported buffer instead of copying it again
+                return np.asarray(img_rgb), original_mode
+    except FileNotFoundError as e:
+        error('load_image', e)
         print(f"Error: The file at {image_path} was not found.")
         return None, None
     except Exception as e:
+        error('load_image', e)
         print(f"Error loading image: {e}")
         return None, None
 
-def save_image(image_array: np.ndarray, output_path: str, original_mode: str):
+def native_layout(mode: str, width: int, height: int):
+    """
+    Describes the raw buffer of an image stored in its own mode.
+
+    Args:
+        mode: A mode from ``NATIVE_LAYOUTS``.
+        width: Image width in pixels.
+        height: Image height in pixels.
+
+    Returns:
+        A tuple of (shape, dtype, row_bytes). ``shape`` is (height, width[, bands])
+        and ``dtype`` a NumPy dtype string; for packed '1' images they describe
+        pixels, not bytes, and ``row_bytes`` is the padded byte width.
+    """
+    bands, dtype = NATIVE_LAYOUTS[mode]
+    dtype = np.dtype(dtype).str
+    if bands is None:
+        return (height, width), dtype, (width + 7) // 8
+    shape = (height, width) if bands == 1 else (height, width, bands)
+    return shape, dtype, width * bands * np.dtype(dtype).itemsize
+
+def image_attributes(img) -> dict:
+    """
+    Collects what a raw pixel buffer does not carry: palette, transparency and ICC profile.
+
+    Returns:
+        A dict with any of 'palette' ((rawmode, bytes)), 'transparency' and 'icc_profile'.
+    """
+    attributes = {}
+    if img.mode in ('P', 'PA') and img.palette is not None:
+        palette = img.palette
+        if palette.rawmode:
+            # Still in the file's layout (e.g. TIFF 'RGB;L') until the image is loaded
+            resolved = Image.new('P', (1, 1))
+            resolved.putpalette(palette.palette, palette.rawmode)
+            palette = resolved.palette
+        attributes['palette'] = (palette.mode, palette.tobytes())
+    if 'transparency' in img.info:
+        attributes['transparency'] = img.info['transparency']
+    if img.info.get('icc_profile'):
+        attributes['icc_profile'] = img.info['icc_profile']
+    return attributes
+
+def format_extension(image_format: str) -> str:
+    """Returns the usual file extension of a Pillow format name (e.g. 'JPEG' -> '.jpeg')."""
+    extensions = [ext for ext, name in Image.registered_extensions().items() if name == image_format]
+    preferred = '.' + (image_format or '').lower()
+    if preferred in extensions or not extensions:
+        return preferred if image_format else ''
+    return extensions[0]
+
+def probe_image(image_path):
+    """
+    Reads an image's dimensions, mode and format from its header without decoding pixels.
+
+    Args:
+        image_path: The path to the image file, or a binary file-like object.
+
+    Returns:
+        A tuple of (shape, mode, format) where ``shape`` is (height, width, bands).
+    """
+    with Image.open(image_path) as img:
+        return (img.height, img.width, len(img.getbands())), img.mode, img.format
+
+def load_image_region(source, box: tuple = None, max_size: int = None) -> np.ndarray:
+    """
+    Decodes part of an encoded image as an RGB NumPy array.
+
+    Args:
+        source: Path or binary file-like object holding the encoded image.
+        box: Optional (left, upper, right, lower) crop box.
+        max_size: Optional bound on width and height; uses Pillow's reduced
+            decoding (``draft``) so large JPEGs are never decoded in full.
+
+    Returns:
+        The decoded RGB pixels.
+    """
+    with Image.open(source) as img:
+        region = img
+        if max_size:
+            region.draft('RGB', (max_size, max_size))
+        if box:
+            region = region.crop(box)
+        region = region.convert('RGB')
+        if max_size:
+            region.thumbnail((max_size, max_size))
+        return np.asarray(region)
+
+@contextmanager
+def open_image_bands(image_path, band_bytes: int, native: bool = False):
+    """
+    Opens an image and exposes its pixel data as a sequence of row bands.
+
+    Only one band is converted to RGB and copied out at a time, so callers that
+    stream the bands never hold a second full-size copy of the image. With
+    ``native=True``, images in a ``NATIVE_LAYOUTS`` mode skip the conversion
+    and yield their own raw buffer instead. Formats a :class:`StripReader`
+    handles (uncompressed rasters, deflate or PackBits TIFF strips and tiles)
+    are never decoded in full: each band decodes only the strips it covers,
+    and bands are aligned to the file's strips where they fit.
+
+    Args:
+        image_path: The path to the image file, or a binary file-like object.
+        band_bytes: Target size in bytes of each band (at least one row).
+        native: Keep the image's own mode where possible.
+
+    Yields:
+        A tuple of (shape, original_mode, bands, attributes) where ``shape`` is
+        the array shape of the pixel data (see :func:`native_layout`),
+        ``bands`` is an iterator of bytes objects and ``attributes`` is
+        :func:`image_attributes` for native bands, or None for RGB bands.
+    """
+    with Image.open(image_path) as img:
+        reader = strip_reader(img)
+        if reader is None:
+            with stage('decode'):
+                img.load()
+        width, height = img.size
+        if native and img.mode in NATIVE_LAYOUTS:
+            shape, _, row_bytes = native_layout(img.mode, width, height)
+            attributes, rawmode = image_attributes(img), None
+        else:
+            shape, row_bytes = (height, width, 3), width * 3
+            attributes, rawmode = None, 'RGB'
+        rows = max(1, band_bytes // row_bytes)
+        if reader is not None and rows >= reader.strip_rows:
+            rows -= rows % reader.strip_rows
+
+        def bands():
+            for top in range(0, height, rows):
+                bottom = min(top + rows, height)
+                if reader is not None:
+                    with stage('decode'):
+                        band = reader.rows(top, bottom)
+                with stage('convert'):
+                    if reader is None:
+                        band = img.crop((0, top, width, bottom))
+                    band = (band.convert(rawmode) if rawmode else band).tobytes()
+                yield band
+
+        yield shape, img.mode, bands(), attributes
+
+def save_image(image_array: np.ndarray, output_path, original_mode: str, format: str = None):
     """
     Saves a NumPy array as an image file, converting it back to its original mode.
     
     Args:
         image_array: The NumPy array containing the image data.
-        output_path: The path to save the image file.
+        output_path: The path to save the image file, or a binary file object.
         original_mode: The original color mode of the image (e.g., 'RGB', 'L').
+        format: Image format (e.g. 'PNG'); required for file objects,
+            otherwise taken from the extension.
     """
     try:
-        # Check if the array needs to be reshaped for color or grayscale
-        if image_array.ndim == 3:
-            img = Image.fromarray(image_array.astype(np.uint8), 'RGB')
-        else:
-            img = Image.fromarray(image_array.astype(np.uint8), 'L')
-        
-        # Convert back to the original mode before saving
-        final_img = img.convert(original_mode)
-        final_img.save(output_path)
+        with stage('convert'):
+            # Check if the array needs to be reshaped for color or grayscale
+            if image_array.ndim == 3:
+                img = Image.fromarray(image_array.astype(np.uint8, copy=False), 'RGB')
+            else:
+                img = Image.fromarray(image_array.astype(np.uint8, copy=False), 'L')
+
+            # Convert back to the original mode before saving
+            final_img = img if img.mode == original_mode else img.convert(original_mode)
+        with stage('encode'):
+            final_img.save(output_path, format=format)
     except Exception as e:
+        error('save_image', e)
         print(f"Error saving image: {e}")
+
+def native_image(data, mode: str, size: tuple, attributes: dict = None) -> Image.Image:
+    """
+    Wraps a raw pixel buffer as a Pillow image in its own mode, with its palette.
+
+    The buffer is wrapped with ``Image.frombuffer`` rather than copied where
+    Pillow allows it (L, P, I, F, RGBA, CMYK, I;16, ...); the image is only
+    valid while ``data`` is.
+
+    Args:
+        data: Bytes-like raw buffer as produced by ``Image.tobytes()``.
+        mode: The image mode.
+        size: (width, height).
+        attributes: Output of :func:`image_attributes`.
+    """
+    img = Image.frombuffer(mode, size, data, 'raw', mode, 0, 1)
+    if attributes and 'palette' in attributes:
+        rawmode, palette = attributes['palette']
+        img.putpalette(palette, rawmode)
+    return img
+
+def save_native(data, output_path, mode: str, size: tuple, attributes: dict = None,
+                format: str = None):
+    """
+    Saves a raw pixel buffer in its own mode, restoring palette, transparency and ICC profile.
+
+    Args:
+        data: Bytes-like raw buffer as produced by ``Image.tobytes()``.
+        output_path: The path to save the image file, or a binary file object.
+        mode: The image mode.
+        size: (width, height).
+        attributes: Output of :func:`image_attributes`.
+        format: Image format; required for file objects (see :func:`save_image`).
+    """
+    attributes = attributes or {}
+    with stage('convert'):
+        img = native_image(data, mode, size, attributes)
+    params = {name: attributes[name] for name in ('transparency', 'icc_profile') if name in attributes}
+    with stage('encode'):
+        img.save(output_path, format=format, **params)
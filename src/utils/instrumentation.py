@@ -0,0 +1,391 @@
+"""
+Lightweight per-job instrumentation.
+
+Code marks its work with ``stage()`` and ``count()``. A ``job()`` gathers
+everything recorded on its thread while it runs into one record. When the job
+ends, that record is handed to the configured sinks:
+
+    {"job": "encrypt", "status": "ok", "seconds": 1.92,
+     "stages": {"kdf": 0.08, "decode": 0.61, "convert": 0.20, "cipher": 0.71, "write": 0.30},
+     "counters": {"source_bytes": 27000000}, "attrs": {"path": "photo.jpg"}}
+
+Stage times are exclusive: time spent in a nested stage is not counted
+again in its parent. For example, decoding that happens inside the
+streaming cipher loop counts as decode, not cipher. A stage entered outside
+any job is reported as a one-stage job of its own.
+
+Nothing is recorded until ``configure()`` installs at least one sink.
+Until then ``job()`` and ``stage()`` return a shared no-op context manager
+and ``count()`` returns at once, so instrumented code pays a global lookup
+per call.
+"""
+import contextlib
+import contextvars
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+METRICS_ENV = 'IMAGE_ENC_METRICS'        # e.g. "log,json:metrics.jsonl,prometheus:metrics.prom"
+PROFILE_ENV = 'IMAGE_ENC_PROFILE'        # "1" attaches a cProfile summary to every job
+TRACE_MEMORY_ENV = 'IMAGE_ENC_TRACE_MEMORY'  # "1" records the tracemalloc peak of every job
+
+logger = logging.getLogger(__name__)
+
+_sinks = ()
+_profile = False
+_trace_memory = False
+_current = contextvars.ContextVar('instrumentation_job', default=None)
+_NULL = contextlib.nullcontext()
+
+
+def configure(sinks, profile: bool = False, trace_memory: bool = False):
+    """
+    Turns instrumentation on (or off, with no sinks).
+
+    Args:
+        sinks: Objects with an ``emit(record)`` method, e.g. :class:`LogSink`,
+            :class:`JsonSink` or :class:`PrometheusSink`.
+        profile: Run every job under cProfile and attach the top functions.
+        trace_memory: Record every job's peak Python heap usage (tracemalloc).
+    """
+    global _sinks, _profile, _trace_memory
+    _sinks = tuple(sinks)
+    _profile = profile
+    _trace_memory = trace_memory
+    if trace_memory and _sinks:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def disable():
+    """Removes all sinks; instrumented code falls back to the no-op path."""
+    configure(())
+
+
+def enabled() -> bool:
+    return bool(_sinks)
+
+
+def sink_from_spec(spec: str):
+    """
+    Builds a sink from a short spec: ``log``, ``json:PATH`` or ``prometheus:PATH``.
+
+    Raises:
+        ValueError: If the spec is not recognised.
+    """
+    kind, _, path = spec.partition(':')
+    if kind == 'log' and not path:
+        return LogSink()
+    if kind == 'json' and path:
+        return JsonSink(path)
+    if kind == 'prometheus' and path:
+        return PrometheusSink(path)
+    raise ValueError(f"Unknown metrics sink: {spec!r} (expected log, json:PATH or prometheus:PATH)")
+
+
+def configure_from_env(environ=None) -> bool:
+    """
+    Configures instrumentation from ``$IMAGE_ENC_METRICS`` (comma-separated sink specs),
+    ``$IMAGE_ENC_PROFILE`` and ``$IMAGE_ENC_TRACE_MEMORY``.
+
+    Returns:
+        True if any sink was configured.
+    """
+    environ = os.environ if environ is None else environ
+    specs = [spec.strip() for spec in environ.get(METRICS_ENV, '').split(',') if spec.strip()]
+    if not specs:
+        return False
+    configure([sink_from_spec(spec) for spec in specs],
+              profile=environ.get(PROFILE_ENV) == '1',
+              trace_memory=environ.get(TRACE_MEMORY_ENV) == '1')
+    return True
+
+
+class _Job:
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.stages = {}
+        self.counters = {}
+        self.errors = []
+        self.stack = []
+        self._profiler = None
+
+    def add_time(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        if _trace_memory:
+            import tracemalloc
+            tracemalloc.reset_peak()
+        if _profile:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._timestamp = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        if self._profiler is not None:
+            self._profiler.disable()
+        _current.reset(self._token)
+        record = {
+            "job": self.name, "status": "ok" if exc is None else "error",
+            "timestamp": self._timestamp, "seconds": seconds,
+            "stages": self.stages, "counters": self.counters, "attrs": self.attrs,
+        }
+        if exc is not None:
+            self.errors.append(f"{type(exc).__name__}: {exc}")
+        if self.errors:
+            record["errors"] = self.errors
+        if _trace_memory:
+            import tracemalloc
+            record["memory_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        if self._profiler is not None:
+            record["profile"] = _profile_summary(self._profiler)
+        _emit(record)
+        return False
+
+
+class _Stage:
+    __slots__ = ('name', 'job', 'owned', 'nested', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.job = _current.get()
+        self.owned = None
+        if self.job is None:
+            self.job = self.owned = _Job(self.name, {}).__enter__()
+        self.nested = 0.0
+        self.job.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        stack = self.job.stack
+        stack.pop()
+        if stack:
+            stack[-1].nested += elapsed
+        self.job.add_time(self.name, elapsed - self.nested)
+        if self.owned is not None:
+            return self.owned.__exit__(exc_type, exc, tb)
+        return False
+
+
+def job(name: str, **attrs):
+    """
+    Context manager grouping the stages and counters of one unit of work.
+
+    A job started inside another job is recorded as a stage of the outer one.
+
+    Args:
+        name: Job kind, e.g. 'encrypt'.
+        **attrs: JSON-friendly details copied into the record (path, cipher, ...).
+    """
+    if not _sinks:
+        return _NULL
+    if _current.get() is not None:
+        return _Stage(name)
+    return _Job(name, attrs)
+
+
+def stage(name: str):
+    """Context manager timing one stage of the current job."""
+    if not _sinks:
+        return _NULL
+    return _Stage(name)
+
+
+def annotate(**attrs):
+    """Adds details to the current job's record, e.g. once a file header has been read."""
+    if not _sinks:
+        return
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def count(name: str, n: int = 1):
+    """Adds ``n`` to a counter of the current job; ignored outside a job."""
+    if not _sinks:
+        return
+    current = _current.get()
+    if current is not None:
+        current.counters[name] = current.counters.get(name, 0) + n
+
+
+def error(stage_name: str, exc: BaseException):
+    """Records an exception that was handled (not raised) in ``stage_name``."""
+    if not _sinks:
+        return
+    current = _current.get()
+    if current is None:
+        with job(stage_name):
+            error(stage_name, exc)
+        return
+    current.errors.append(f"{stage_name}: {type(exc).__name__}: {exc}")
+    current.counters["errors"] = current.counters.get("errors", 0) + 1
+
+
+class _TimedFile:
+    """File proxy timing reads and writes as 'read'/'write' stages."""
+
+    def __init__(self, f):
+        self._f = f
+
+    def read(self, *args):
+        with _Stage('read'):
+            return self._f.read(*args)
+
+    def readinto(self, buffer):
+        with _Stage('read'):
+            return self._f.readinto(buffer)
+
+    def write(self, data):
+        with _Stage('write'):
+            return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def timed_file(f):
+    """Returns ``f`` wrapped so its I/O is timed, or ``f`` itself while disabled."""
+    if not _sinks:
+        return f
+    return _TimedFile(f)
+
+
+def _profile_summary(profiler, limit: int = 25) -> str:
+    import pstats
+
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+def _emit(record: dict):
+    for sink in _sinks:
+        try:
+            sink.emit(record)
+        except Exception:
+            # Metrics must never fail the job they describe
+            logger.exception("Metrics sink %r failed", sink)
+
+
+class LogSink:
+    """
+    Logs one line per job, e.g. ``encrypt ok 1.920s kdf=0.080 decode=0.610 ...``.
+
+    Without a ``log`` and with logging unconfigured, lines go to stderr.
+    """
+
+    def __init__(self, log: logging.Logger = None, level: int = logging.INFO):
+        if log is None:
+            log = logger
+            if not log.handlers and not logging.getLogger().handlers:
+                log.addHandler(logging.StreamHandler())
+                log.setLevel(level)
+        self.log = log
+        self.level = level
+
+    def emit(self, record: dict):
+        stages = ' '.join(f"{name}={seconds:.3f}" for name, seconds in record["stages"].items())
+        counters = ' '.join(f"{name}={value}" for name, value in record["counters"].items())
+        if "memory_peak_bytes" in record:
+            counters += f" memory_peak_mb={record['memory_peak_bytes'] / 2**20:.1f}"
+        level = self.level if record["status"] == "ok" else logging.WARNING
+        self.log.log(level, "%s %s %.3fs %s %s %s", record["job"], record["status"], record["seconds"],
+                     stages, counters, ' '.join(f"{k}={v}" for k, v in record["attrs"].items()))
+        for message in record.get("errors", ()):
+            self.log.warning("%s error: %s", record["job"], message)
+        if "profile" in record:
+            self.log.log(level, "%s profile:\n%s", record["job"], record["profile"])
+
+
+class JsonSink:
+    """
+    Appends one JSON object per job to a file (JSON Lines).
+
+    Each record is written with a single append, so several processes can
+    share the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, record: dict):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+
+class PrometheusSink:
+    """
+    Keeps running totals and rewrites a Prometheus text-format file after every job.
+
+    The file suits node_exporter's textfile collector. Worker processes
+    forked from the configuring process (batch jobs) write their own
+    ``NAME.<pid>.prom`` file next to it, labelled with their pid.
+    """
+
+    def __init__(self, path: str, prefix: str = 'image_encryption'):
+        self.path = path
+        self.prefix = prefix
+        self._owner = self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._jobs = {}      # (job, status) -> count
+        self._seconds = {}   # job -> seconds
+        self._stages = {}    # (job, stage) -> seconds
+        self._counters = {}  # (job, counter) -> value
+
+    def emit(self, record: dict):
+        name = record["job"]
+        with self._lock:
+            if os.getpid() != self._pid:
+                # Forked worker: start from zero, keep our own file
+                self._pid = os.getpid()
+                self._jobs, self._seconds, self._stages, self._counters = {}, {}, {}, {}
+            key = (name, record["status"])
+            self._jobs[key] = self._jobs.get(key, 0) + 1
+            self._seconds[name] = self._seconds.get(name, 0.0) + record["seconds"]
+            for stage_name, seconds in record["stages"].items():
+                self._stages[(name, stage_name)] = self._stages.get((name, stage_name), 0.0) + seconds
+            for counter, value in record["counters"].items():
+                self._counters[(name, counter)] = self._counters.get((name, counter), 0) + value
+            self._write()
+
+    def _write(self):
+        path, pid = self.path, ''
+        if os.getpid() != self._owner:
+            base, ext = os.path.splitext(self.path)
+            path, pid = f"{base}.{os.getpid()}{ext or '.prom'}", f',pid="{os.getpid()}"'
+        p = self.prefix
+        lines = [f"# TYPE {p}_jobs_total counter"]
+        lines += [f'{p}_jobs_total{{job="{job_name}",status="{status}"{pid}}} {n}'
+                  for (job_name, status), n in sorted(self._jobs.items())]
+        lines.append(f"# TYPE {p}_job_seconds_total counter")
+        lines += [f'{p}_job_seconds_total{{job="{job_name}"{pid}}} {seconds:.6f}'
+                  for job_name, seconds in sorted(self._seconds.items())]
+        lines.append(f"# TYPE {p}_stage_seconds_total counter")
+        lines += [f'{p}_stage_seconds_total{{job="{job_name}",stage="{stage_name}"{pid}}} {seconds:.6f}'
+                  for (job_name, stage_name), seconds in sorted(self._stages.items())]
+        lines.append(f"# TYPE {p}_events_total counter")
+        lines += [f'{p}_events_total{{job="{job_name}",event="{counter}"{pid}}} {value}'
+                  for (job_name, counter), value in sorted(self._counters.items())]
+        # Write then rename so scrapers never see a half-written file
+        partial = f"{path}.{os.getpid()}.tmp"
+        with open(partial, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(partial, path)
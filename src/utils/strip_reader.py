@@ -0,0 +1,220 @@
+"""
+Band-by-band decoding of large images.
+
+Pillow decodes a whole image on ``load()``. When a format stores its pixels
+in independently decodable pieces -- uncompressed rasters (TIFF, BMP, PPM,
+...) and TIFF strips or tiles compressed with deflate or PackBits -- a
+:class:`StripReader` decodes only the pieces covering the requested rows, so
+a gigapixel image can be streamed with memory bounded by one band. Other
+formats (PNG, JPEG, LZW TIFF, ...) get no reader and must be decoded in full.
+"""
+import bisect
+import zlib
+
+import numpy as np
+from PIL import Image
+
+# TIFF tags
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+FILL_ORDER = 266
+STRIP_OFFSETS = 273
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+
+COMPRESSION_NONE = 1
+COMPRESSION_DEFLATE = (8, 32946)
+COMPRESSION_PACKBITS = 32773
+
+
+def _read(fp, offset: int, length: int) -> bytes:
+    fp.seek(offset)
+    data = fp.read(length)
+    if len(data) < length:
+        raise OSError("Image file is truncated.")
+    return data
+
+
+def _from_raw(mode: str, size: tuple, data: bytes, rawmode: str, stride: int = 0, orientation: int = 1):
+    # frombuffer maps rawmodes such as 'I;16B' as their own mode, so only share when they match
+    factory = Image.frombuffer if rawmode == mode else Image.frombytes
+    return factory(mode, size, data, 'raw', rawmode, stride, orientation)
+
+
+class _RawRows:
+    """Rows ``y0``..``y1 - 1`` stored uncompressed at ``offset``, ``stride`` bytes apart."""
+    def __init__(self, img, y0: int, y1: int, offset: int, rawmode: str, stride: int, orientation: int):
+        self.img, self.y0, self.y1 = img, y0, y1
+        self.offset, self.rawmode, self.stride, self.orientation = offset, rawmode, stride, orientation
+
+    def decode(self, top: int, bottom: int) -> Image.Image:
+        # Bottom-up rasters (BMP) store the last row first
+        first = top - self.y0 if self.orientation > 0 else self.y1 - bottom
+        data = _read(self.img.fp, self.offset + first * self.stride, (bottom - top) * self.stride)
+        return _from_raw(self.img.mode, (self.img.width, bottom - top), data,
+                         self.rawmode, self.stride, self.orientation)
+
+
+class _TiffRows:
+    """One TIFF strip, or one row of TIFF tiles, decoded whole and cropped as needed."""
+    def __init__(self, layout: '_TiffLayout', y0: int, y1: int, pieces: list):
+        self.layout, self.y0, self.y1, self.pieces = layout, y0, y1, pieces
+        self._decoded = None
+
+    def decode(self, top: int, bottom: int) -> Image.Image:
+        if self._decoded is None:
+            self._decoded = self.layout.decode(self)
+        if (top, bottom) == (self.y0, self.y1):
+            return self._decoded
+        return self._decoded.crop((0, top - self.y0, self._decoded.width, bottom - self.y0))
+
+    def release(self):
+        self._decoded = None
+
+
+class _TiffLayout:
+    def __init__(self, img, rawmode: str, compression: int, predictor: int, samples: int, piece_size: tuple):
+        self.img, self.rawmode, self.compression, self.predictor = img, rawmode, compression, predictor
+        self.samples = samples
+        self.piece_width, self.piece_height = piece_size
+
+    def _piece(self, offset: int, length: int, size: tuple) -> Image.Image:
+        data = _read(self.img.fp, offset, length)
+        if self.compression == COMPRESSION_PACKBITS:
+            return Image.frombytes(self.img.mode, size, data, 'packbits', self.rawmode)
+        if self.compression in COMPRESSION_DEFLATE:
+            data = zlib.decompress(data)
+        if self.predictor == 2:
+            # Horizontal differencing of 8-bit samples: a running sum per row and sample
+            width, height = size
+            rows = np.frombuffer(data, np.uint8, width * height * self.samples).reshape(height, width, self.samples)
+            data = np.cumsum(rows, axis=1, dtype=np.uint8).tobytes()
+        return _from_raw(self.img.mode, size, data, self.rawmode)
+
+    def decode(self, unit: _TiffRows) -> Image.Image:
+        height = unit.y1 - unit.y0
+        if self.piece_width == self.img.width:
+            offset, length = unit.pieces[0]
+            return self._piece(offset, length, (self.img.width, height))
+        band = Image.new(self.img.mode, (self.img.width, height))
+        for column, (offset, length) in enumerate(unit.pieces):
+            # Edge tiles are stored full size; paste clips them to the band
+            tile = self._piece(offset, length, (self.piece_width, self.piece_height))
+            band.paste(tile, (column * self.piece_width, 0))
+        return band
+
+
+class StripReader:
+    """
+    Decodes horizontal bands of an open image without decoding the rest of it.
+
+    Use :func:`strip_reader` to create one. The image must stay open while the
+    reader is used.
+
+    Attributes:
+        strip_rows: Row count of the file's own strips (or tile rows); bands
+            aligned to it decode every piece exactly once.
+    """
+    def __init__(self, img, units: list, strip_rows: int):
+        self._img = img
+        self._units = units
+        self._starts = [unit.y0 for unit in units]
+        self.strip_rows = strip_rows
+        self._palette = None
+        if img.mode in ('P', 'PA') and img.palette is not None:
+            self._palette = (img.palette.palette, img.palette.rawmode or img.palette.mode)
+
+    def rows(self, top: int, bottom: int) -> Image.Image:
+        """Returns rows ``top``..``bottom - 1`` as an image of the source's mode, with its palette."""
+        first = bisect.bisect_right(self._starts, top) - 1
+        pieces = []
+        for index in range(first, len(self._units)):
+            unit = self._units[index]
+            if unit.y0 >= bottom:
+                break
+            pieces.append((unit.y0, unit.decode(max(top, unit.y0), min(bottom, unit.y1))))
+            if unit.y1 <= bottom and hasattr(unit, 'release'):
+                unit.release()  # Fully consumed by this band
+        if len(pieces) == 1:
+            band = pieces[0][1]
+        else:
+            band = Image.new(self._img.mode, (self._img.width, bottom - top))
+            for y0, piece in pieces:
+                band.paste(piece, (0, max(0, y0 - top)))
+        if self._palette is not None:
+            band.putpalette(*self._palette)
+        return band
+
+
+def _raw_stride(mode: str, rawmode: str, width: int) -> int:
+    try:
+        return len(Image.new(mode, (width, 1)).tobytes('raw', rawmode))
+    except ValueError:
+        return 0
+
+
+def _raw_reader(img):
+    units = []
+    for tile in sorted(img.tile, key=lambda tile: tile.extents[1]):
+        args = tile.args if isinstance(tile.args, tuple) else (tile.args,)
+        rawmode, stride, orientation = (args + (0, 1))[:3]
+        x0, y0, x1, y1 = tile.extents
+        stride = stride or _raw_stride(img.mode, rawmode, img.width)
+        if not stride:
+            return None
+        units.append(_RawRows(img, y0, y1, tile.offset, rawmode, stride, orientation or 1))
+    return StripReader(img, units, units[0].y1 - units[0].y0)
+
+
+def _tiff_reader(img):
+    tags = img.tag_v2
+    compression = tags.get(COMPRESSION, COMPRESSION_NONE)
+    predictor = tags.get(PREDICTOR, 1)
+    bits = tags.get(BITS_PER_SAMPLE, (1,))
+    bits = bits if isinstance(bits, tuple) else (bits,)
+    if (compression not in (COMPRESSION_NONE, COMPRESSION_PACKBITS, *COMPRESSION_DEFLATE)
+            or tags.get(PLANAR_CONFIGURATION, 1) != 1 or tags.get(FILL_ORDER, 1) != 1
+            or predictor not in (1, 2)
+            or predictor == 2 and (set(bits) != {8} or compression == COMPRESSION_PACKBITS)):
+        return None
+
+    width, height = img.size
+    if TILE_OFFSETS in tags:
+        piece_size = (tags[TILE_WIDTH], tags[TILE_LENGTH])
+        offsets, counts = tags[TILE_OFFSETS], tags[TILE_BYTE_COUNTS]
+    else:
+        piece_size = (width, min(tags.get(ROWS_PER_STRIP, height), height))
+        offsets, counts = tags[STRIP_OFFSETS], tags[STRIP_BYTE_COUNTS]
+    offsets = offsets if isinstance(offsets, tuple) else (offsets,)
+    counts = counts if isinstance(counts, tuple) else (counts,)
+    across = -(-width // piece_size[0])
+    if len(offsets) != len(counts) or len(offsets) != across * -(-height // piece_size[1]):
+        return None
+
+    layout = _TiffLayout(img, img.tile[0].args[0], compression, predictor, len(bits), piece_size)
+    units = []
+    for row, y0 in enumerate(range(0, height, piece_size[1])):
+        pieces = list(zip(offsets[row * across:(row + 1) * across], counts[row * across:(row + 1) * across]))
+        units.append(_TiffRows(layout, y0, min(y0 + piece_size[1], height), pieces))
+    return StripReader(img, units, piece_size[1])
+
+
+def strip_reader(img):
+    """
+    Returns a :class:`StripReader` for an opened, not yet loaded image, or
+    None when its format can only be decoded in full.
+    """
+    if img.fp is None or not img.tile:
+        return None
+    if all(tile.codec_name == 'raw' and tile.extents[0] == 0 and tile.extents[2] == img.width
+           for tile in img.tile):
+        return _raw_reader(img)
+    if img.format == 'TIFF' and len(img.tile) == 1 and img.tile[0].codec_name == 'libtiff':
+        return _tiff_reader(img)
+    return None
@@ -0,0 +1,162 @@
+"""
+Streaming baseline TIFF writer.
+
+Pillow can only save an image it holds in full. :class:`TiffStripWriter`
+instead takes raw pixel rows as they arrive and writes them out strip by
+strip, keeping one strip in memory, and writes the directory at the end.
+Files whose raster may pass 4 GB are written as BigTIFF.
+"""
+import struct
+import zlib
+
+# Mode -> (bits per sample, photometric interpretation, extra samples, sample format)
+TIFF_LAYOUTS = {
+    '1': ((1,), 1, (), 1), 'L': ((8,), 1, (), 1), 'P': ((8,), 3, (), 1), 'LA': ((8, 8), 1, (2,), 1),
+    'RGB': ((8, 8, 8), 2, (), 1), 'RGBA': ((8, 8, 8, 8), 2, (2,), 1), 'CMYK': ((8, 8, 8, 8), 5, (), 1),
+    'I;16': ((16,), 1, (), 1), 'I;16L': ((16,), 1, (), 1), 'I': ((32,), 1, (), 2), 'F': ((32,), 1, (), 3),
+}
+STRIP_BYTES = 64 * 1024  # Default strip size, as Pillow uses
+
+SHORT, LONG, UNDEFINED, LONG8 = 3, 4, 7, 16
+_TYPE_FORMATS = {SHORT: 'H', LONG: 'I', UNDEFINED: 'B', LONG8: 'Q'}
+
+
+def tiff_supported(mode: str, attributes: dict = None) -> bool:
+    """Returns True if :class:`TiffStripWriter` can write ``mode`` with these attributes."""
+    if mode not in TIFF_LAYOUTS:
+        return False
+    return mode != 'P' or (attributes or {}).get('palette', (None,))[0] == 'RGB'
+
+
+class TiffStripWriter:
+    """
+    Writes an image to a little-endian TIFF as its rows arrive.
+
+    Rows must be passed in order as the raw buffer ``Image.tobytes()`` would
+    give for ``mode``, in pieces of any size; 'I' and 'F' rows must be
+    little-endian.
+
+    Args:
+        f: Binary file object opened for writing; left open.
+        mode: Image mode, one of ``TIFF_LAYOUTS``.
+        size: (width, height).
+        attributes: Optional ``image_attributes`` dict; its palette and ICC
+            profile are stored (a palette is required for 'P').
+        rows_per_strip: Rows per strip; defaults to about ``STRIP_BYTES``.
+        compression: None or 'deflate'.
+
+    Raises:
+        ValueError: On close, if fewer or more rows than ``size`` were written.
+    """
+    def __init__(self, f, mode: str, size: tuple, attributes: dict = None, rows_per_strip: int = None,
+                 compression: str = None):
+        if mode not in TIFF_LAYOUTS:
+            raise ValueError(f"Mode {mode} cannot be written as a streaming TIFF.")
+        if compression not in (None, 'deflate'):
+            raise ValueError(f"Unknown TIFF compression: {compression}")
+        self._f = f
+        self.mode = mode
+        self.width, self.height = size
+        self.attributes = attributes or {}
+        bits = TIFF_LAYOUTS[mode][0]
+        self.row_bytes = (self.width * sum(bits) + 7) // 8
+        self.rows_per_strip = max(1, min(rows_per_strip or STRIP_BYTES // max(1, self.row_bytes), self.height))
+        self.compression = compression
+        # Offsets are 32-bit in classic TIFF; leave headroom for the directory and deflate overhead
+        self.bigtiff = self.row_bytes * self.height > 0xFFFFFFFF - (1 << 26)
+        self._start = f.tell()
+        self._pending = bytearray()
+        self._strips = []
+        self._rows = 0
+        f.write(b'II+\x00\x08\x00\x00\x00' + bytes(8) if self.bigtiff else b'II*\x00' + bytes(4))
+
+    def write(self, data):
+        """Appends raw row bytes; whole strips are written as soon as they are complete."""
+        self._pending += data
+        strip_bytes = self.rows_per_strip * self.row_bytes
+        if len(self._pending) < strip_bytes:
+            return
+        view = memoryview(self._pending)
+        offset = 0
+        while len(view) - offset >= strip_bytes:
+            self._write_strip(view[offset:offset + strip_bytes])
+            offset += strip_bytes
+        view.release()
+        del self._pending[:offset]
+
+    def _write_strip(self, strip):
+        self._rows += len(strip) // self.row_bytes
+        if self._rows > self.height:
+            raise ValueError("More rows were written than the image height.")
+        if self.compression == 'deflate':
+            strip = zlib.compress(strip, 6)
+        self._strips.append((self._f.tell() - self._start, len(strip)))
+        self._f.write(strip)
+
+    def _entries(self) -> list:
+        bits, photometric, extra_samples, sample_format = TIFF_LAYOUTS[self.mode]
+        offset_type = LONG8 if self.bigtiff else LONG
+        entries = [
+            (256, LONG, [self.width]), (257, LONG, [self.height]), (258, SHORT, list(bits)),
+            (259, SHORT, [8 if self.compression else 1]), (262, SHORT, [photometric]),
+            (273, offset_type, [offset for offset, _ in self._strips]), (277, SHORT, [len(bits)]),
+            (278, LONG, [self.rows_per_strip]), (279, offset_type, [length for _, length in self._strips]),
+            (284, SHORT, [1]),
+        ]
+        if self.mode == 'P':
+            if 'palette' not in self.attributes:
+                raise ValueError("A 'P' image needs its palette.")
+            rawmode, palette = self.attributes['palette']
+            if rawmode != 'RGB':
+                raise ValueError(f"Palettes in {rawmode} cannot be written to TIFF.")
+            palette = bytes(palette[:768]).ljust(768, b'\x00')
+            # All reds, then all greens, then all blues, scaled to 16 bits
+            colormap = [palette[i + channel] * 257 for channel in range(3) for i in range(0, 768, 3)]
+            entries.append((320, SHORT, colormap))
+        if extra_samples:
+            entries.append((338, SHORT, list(extra_samples)))
+        if sample_format != 1:
+            entries.append((339, SHORT, [sample_format] * len(bits)))
+        if self.attributes.get('icc_profile'):
+            entries.append((34675, UNDEFINED, list(self.attributes['icc_profile'])))
+        return entries
+
+    def close(self):
+        """Writes the last strip and the image directory."""
+        if self._pending:
+            self._write_strip(bytes(self._pending))
+            self._pending.clear()
+        if self._rows != self.height:
+            raise ValueError(f"Got {self._rows} of {self.height} rows.")
+
+        entries = self._entries()
+        f, start = self._f, self._start
+        if f.tell() % 2:
+            f.write(b'\x00')  # Directories start on a word boundary
+        directory = f.tell() - start
+        count_format, entry_format, inline = ('<Q', '<HHQ', 8) if self.bigtiff else ('<H', '<HHI', 4)
+        entry_size = struct.calcsize(entry_format) + inline
+        value_start = directory + struct.calcsize(count_format) + len(entries) * entry_size + inline
+        table, values = [struct.pack(count_format, len(entries))], []
+        for tag, kind, items in entries:
+            data = struct.pack(f'<{len(items)}{_TYPE_FORMATS[kind]}', *items)
+            if len(data) <= inline:
+                field = data.ljust(inline, b'\x00')
+            else:
+                field = struct.pack('<Q' if self.bigtiff else '<I', value_start + sum(len(v) for v in values))
+                values.append(data + b'\x00' * (len(data) % 2))
+            table.append(struct.pack(entry_format, tag, kind, len(items)) + field)
+        table.append(bytes(inline))  # No further directories
+        f.write(b''.join(table) + b''.join(values))
+
+        end = f.tell()
+        f.seek(start + (8 if self.bigtiff else 4))
+        f.write(struct.pack('<Q' if self.bigtiff else '<I', directory))
+        f.seek(end)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
@@ -0,0 +1,55 @@
+"""
+Recovery of an archive whose writer died before committing its index.
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from encryption.archive import Archive  # noqa: E402
+
+
+class ArchiveRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.image = os.path.join(self._tmp.name, 'image.png')
+        Image.new('RGB', (8, 8), 'green').save(self.image)
+        self.path = os.path.join(self._tmp.name, 'images.encpack')
+        self.key, self.salt = os.urandom(32), os.urandom(16)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _crash(self, archive: Archive):
+        archive._f.close()  # Dies without writing the index and trailer
+
+    def test_removed_images_stay_removed_after_a_crash(self):
+        with Archive(self.path, 'a') as archive:
+            for name in ('a.png', 'b.png'):
+                archive.add(name, self.image, self.key, self.salt)
+        archive = Archive(self.path, 'a')
+        archive.remove('a.png')
+        archive.add('c.png', self.image, self.key, self.salt)
+        self._crash(archive)
+
+        with Archive(self.path) as archive:
+            self.assertEqual(list(archive), ['b.png', 'c.png'])
+
+    def test_image_added_back_after_removal_is_kept(self):
+        archive = Archive(self.path, 'a')
+        archive.add('a.png', self.image, self.key, self.salt)
+        archive.remove('a.png')
+        archive.add('a.png', self.image, self.key, self.salt)
+        self._crash(archive)
+
+        with Archive(self.path) as archive:
+            self.assertEqual(list(archive), ['a.png'])
+            self.assertEqual(archive.header('a.png').shape[:2], (8, 8))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+Round trips of stacks through encrypt_stack and extract_stack.
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from encryption.stack import encrypt_stack, extract_stack  # noqa: E402
+
+
+class StackRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.key, self.salt = os.urandom(32), os.urandom(16)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _round_trip(self, mode: str, frames: list[np.ndarray], suffix: str) -> list[Image.Image]:
+        paths = []
+        for index, frame in enumerate(frames):
+            path = os.path.join(self.tmp, f"frame_{index}{suffix}")
+            height, width = frame.shape[:2]
+            Image.frombytes(mode, (width, height), frame.tobytes()).save(path)
+            paths.append(path)
+        stack = os.path.join(self.tmp, 'stack.enc')
+        encrypt_stack(paths, stack, self.key, self.salt, verbose=False)
+        outputs = extract_stack(stack, os.path.join(self.tmp, 'out'), key=self.key)
+        images = [Image.open(output) for output in outputs]
+        for image in images:
+            image.load()
+        return images
+
+    def test_i16b_keeps_its_byte_order(self):
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 1 << 16, (5, 7), dtype=np.uint16).astype('>u2') for _ in range(3)]
+        images = self._round_trip('I;16B', frames, '.tiff')
+        for frame, image in zip(frames, images):
+            self.assertEqual(image.mode, 'I;16B')
+            self.assertEqual(image.tobytes(), frame.tobytes())
+
+    def test_rgb(self):
+        rng = np.random.default_rng(1)
+        frames = [rng.integers(0, 256, (4, 6, 3), dtype=np.uint8) for _ in range(2)]
+        images = self._round_trip('RGB', frames, '.png')
+        for frame, image in zip(frames, images):
+            np.testing.assert_array_equal(np.asarray(image), frame)
+
+
+if __name__ == '__main__':
+    unittest.main()
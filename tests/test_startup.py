@@ -0,0 +1,25 @@
+"""
+Startup-time budget of the headless CLI (see benchmarks/startup_budget.py).
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from startup_budget import COMMANDS, FORBIDDEN, LAZY, measure  # noqa: E402
+
+BUDGET_MS = 100
+
+
+class StartupBudgetTest(unittest.TestCase):
+    def test_commands_import_no_heavy_modules_and_stay_in_budget(self):
+        for command in COMMANDS:
+            with self.subTest(command=' '.join(command)):
+                total_ms, packages = measure(command, runs=5)
+                self.assertEqual(sorted(set(FORBIDDEN + LAZY) & packages), [])
+                self.assertLessEqual(total_ms, BUDGET_MS)
+
+
+if __name__ == '__main__':
+    unittest.main()